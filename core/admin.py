@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import Novel, Volume, Chapter, Glossary, Segment, APIKey
+from .models import (
+    Novel, Volume, Chapter, Glossary, Segment, APIKey, GlossaryRun, GlossaryBatch, TranslationCascadeStats,
+    TranslationBatch, LLMCallLog,
+)
+from .utils.usage_stats import today_start, usage_annotations
 
 
 @admin.register(Novel)
@@ -26,6 +30,76 @@ class SegmentAdmin(admin.ModelAdmin):
 class GlossaryAdmin(admin.ModelAdmin):
     list_display = ('novel', 'term_cn', 'term_vi')
 
+class GlossaryBatchInline(admin.TabularInline):
+    model = GlossaryBatch
+    extra = 0
+    readonly_fields = (
+        'index', 'start_ordinal', 'end_ordinal', 'chapter_count', 'status', 'new_terms',
+        'prompt_tokens', 'output_tokens', 'started_at', 'finished_at', 'duration_seconds', 'error',
+    )
+
+@admin.register(GlossaryRun)
+class GlossaryRunAdmin(admin.ModelAdmin):
+    list_display = ('novel', 'status', 'start_ordinal', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    inlines = [GlossaryBatchInline]
+
 @admin.register(APIKey)
 class APIKeyAdmin(admin.ModelAdmin):
-    list_display = ('name', 'created_at')
\ No newline at end of file
+    """Key kèm tổng usage (LLMCallLog) và mức dùng quota hôm nay"""
+    list_display = ('name', 'provider', 'is_active', 'calls', 'prompt_tokens', 'output_tokens', 'cost_usd', 'calls_today', 'quota_used', 'last_used', 'created_at')
+    list_filter = ('provider', 'is_active')
+    readonly_fields = ('usage_count', 'last_used')
+
+    def get_queryset(self, request):
+        totals = usage_annotations('call_logs__')
+        today = {
+            f'{name}_today': expression
+            for name, expression in usage_annotations('call_logs__', created_at__gte=today_start()).items()
+        }
+        return super().get_queryset(request).annotate(**totals, **today)
+
+    @admin.display(description='Calls', ordering='calls')
+    def calls(self, obj):
+        return obj.calls
+
+    @admin.display(description='Prompt tokens', ordering='prompt_tokens')
+    def prompt_tokens(self, obj):
+        return f"{obj.prompt_tokens:,}"
+
+    @admin.display(description='Output tokens', ordering='output_tokens')
+    def output_tokens(self, obj):
+        return f"{obj.output_tokens:,}"
+
+    @admin.display(description='Chi phí (USD)', ordering='cost')
+    def cost_usd(self, obj):
+        return f"{obj.cost:.4f}"
+
+    @admin.display(description='Calls hôm nay', ordering='calls_today')
+    def calls_today(self, obj):
+        return obj.calls_today
+
+    @admin.display(description='Quota hôm nay')
+    def quota_used(self, obj):
+        if not obj.daily_request_limit:
+            return '-'
+        return f"{obj.calls_today / obj.daily_request_limit:.0%} / {obj.daily_request_limit}"
+
+@admin.register(TranslationCascadeStats)
+class TranslationCascadeStatsAdmin(admin.ModelAdmin):
+    list_display = ('novel', 'translations', 'escalated', 'escalation_rate', 'saved_seconds', 'saved_cost', 'updated_at')
+    readonly_fields = [field.name for field in TranslationCascadeStats._meta.fields]
+
+@admin.register(TranslationBatch)
+class TranslationBatchAdmin(admin.ModelAdmin):
+    list_display = ('id', 'novel', 'provider', 'model', 'status', 'request_count', 'translated_count', 'failed_count', 'created_at', 'completed_at')
+    list_filter = ('status', 'provider')
+    readonly_fields = [field.name for field in TranslationBatch._meta.fields]
+
+@admin.register(LLMCallLog)
+class LLMCallLogAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_at', 'operation', 'provider', 'model', 'api_key', 'prompt_tokens', 'output_tokens', 'cached_tokens', 'cost', 'latency', 'retries', 'outcome')
+    list_filter = ('operation', 'provider', 'outcome')
+    list_select_related = ('api_key',)
+    raw_id_fields = ('novel', 'chapter', 'segment')
+    readonly_fields = [field.name for field in LLMCallLog._meta.fields]
@@ -0,0 +1,308 @@
+"""
+Đo hiệu năng các thao tác xử lý văn bản so với cài đặt cũ
+Usage: python manage.py benchmark foreign_chars [--chapter-id 1] [--repeat 20]
+       python manage.py benchmark segmenter [--chars 1000000] [--repeat 5]
+       python manage.py benchmark llm --fake [--requests 50] [--concurrency 8] [--chars 3000]
+"""
+import random
+import re
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Chapter
+from core.utils.foreign_char_detector import ForeignCharDetector
+from core.utils.segment_processor import SegmentProcessor
+
+
+# ==================== CÀI ĐẶT CŨ (để so sánh) ====================
+
+def _legacy_detect(text: str) -> dict:
+    """ForeignCharDetector.detect trước khi chuyển sang quét một lượt"""
+    d = ForeignCharDetector
+    chinese = list(set(re.findall(d.CHINESE_PATTERN, text)))
+    korean = list(set(re.findall(d.KOREAN_PATTERN, text)))
+    japanese = list(set(re.findall(d.JAPANESE_PATTERN, text)))
+    thai = list(set(re.findall(d.THAI_PATTERN, text)))
+    return {
+        'chinese_count': len(chinese),
+        'korean_count': len(korean),
+        'japanese_count': len(japanese),
+        'thai_count': len(thai),
+        'all_chars': chinese + korean + japanese + thai,
+    }
+
+
+def _legacy_highlight(text: str) -> str:
+    d = ForeignCharDetector
+    for _key, pattern, _flag, _label, style in d.LANGUAGES:
+        text = re.sub(pattern, rf'<mark style="{style}">\g<0></mark>', text)
+    return text
+
+
+def _legacy_detect_and_highlight(text: str):
+    return _legacy_detect(text), _legacy_highlight(text)
+
+
+def _detect_and_highlight(text: str):
+    spans = ForeignCharDetector.scan(text)
+    return ForeignCharDetector.detect(text, spans), ForeignCharDetector.highlight_html(text, spans)
+
+
+def _legacy_count_words(text: str) -> int:
+    chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text))
+    other_words = len(re.findall(r'\b\w+\b', text))
+    return chinese_chars + other_words
+
+
+def _legacy_split_by_sentences(text: str) -> list:
+    sentences = re.split(r'([。！？\.!?]+[\s]*)', text)
+    result = []
+    for i in range(0, len(sentences)-1, 2):
+        if i+1 < len(sentences):
+            result.append(sentences[i] + sentences[i+1])
+        else:
+            result.append(sentences[i])
+    if sentences and not result:
+        result = [text]
+    return [s.strip() for s in result if s.strip()]
+
+
+def _legacy_segments(text: str, max_words: int = 3000) -> list:
+    """SegmentProcessor.create_segments trước khi chuyển sang segmenter một lượt (không ghi DB)"""
+    segments = []
+    current_segment = []
+    current_word_count = 0
+    for sentence in _legacy_split_by_sentences(text):
+        sentence_words = _legacy_count_words(sentence)
+        if sentence_words > max_words:
+            if current_segment:
+                segments.append('\n'.join(current_segment))
+                current_segment = []
+                current_word_count = 0
+            segments.append(sentence)
+            continue
+        if current_word_count + sentence_words > max_words and current_segment:
+            segments.append('\n'.join(current_segment))
+            current_segment = [sentence]
+            current_word_count = sentence_words
+        else:
+            current_segment.append(sentence)
+            current_word_count += sentence_words
+    if current_segment:
+        segments.append('\n'.join(current_segment))
+    return segments
+
+
+def _segments(text: str) -> list:
+    return list(SegmentProcessor.iter_segments(text, SegmentProcessor.DEFAULT_SEGMENT_TOKENS))
+
+
+# ==================== DỮ LIỆU MẪU ====================
+
+SAMPLE_SENTENCES = [
+    'Lý Minh Hiên đứng trước cổng Thiên Nguyên Thành, ánh mắt trầm tĩnh nhìn về phía xa.',
+    'Hắn khẽ thở dài, trong lòng dâng lên một cảm giác khó tả.',
+    '"Ngươi thật sự muốn đi sao?" Tiểu Vũ hỏi, giọng nói mang theo chút lo lắng.',
+    'Gió lạnh thổi qua, cuốn theo những chiếc lá vàng rơi lả tả trên con đường lát đá.',
+]
+SAMPLE_FOREIGN = ['天元', '剑圣', '사랑', 'の', 'カタ', 'ไทย']
+
+
+SAMPLE_SOURCE_SENTENCES = [
+    '李明轩站在天元城门前，目光平静地望向远方。',
+    '他轻轻叹了口气，心中涌起一股难以言喻的感觉。',
+    '“你真的要走吗？”小雨问道，声音里带着一丝担忧。',
+    '冷风吹过，卷起片片黄叶，洒落在石板路上。',
+]
+
+
+def sample_source(chars: int = 1000000, seed: int = 42) -> str:
+    """Nguyên văn tiếng Trung, mỗi đoạn 3-6 câu"""
+    rng = random.Random(seed)
+    paragraphs = []
+    length = 0
+    while length < chars:
+        paragraph = ''.join(rng.choice(SAMPLE_SOURCE_SENTENCES) for _ in range(rng.randint(3, 6)))
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return '\n\n'.join(paragraphs)
+
+
+def sample_translation(chars: int = 12000, foreign_ratio: float = 0.02, seed: int = 42) -> str:
+    """Bản dịch tiếng Việt cỡ một chapter, lẫn một ít ký tự ngoại ngữ"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < chars:
+        sentence = rng.choice(SAMPLE_SENTENCES)
+        if rng.random() < foreign_ratio * 20:
+            words = sentence.split(' ')
+            words.insert(rng.randrange(len(words)), rng.choice(SAMPLE_FOREIGN))
+            sentence = ' '.join(words)
+        parts.append(sentence)
+        length += len(sentence) + 1
+    return ' '.join(parts)
+
+
+class Command(BaseCommand):
+    help = 'So sánh hiệu năng cài đặt mới với cài đặt cũ trên văn bản cỡ chapter'
+
+    TARGETS = ('foreign_chars', 'segmenter', 'llm')
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=self.TARGETS, help='Thao tác cần đo')
+        parser.add_argument(
+            '--chapter-id',
+            type=int,
+            default=None,
+            help='Dùng bản dịch của chapter có sẵn thay vì văn bản mẫu'
+        )
+        parser.add_argument(
+            '--chars',
+            type=int,
+            default=None,
+            help='Độ dài văn bản mẫu (default: 12000 ký tự, segmenter: 1000000 ký tự)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Số lần chạy mỗi cài đặt (default: 20)'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=50,
+            help='llm: số request dịch (default: 50)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='llm: số request song song (default: 8)'
+        )
+        parser.add_argument(
+            '--fake',
+            action='store_true',
+            help='llm: dùng LLM giả lập trong process (settings.LLM_FAKE, mặc định nếu chưa cấu hình)'
+        )
+
+    def handle(self, *args, **options):
+        getattr(self, f"bench_{options['target']}")(options)
+
+    def _time(self, label: str, func, text: str, repeat: int) -> float:
+        elapsed = min(timeit.repeat(lambda: func(text), number=1, repeat=repeat))
+        self.stdout.write(f'   {label:<28} {elapsed * 1000:8.2f} ms')
+        return elapsed
+
+    def _compare(self, label: str, legacy, current, text: str, repeat: int):
+        self.stdout.write(f'\n⏱️ {label}')
+        old = self._time('cũ', legacy, text, repeat)
+        new = self._time('mới', current, text, repeat)
+        self.stdout.write(self.style.SUCCESS(f'   → nhanh hơn {old / new:.1f}x'))
+
+    def _get_text(self, options) -> str:
+        if options['chapter_id'] is None:
+            return sample_translation(options['chars'] or 12000)
+        try:
+            chapter = Chapter.objects.get(pk=options['chapter_id'])
+        except Chapter.DoesNotExist:
+            raise CommandError(f"Chapter với ID {options['chapter_id']} không tồn tại")
+        text = chapter.full_translation
+        if not text:
+            raise CommandError('Chapter chưa có bản dịch')
+        return text
+
+    def bench_foreign_chars(self, options):
+        text = self._get_text(options)
+        repeat = options['repeat']
+        self.stdout.write(f'📄 Văn bản: {len(text):,} ký tự')
+
+        # Kết quả phải giống cài đặt cũ (bỏ qua thứ tự ký tự)
+        legacy = _legacy_detect(text)
+        current = ForeignCharDetector.detect(text)
+        for key in ('chinese_count', 'korean_count', 'japanese_count', 'thai_count'):
+            if legacy[key] != current[key]:
+                raise CommandError(f'Kết quả khác nhau ở {key}: {legacy[key]} != {current[key]}')
+        if sorted(legacy['all_chars']) != sorted(current['all_chars']):
+            raise CommandError('Kết quả khác nhau ở all_chars')
+        self.stdout.write(f"   Ký tự ngoại ngữ: {current['total_count']} ({current['severity']})")
+
+        self._compare('detect', _legacy_detect, ForeignCharDetector.detect, text, repeat)
+        self._compare('highlight_html', _legacy_highlight, ForeignCharDetector.highlight_html, text, repeat)
+        self._compare('detect + highlight_html', _legacy_detect_and_highlight, _detect_and_highlight, text, repeat)
+        self._compare(
+            'should_warn',
+            lambda t: sum(len(set(re.findall(p, t))) for _k, p, *_ in ForeignCharDetector.LANGUAGES) >= 3,
+            ForeignCharDetector.should_warn,
+            text,
+            repeat
+        )
+
+    def bench_segmenter(self, options):
+        if options['chapter_id'] is None:
+            text = sample_source(options['chars'] or 1000000)
+        else:
+            try:
+                text = Chapter.objects.get(pk=options['chapter_id']).content_raw or ''
+            except Chapter.DoesNotExist:
+                raise CommandError(f"Chapter với ID {options['chapter_id']} không tồn tại")
+        repeat = options['repeat']
+        self.stdout.write(f'📄 Văn bản: {len(text):,} ký tự')
+
+        legacy = _legacy_segments(text)
+        current = _segments(text)
+        self.stdout.write(f'   Segments: cũ {len(legacy)}, mới {len(current)}')
+        # Bản mới cắt trên văn bản gốc nên phải giữ nguyên toàn bộ ký tự (trừ khoảng trắng)
+        if re.sub(r'\s+', '', ''.join(current)) != re.sub(r'\s+', '', text):
+            raise CommandError('Segments mới không giữ nguyên nội dung gốc')
+
+        self._compare('count_words', _legacy_count_words, SegmentProcessor.count_words, text, repeat)
+        self._compare('split_by_sentences', _legacy_split_by_sentences, SegmentProcessor.split_by_sentences, text, repeat)
+        self._compare('chia segments', _legacy_segments, _segments, text, repeat)
+
+    def bench_llm(self, options):
+        """Throughput/độ trễ của translate_segment qua router (LLM giả lập hoặc stub server)"""
+        from django.conf import settings
+        from core.utils.ai_client import translate_segment
+        from core.utils.llm_router import get_router
+
+        if options['fake'] and getattr(settings, 'LLM_FAKE', None) is None:
+            settings.LLM_FAKE = {}
+        source = sample_source(options['chars'] or 3000)
+        total = options['requests']
+
+        latencies = []
+        failures = []
+
+        def run(index):
+            started = time.monotonic()
+            try:
+                translate_segment(f"第{index}章\n{source}")
+            except Exception as e:
+                failures.append(str(e))
+                return
+            latencies.append(time.monotonic() - started)
+
+        self.stdout.write(f"🌐 {total} request dịch ({len(source):,} ký tự), {options['concurrency']} song song")
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(run, range(total)))
+        elapsed = time.monotonic() - started
+
+        latencies.sort()
+        self.stdout.write(self.style.SUCCESS(f'   Hoàn tất sau {elapsed:.2f}s → {len(latencies) / elapsed:.2f} request/s'))
+        if latencies:
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(f'   Độ trễ: p50 {p50:.2f}s, p95 {p95:.2f}s, max {latencies[-1]:.2f}s')
+        if failures:
+            self.stdout.write(self.style.ERROR(f'   Thất bại: {len(failures)} (VD: {failures[0]})'))
+
+        router = get_router()
+        for name in router.providers:
+            stats = router.stats(name, 'translate')
+            latency = f"{stats['latency']:.2f}s/1k token" if stats['latency'] is not None else '-'
+            self.stdout.write(f"   {name}: {stats['calls']} lần gọi, độ trễ {latency}, tỉ lệ lỗi {stats['errors']:.0%}")
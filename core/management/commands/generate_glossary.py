@@ -25,8 +25,29 @@ class Command(BaseCommand):
         parser.add_argument(
             '--batch-size',
             type=int,
-            default=20000,
-            help='Số từ tối đa mỗi batch (default: 20000)'
+            default=GlossaryGenerator.MAX_TOKENS_PER_BATCH,
+            help=f'Số token ước lượng tối đa mỗi batch (default: {GlossaryGenerator.MAX_TOKENS_PER_BATCH})'
+        )
+        parser.add_argument(
+            '--parallel',
+            action='store_true',
+            help='Gửi nhiều batch song song (gộp kết quả theo thứ tự chapter)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Số request song song tối đa (default: settings.GLOSSARY_PARALLEL_WORKERS)'
+        )
+        parser.add_argument(
+            '--mine',
+            action='store_true',
+            help='Khai phá thuật ngữ ứng viên cục bộ (NumPy), chỉ gửi ứng viên + ngữ cảnh cho AI'
+        )
+        parser.add_argument(
+            '--reconcile',
+            action='store_true',
+            help='Chạy thêm bước chọn bản dịch cho các terms bị xung đột'
         )
 
     def handle(self, *args, **options):
@@ -42,7 +63,20 @@ class Command(BaseCommand):
         
         # Khởi tạo generator
         generator = GlossaryGenerator(novel)
-        generator.MAX_WORDS_PER_BATCH = options['batch_size']
+        generator.MAX_TOKENS_PER_BATCH = options['batch_size']
+        
+        if options['mine']:
+            try:
+                summary = generator.generate_from_candidates()
+            except Exception as e:
+                raise CommandError(f'Lỗi khi tạo glossary: {str(e)}')
+            
+            self.stdout.write(self.style.SUCCESS('\n🎉 Hoàn tất!'))
+            self.stdout.write(f'   - Ứng viên: {summary["candidates"]}')
+            self.stdout.write(f'   - Prompt: {summary["prompt_chars"]:,} / {summary["source_chars"]:,} ký tự gốc')
+            self.stdout.write(f'   - Terms mới: {summary["new_terms"]}')
+            self.stdout.write(f'   - Tổng terms: {summary["total_terms"]}')
+            return
         
         if from_checkpoint:
             checkpoint = generator.get_checkpoint()
@@ -52,13 +86,19 @@ class Command(BaseCommand):
         
         # Chạy generation
         try:
-            summary = generator.generate(start_from_checkpoint=from_checkpoint)
+            summary = generator.generate(
+                start_from_checkpoint=from_checkpoint,
+                parallel=options['parallel'],
+                max_workers=options['workers'],
+                reconcile=options['reconcile']
+            )
             
             self.stdout.write(self.style.SUCCESS('\n🎉 Hoàn tất!'))
             self.stdout.write(f'📊 Tổng kết:')
             self.stdout.write(f'   - Batches: {summary["total_batches"]}')
             self.stdout.write(f'   - Chapters: {summary["processed_chapters"]}')
             self.stdout.write(f'   - Terms mới: {summary["new_terms"]}')
+            self.stdout.write(f'   - Xung đột: {summary["conflicts"]} (đã reconcile: {summary["reconciled"]})')
             self.stdout.write(f'   - Tổng terms: {summary["total_terms"]}')
             self.stdout.write(f'   - Checkpoint: {summary["checkpoint"]}')
             
@@ -0,0 +1,209 @@
+"""
+Server LLM giả lập tương thích OpenAI (/v1/chat/completions, /v1/models) và Anthropic (/v1/messages)
+để benchmark/load test provider OpenAI-compatible/Anthropic không cần API key
+Usage: python manage.py llm_stub_server --port 8001
+       python manage.py llm_stub_server --error-rate 0.05 --rate-limit-every 50 --rate-limit-burst 5
+
+Trỏ provider vào stub trong settings.LLM_PROVIDERS:
+    'openai': {'base_url': 'http://127.0.0.1:8001/v1', ...}
+    'anthropic': {'base_url': 'http://127.0.0.1:8001', ...}
+"""
+import hashlib
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.utils.fake_llm import FakeLLM, FakeLLMError
+from core.utils.tokens import estimate_tokens
+
+
+def _openai_message(body: dict) -> str:
+    """Nội dung text của các message (content dạng chuỗi hoặc list các phần text)"""
+    parts = []
+    for message in body.get('messages', []):
+        content = message.get('content', '')
+        if isinstance(content, list):
+            content = ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+        parts.append(content)
+    return '\n'.join(parts)
+
+
+def _cache_control_blocks(body: dict) -> list:
+    """Các phần text có cache_control (Anthropic prompt caching)"""
+    return [
+        part.get('text', '')
+        for message in body.get('messages', []) if isinstance(message.get('content'), list)
+        for part in message['content'] if isinstance(part, dict) and part.get('cache_control')
+    ]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    fake: FakeLLM = None
+    cached_prefixes: set = None  # Hash các phần đã được cache_control (Anthropic)
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # Không in mỗi request (làm chậm load test)
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, error: FakeLLMError):
+        headers = {'Retry-After': str(error.retry_after)} if error.retry_after else None
+        self._send_json(error.code, {'error': {'code': error.code, 'type': error.status, 'message': str(error)}}, headers)
+
+    def _read_body(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/models':
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'fake', 'object': 'model'}]})
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        try:
+            body = self._read_body()
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON'}})
+            return
+
+        try:
+            if path == '/v1/chat/completions':
+                if body.get('stream'):
+                    self._chat_stream(body)
+                else:
+                    self._chat(body)
+            elif path == '/v1/messages':
+                self._messages(body)
+            else:
+                self._send_json(404, {'error': {'message': 'Not found'}})
+        except FakeLLMError as e:
+            self._send_error(e)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _chat(self, body: dict):
+        text, usage = self.fake.generate(_openai_message(body))
+        self._send_json(200, {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': usage['prompt_tokens'],
+                'completion_tokens': usage['output_tokens'],
+                'total_tokens': usage['prompt_tokens'] + usage['output_tokens'],
+            },
+        })
+
+    def _chat_stream(self, body: dict):
+        chunks = self.fake.stream(_openai_message(body))
+        # Lỗi (429/503) được raise ở đoạn đầu tiên, trước khi gửi header 200
+        first = next(chunks, '')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        for chunk in [first, *chunks]:
+            payload = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': body.get('model', 'fake'),
+                'choices': [{'index': 0, 'delta': {'content': chunk}, 'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.close_connection = True
+
+    def _messages(self, body: dict):
+        # Phần cache_control đã gặp -> đọc từ cache, lần đầu -> ghi cache
+        cache_read = cache_creation = 0
+        for block in _cache_control_blocks(body):
+            digest = hashlib.sha1(block.encode('utf-8')).hexdigest()
+            if digest in self.cached_prefixes:
+                cache_read += estimate_tokens(block)
+            else:
+                self.cached_prefixes.add(digest)
+                cache_creation += estimate_tokens(block)
+        text, usage = self.fake.generate(_openai_message(body), cached_tokens=cache_read)
+        self._send_json(200, {
+            'id': f'msg_{uuid.uuid4().hex}',
+            'type': 'message',
+            'role': 'assistant',
+            'model': body.get('model', 'fake'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'usage': {
+                'input_tokens': usage['prompt_tokens'] - cache_read - cache_creation,
+                'cache_read_input_tokens': cache_read,
+                'cache_creation_input_tokens': cache_creation,
+                'output_tokens': usage['output_tokens'],
+            },
+        })
+
+
+class Command(BaseCommand):
+    help = 'Chạy server LLM giả lập (OpenAI/Anthropic-compatible) để benchmark không cần API key'
+
+    # Tham số dòng lệnh ghi đè settings.LLM_FAKE
+    OVERRIDES = (
+        ('latency_median', float, 'Giây, trung vị độ trễ'),
+        ('latency_sigma', float, 'Độ lệch log-normal của độ trễ'),
+        ('seconds_per_1k_output', float, 'Giây sinh mỗi 1000 token output'),
+        ('error_rate', float, 'Tỉ lệ lỗi 503'),
+        ('rate_limit_every', int, 'Mỗi N request bắt đầu một đợt 429'),
+        ('rate_limit_burst', int, 'Số request bị 429 mỗi đợt'),
+        ('output_ratio', float, 'Token output / token bản gốc'),
+        ('time_scale', float, 'Nhân mọi thời gian chờ (0 = không chờ)'),
+        ('seed', int, 'Seed ngẫu nhiên'),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Địa chỉ lắng nghe (default: 127.0.0.1)')
+        parser.add_argument('--port', type=int, default=8001, help='Cổng (default: 8001)')
+        for name, type_, help_text in self.OVERRIDES:
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=type_, default=None, help=help_text)
+
+    def handle(self, *args, **options):
+        config = dict(getattr(settings, 'LLM_FAKE', None) or {})
+        for name, _type, _help in self.OVERRIDES:
+            if options[name] is not None:
+                config[name] = options[name]
+
+        fake = FakeLLM(config)
+        handler = type('Handler', (StubHandler,), {'fake': fake, 'cached_prefixes': set()})
+        server = ThreadingHTTPServer((options['host'], options['port']), handler)
+        server.daemon_threads = True
+
+        base = f"http://{options['host']}:{options['port']}"
+        self.stdout.write(self.style.SUCCESS(f'🧪 LLM stub server: {base}'))
+        self.stdout.write(f"   OpenAI-compatible: {base}/v1  |  Anthropic: {base}")
+        self.stdout.write('   ' + ', '.join(f'{key}={value}' for key, value in fake.config.items()))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write('\n👋 Dừng server')
+        finally:
+            server.server_close()
@@ -0,0 +1,72 @@
+"""
+Chia segments cho toàn bộ chapters của novel (song song, ghi bằng bulk_create)
+Usage: python manage.py prepare_novel --novel-id 1
+       python manage.py prepare_novel --novel-id 1 --force --workers 8
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Novel
+from core.utils.novel_prepare import prepare_novel
+
+
+class Command(BaseCommand):
+    help = 'Chia segments cho toàn bộ chapters của novel'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--novel-id',
+            type=int,
+            required=True,
+            help='ID của novel cần chia segments'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Chia lại cả chapters đã có segments (xóa bản dịch segments cũ, các chapter đó phải dịch lại)'
+        )
+        parser.add_argument(
+            '--max-tokens',
+            type=int,
+            default=None,
+            help='Token tối đa mỗi segment (default: theo TRANSLATION_MODEL)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Số process song song (default: số CPU, 1 = tuần tự)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Số chapters mỗi đợt (default: 200)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            novel = Novel.objects.get(pk=options['novel_id'])
+        except Novel.DoesNotExist:
+            raise CommandError(f"Novel với ID {options['novel_id']} không tồn tại")
+
+        self.stdout.write(f'✂️ Chia segments: {novel.title}')
+
+        def progress(prepared, total, segments):
+            self.stdout.write(f'   {prepared}/{total} chapters, {segments} segments', ending='\r')
+            self.stdout.flush()
+
+        started = time.monotonic()
+        summary = prepare_novel(
+            novel,
+            force=options['force'],
+            max_tokens=options['max_tokens'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            progress=progress
+        )
+
+        self.stdout.write(self.style.SUCCESS(f'\n🎉 Hoàn tất sau {time.monotonic() - started:.1f}s'))
+        self.stdout.write(f"   - Chapters đã chia: {summary['prepared_chapters']}")
+        self.stdout.write(f"   - Segments đã tạo: {summary['created_segments']}")
+        self.stdout.write(f"   - Token tối đa mỗi segment: {summary['max_tokens']}")
@@ -0,0 +1,66 @@
+"""
+Quét lại ký tự ngoại ngữ cho segments đã dịch và dựng lại cảnh báo của chapters
+Usage: python manage.py scan_foreign_chars --novel-id 1
+       python manage.py scan_foreign_chars --all --workers 8
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Novel
+from core.utils.foreign_char_scan import scan_segments
+
+
+class Command(BaseCommand):
+    help = 'Quét lại ký tự ngoại ngữ trong bản dịch (một novel hoặc toàn bộ DB)'
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument(
+            '--novel-id',
+            type=int,
+            help='ID của novel cần quét'
+        )
+        target.add_argument(
+            '--all',
+            action='store_true',
+            help='Quét toàn bộ DB'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Số process song song (default: số CPU, 1 = tuần tự)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Số segments mỗi đợt (default: 500)'
+        )
+
+    def handle(self, *args, **options):
+        novel = None
+        if options['novel_id'] is not None:
+            try:
+                novel = Novel.objects.get(pk=options['novel_id'])
+            except Novel.DoesNotExist:
+                raise CommandError(f"Novel với ID {options['novel_id']} không tồn tại")
+
+        self.stdout.write(f"🔍 Quét ký tự ngoại ngữ: {novel.title if novel else 'toàn bộ DB'}")
+
+        def progress(scanned, total):
+            self.stdout.write(f'   {scanned}/{total} segments', ending='\r')
+            self.stdout.flush()
+
+        started = time.monotonic()
+        summary = scan_segments(
+            novel,
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            progress=progress
+        )
+
+        self.stdout.write(self.style.SUCCESS(f'\n🎉 Hoàn tất sau {time.monotonic() - started:.1f}s'))
+        self.stdout.write(f"   - Segments đã quét: {summary['scanned_segments']}")
+        self.stdout.write(f"   - Segments có cảnh báo: {summary['segments_with_warning']}")
+        self.stdout.write(f"   - Chapters có cảnh báo: {summary['chapters_with_warning']}")
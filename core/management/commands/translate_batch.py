@@ -0,0 +1,93 @@
+"""
+Dịch offline cả novel qua batch API của provider (gửi một lần, provider xử lý trong vài giờ)
+Usage: python manage.py translate_batch submit --novel-id 1 [--provider gemini|openai|local] [--limit 100] [--wait]
+       python manage.py translate_batch poll --batch-id 3
+       python manage.py translate_batch wait --batch-id 3 [--interval 300]
+       python manage.py translate_batch list [--novel-id 1]
+"""
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Novel, TranslationBatch
+from core.utils.batch_translator import BATCH_BACKENDS, poll_batch, submit_batch, wait_batch
+
+
+class Command(BaseCommand):
+    help = 'Dịch offline qua batch API của provider (gemini, openai, local = giả lập bằng file)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['submit', 'poll', 'wait', 'list'])
+        parser.add_argument('--novel-id', type=int, help='Novel cần dịch (submit, list)')
+        parser.add_argument('--batch-id', type=int, help='Batch cần kiểm tra (poll, wait)')
+        parser.add_argument(
+            '--provider',
+            choices=list(BATCH_BACKENDS),
+            default=None,
+            help='Backend batch (default: settings.BATCH_TRANSLATION_PROVIDER)'
+        )
+        parser.add_argument('--limit', type=int, default=None, help='Chỉ gửi N chapters đầu tiên chưa dịch')
+        parser.add_argument('--force', action='store_true', help='Dịch lại cả chapters đã dịch (giữ segments và bản dịch cũ tới khi có kết quả)')
+        parser.add_argument('--wait', action='store_true', help='submit: chờ job xong và ghi kết quả')
+        parser.add_argument('--interval', type=float, default=None, help='Giây giữa các lần poll')
+
+    def _novel(self, options) -> Novel:
+        if not options['novel_id']:
+            raise CommandError('Cần --novel-id')
+        try:
+            return Novel.objects.get(pk=options['novel_id'])
+        except Novel.DoesNotExist:
+            raise CommandError(f"Novel với ID {options['novel_id']} không tồn tại")
+
+    def _batch(self, options) -> TranslationBatch:
+        if not options['batch_id']:
+            raise CommandError('Cần --batch-id')
+        try:
+            return TranslationBatch.objects.select_related('novel').get(pk=options['batch_id'])
+        except TranslationBatch.DoesNotExist:
+            raise CommandError(f"Batch với ID {options['batch_id']} không tồn tại")
+
+    def _report(self, batch: TranslationBatch):
+        line = f"   Batch #{batch.id} [{batch.provider}] {batch.status}: {batch.request_count} segments"
+        if batch.status == 'ingested':
+            line += f", đã ghi {batch.translated_count}, lỗi {batch.failed_count}, " \
+                    f"{batch.prompt_tokens:,} + {batch.output_tokens:,} tokens"
+        self.stdout.write(line)
+        if batch.error:
+            self.stdout.write(self.style.WARNING(f"   {batch.error}"))
+
+    def _wait(self, batch: TranslationBatch, interval):
+        def progress(batch):
+            self.stdout.write(f"   ⏳ Batch #{batch.id}: {batch.status}", ending='\r')
+            self.stdout.flush()
+
+        wait_batch(batch, interval=interval, progress=progress)
+        self.stdout.write('')
+
+    def handle(self, *args, **options):
+        action = options['action']
+
+        if action == 'list':
+            batches = TranslationBatch.objects.select_related('novel')
+            if options['novel_id']:
+                batches = batches.filter(novel_id=options['novel_id'])
+            for batch in batches[:50]:
+                self._report(batch)
+            return
+
+        if action == 'submit':
+            novel = self._novel(options)
+            try:
+                batch = submit_batch(novel, options['provider'], limit=options['limit'], force=options['force'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            if batch is None:
+                self.stdout.write(self.style.SUCCESS('✅ Không còn segment nào cần dịch'))
+                return
+            self.stdout.write(self.style.SUCCESS(f"📤 Batch #{batch.id}: job {batch.job_id}"))
+            if options['wait']:
+                self._wait(batch, options['interval'])
+        elif action == 'poll':
+            batch = poll_batch(self._batch(options))
+        else:
+            batch = self._batch(options)
+            self._wait(batch, options['interval'])
+
+        self._report(batch)
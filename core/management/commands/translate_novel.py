@@ -0,0 +1,82 @@
+"""
+Dịch các chapters chưa dịch của novel, gộp các chapters ngắn liên tiếp vào chung một request
+Usage: python manage.py translate_novel --novel-id 1
+       python manage.py translate_novel --novel-id 1 --no-pack --limit 10
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Novel, TranslationCascadeStats
+from core.utils.chapter_translator import translate_novel
+
+
+class Command(BaseCommand):
+    help = 'Dịch hàng loạt chapters của novel (gộp chapters ngắn vào chung request)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--novel-id',
+            type=int,
+            required=True,
+            help='ID của novel cần dịch'
+        )
+        parser.add_argument(
+            '--no-pack',
+            action='store_true',
+            help='Dịch từng chapter riêng (không gộp chapters ngắn)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Dịch lại cả chapters đã dịch'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Chỉ dịch N chapters đầu tiên'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            novel = Novel.objects.get(pk=options['novel_id'])
+        except Novel.DoesNotExist:
+            raise CommandError(f"Novel với ID {options['novel_id']} không tồn tại")
+
+        pack = not options['no_pack']
+        self.stdout.write(f"🌐 Dịch novel: {novel.title} ({'gộp chapters ngắn' if pack else 'từng chapter'})")
+
+        def progress(translated, total, requests):
+            self.stdout.write(f'   {translated}/{total} chapters, {requests} requests', ending='\r')
+            self.stdout.flush()
+
+        started = time.monotonic()
+        summary = translate_novel(
+            novel,
+            pack=pack,
+            force=options['force'],
+            limit=options['limit'],
+            progress=progress
+        )
+
+        self.stdout.write(self.style.SUCCESS(f'\n🎉 Hoàn tất sau {time.monotonic() - started:.1f}s'))
+        self.stdout.write(f"   - Chapters đã dịch: {summary['translated_chapters']}")
+        self.stdout.write(f"   - Chapters gộp chung request: {summary['packed_chapters']}")
+        self.stdout.write(f"   - Số request dịch: {summary['requests']}")
+        self.stdout.write(f"   - Thay thuật ngữ còn sót: {summary['substituted_terms']}")
+        self.stdout.write(f"   - Câu được sửa: {summary['repaired_sentences']}")
+        if summary['foreign_warnings']:
+            self.stdout.write(self.style.WARNING(f"   - Cảnh báo ký tự ngoại ngữ: {len(summary['foreign_warnings'])}"))
+        for failed in summary['failed']:
+            self.stdout.write(self.style.ERROR(f"   ❌ Chapter {failed['chapter_id']}: {failed['error']}"))
+
+        stats = TranslationCascadeStats.objects.filter(novel=novel).first()
+        if stats:
+            cascade = stats.as_dict()
+            self.stdout.write(
+                f"   - Cascade (cả novel): {cascade['escalated']}/{cascade['translations']} bản dịch lại bằng model mạnh "
+                f"({cascade['escalation_rate']:.0%}), lỗi kiểm tra {cascade['failed_checks']}"
+            )
+            self.stdout.write(
+                f"     Tiết kiệm ước tính: {cascade['saved_seconds']}s, ${cascade['saved_cost']}"
+            )
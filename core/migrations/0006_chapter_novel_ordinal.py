@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_chapter_ordinal(apps, schema_editor):
+    Chapter = apps.get_model('core', 'Chapter')
+    Novel = apps.get_model('core', 'Novel')
+    for novel_id in Novel.objects.values_list('id', flat=True):
+        rows = Chapter.objects.filter(volume__novel_id=novel_id).order_by(
+            'volume__index', 'index'
+        ).values_list('id', flat=True)
+        chapters = [
+            Chapter(id=chapter_id, ordinal=ordinal, novel_id=novel_id)
+            for ordinal, chapter_id in enumerate(rows, start=1)
+        ]
+        Chapter.objects.bulk_update(chapters, ['ordinal', 'novel'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_novel_translation_style'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='novel',
+            field=models.ForeignKey(editable=False, help_text='Denormalize từ volume.novel để truy vấn theo thứ tự global', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chapters', to='core.novel'),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='ordinal',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Thứ tự global của chapter trong novel (1-based), xem Novel.reindex_chapters'),
+        ),
+        migrations.RunPython(backfill_chapter_ordinal, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chapter',
+            index=models.Index(fields=['novel', 'ordinal'], name='core_chapter_novel_ordinal'),
+        ),
+    ]
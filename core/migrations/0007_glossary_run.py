@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:44
+
+import re
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def move_description_checkpoints(apps, schema_editor):
+    """Chuyển checkpoint cũ ('checkpoint:N' trong Novel.description) sang GlossaryRun"""
+    Novel = apps.get_model('core', 'Novel')
+    GlossaryRun = apps.get_model('core', 'GlossaryRun')
+    GlossaryBatch = apps.get_model('core', 'GlossaryBatch')
+    
+    for novel in Novel.objects.filter(description__contains='checkpoint:'):
+        match = re.search(r'checkpoint:(\d+)', novel.description)
+        if not match:
+            continue
+        checkpoint = int(match.group(1))
+        
+        if checkpoint > 0:
+            run = GlossaryRun.objects.create(
+                novel=novel,
+                status='completed',
+                finished_at=django.utils.timezone.now()
+            )
+            GlossaryBatch.objects.create(
+                run=run,
+                index=1,
+                start_ordinal=1,
+                end_ordinal=checkpoint,
+                status='done'
+            )
+        
+        novel.description = re.sub(r'\s*checkpoint:\d+\s*', '\n', novel.description).strip()
+        novel.save(update_fields=['description'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_chapter_novel_ordinal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GlossaryRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Đang chạy'), ('completed', 'Hoàn tất'), ('failed', 'Lỗi'), ('reset', 'Đã reset')], default='running', max_length=16)),
+                ('start_ordinal', models.PositiveIntegerField(default=0, help_text='Checkpoint lúc bắt đầu chạy')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('novel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='glossary_runs', to='core.novel')),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='GlossaryBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('start_ordinal', models.PositiveIntegerField()),
+                ('end_ordinal', models.PositiveIntegerField()),
+                ('chapter_count', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'Chờ xử lý'), ('running', 'Đang xử lý'), ('done', 'Xong'), ('failed', 'Lỗi')], default='pending', max_length=16)),
+                ('new_terms', models.IntegerField(default=0)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('output_tokens', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_seconds', models.FloatField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='core.glossaryrun')),
+            ],
+            options={
+                'ordering': ['index'],
+                'unique_together': {('run', 'index')},
+            },
+        ),
+        migrations.RunPython(move_description_checkpoints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_glossary_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='glossary',
+            name='needs_review',
+            field=models.BooleanField(default=False, help_text='Có bản dịch xung đột khi tạo glossary tự động (xem note)'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_glossary_needs_review'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='token_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Số token ước lượng của content_raw (None = chưa tính)', null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_chapter_token_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranslationCascadeStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('translations', models.PositiveIntegerField(default=0, help_text='Số bản dịch (segment hoặc chapter trong pack)')),
+                ('escalated', models.PositiveIntegerField(default=0, help_text='Số bản phải dịch lại bằng model mạnh')),
+                ('failed_format', models.PositiveIntegerField(default=0)),
+                ('failed_foreign', models.PositiveIntegerField(default=0)),
+                ('failed_glossary', models.PositiveIntegerField(default=0)),
+                ('failed_length', models.PositiveIntegerField(default=0)),
+                ('fast_seconds', models.FloatField(default=0)),
+                ('strong_seconds', models.FloatField(default=0)),
+                ('direct_seconds', models.FloatField(default=0, help_text='Ước tính nếu mọi bản đều dịch thẳng bằng model mạnh')),
+                ('fast_cost', models.FloatField(default=0, help_text='USD')),
+                ('strong_cost', models.FloatField(default=0, help_text='USD')),
+                ('direct_cost', models.FloatField(default=0, help_text='USD, ước tính nếu mọi bản đều dịch thẳng bằng model mạnh')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('novel', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cascade_stats', to='core.novel')),
+            ],
+            options={
+                'verbose_name': 'Translation cascade stats',
+                'verbose_name_plural': 'Translation cascade stats',
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_translation_cascade_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranslationBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(help_text='gemini, openai hoặc local (giả lập bằng file)', max_length=20)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('api_key_id', models.IntegerField(blank=True, help_text='Job thuộc về key đã gửi', null=True)),
+                ('job_id', models.CharField(blank=True, help_text='ID/tên job phía provider', max_length=255)),
+                ('status', models.CharField(choices=[('submitted', 'Đã gửi'), ('running', 'Provider đang xử lý'), ('succeeded', 'Provider xử lý xong'), ('ingested', 'Đã ghi bản dịch'), ('failed', 'Lỗi'), ('cancelled', 'Đã hủy')], default='submitted', max_length=16)),
+                ('input_file', models.CharField(max_length=500)),
+                ('output_file', models.CharField(blank=True, max_length=500)),
+                ('request_count', models.PositiveIntegerField(default=0)),
+                ('translated_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('output_tokens', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('novel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='translation_batches', to='core.novel')),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:36
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_translation_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('operation', models.CharField(help_text='translate, translate_fast, review, glossary...', max_length=32)),
+                ('provider', models.CharField(max_length=20)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('output_tokens', models.IntegerField(default=0)),
+                ('cached_tokens', models.IntegerField(default=0, help_text='Token prompt đọc từ context cache')),
+                ('latency', models.FloatField(default=0, help_text='Giây, gồm cả thời gian thử lại')),
+                ('retries', models.PositiveIntegerField(default=0)),
+                ('outcome', models.CharField(choices=[('ok', 'Thành công'), ('error', 'Lỗi'), ('cancelled', 'Bị hủy giữa chừng')], default='ok', max_length=16)),
+                ('error', models.TextField(blank=True)),
+                ('prompt_sample', models.TextField(blank=True, help_text='Chỉ lưu cho một phần request (LLM_TRACE_SAMPLE_RATE) và request lỗi')),
+                ('response_sample', models.TextField(blank=True)),
+                ('api_key', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='call_logs', to='core.apikey')),
+                ('chapter', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to='core.chapter')),
+                ('novel', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to='core.novel')),
+                ('segment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to='core.segment')),
+            ],
+            options={
+                'verbose_name': 'LLM call',
+                'verbose_name_plural': 'LLM calls',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['operation', 'created_at'], name='core_llmcall_op_created')],
+            },
+        ),
+    ]
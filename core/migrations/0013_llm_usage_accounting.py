@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_llm_call_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apikey',
+            name='daily_request_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='Quota request/ngày của key ở provider (để trống = không giới hạn), admin hiển thị % đã dùng hôm nay', null=True),
+        ),
+        migrations.AddField(
+            model_name='llmcalllog',
+            name='cost',
+            field=models.FloatField(default=0, help_text='USD theo LLM_PRICES (batch: nhân LLM_BATCH_PRICE_RATIO)'),
+        ),
+    ]
@@ -1,5 +1,9 @@
 from django.db import models
+from django.db.models import Max, Q
 from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .utils.tokens import estimate_tokens
 
 
 class Novel(models.Model):
@@ -33,6 +37,27 @@ class Novel(models.Model):
                     })
         
         return segments_data
+    
+    def reindex_chapters(self) -> int:
+        """
+        Tính lại thứ tự global (Chapter.ordinal, 1-based) theo (volume.index, chapter.index)
+        Chapter.save/Volume.save tự gọi khi thứ tự thay đổi; sau khi xóa volume/chapter
+        gọi lại để đánh số liền (khoảng trống không làm sai thứ tự)
+        
+        Returns:
+            Số chapters được cập nhật
+        """
+        rows = Chapter.objects.filter(volume__novel=self).order_by(
+            'volume__index', 'index'
+        ).values_list('id', 'ordinal', 'novel_id')
+        
+        changed = [
+            Chapter(id=chapter_id, ordinal=ordinal, novel_id=self.id)
+            for ordinal, (chapter_id, old_ordinal, novel_id) in enumerate(rows, start=1)
+            if old_ordinal != ordinal or novel_id != self.id
+        ]
+        Chapter.objects.bulk_update(changed, ['ordinal', 'novel'], batch_size=500)
+        return len(changed)
 
 
 class Volume(models.Model):
@@ -47,12 +72,51 @@ class Volume(models.Model):
     def __str__(self):
         return f"{self.novel.title} - Vol {self.index}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_index = instance.__dict__.get('index')
+        return instance
+
+    def save(self, *args, **kwargs):
+        reorder = not self._state.adding and self.index != getattr(self, '_loaded_index', self.index)
+        super().save(*args, **kwargs)
+        self._loaded_index = self.index
+        if reorder:
+            # Đổi thứ tự volume -> thứ tự global của mọi chapter phía sau thay đổi
+            self.novel.reindex_chapters()
+
+
+class ChapterQuerySet(models.QuerySet):
+    def translated(self):
+        """Chapters đã dịch (đã finalize hoặc đang ghép lazy từ segments)"""
+        return self.filter(Q(translation__isnull=False) | Q(status='translated'))
+
 
 class Chapter(models.Model):
     volume = models.ForeignKey(Volume, on_delete=models.CASCADE, related_name='chapters')
+    novel = models.ForeignKey(
+        Novel,
+        on_delete=models.CASCADE,
+        related_name='chapters',
+        null=True,
+        editable=False,
+        help_text='Denormalize từ volume.novel để truy vấn theo thứ tự global'
+    )
+    ordinal = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='Thứ tự global của chapter trong novel (1-based), xem Novel.reindex_chapters'
+    )
     index = models.PositiveIntegerField(default=1)
     title = models.CharField(max_length=512, blank=True)
     content_raw = models.TextField(blank=True, null=True)
+    token_count = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Số token ước lượng của content_raw (None = chưa tính)'
+    )
     translation = models.TextField(blank=True, null=True)
     title_translation = models.TextField(blank=True, null=True)
     match_percent = models.FloatField(default=0)
@@ -65,13 +129,125 @@ class Chapter(models.Model):
         help_text='Tổng hợp cảnh báo ký tự ngoại ngữ từ tất cả segments'
     )
 
+    objects = ChapterQuerySet.as_manager()
+
     class Meta:
         unique_together = ('volume', 'index')
         ordering = ['index']
+        indexes = [
+            models.Index(fields=['novel', 'ordinal'], name='core_chapter_novel_ordinal'),
+        ]
 
     def __str__(self):
         return f"Vol{self.volume.index}-Chap{self.index}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Giữ nội dung lúc load để chỉ tính lại token_count khi content_raw thay đổi
+        instance._loaded_content_raw = instance.__dict__.get('content_raw')
+        instance._loaded_position = (instance.__dict__.get('volume_id'), instance.__dict__.get('index'))
+        return instance
+
+    def _assign_ordinal(self) -> bool:
+        """
+        Gán ordinal khi chapter mới được tạo hoặc đổi volume/index (mọi đường ghi: view, admin, ORM)
+        Chapter mới nằm cuối novel lấy ordinal lớn nhất + 1, chen giữa hoặc đổi chỗ thì reindex sau khi lưu
+
+        Returns:
+            True nếu phải gọi Novel.reindex_chapters sau khi lưu
+        """
+        self.novel_id = self.volume.novel_id
+        if not self._state.adding:
+            return True
+        others = Chapter.objects.filter(novel_id=self.novel_id)
+        volume_index = self.volume.index
+        if others.filter(
+            Q(volume__index__gt=volume_index) | Q(volume__index=volume_index, index__gt=self.index)
+        ).exists():
+            return True
+        self.ordinal = (others.aggregate(last=Max('ordinal'))['last'] or 0) + 1
+        return False
+
+    def save(self, *args, **kwargs):
+        if self.novel_id is None:
+            self.novel_id = self.volume.novel_id
+        update_fields = kwargs.get('update_fields')
+        reindex = False
+        if (
+            (update_fields is None or {'index', 'volume'} & set(update_fields))
+            and (self._state.adding
+                 or getattr(self, '_loaded_position', None) != (self.volume_id, self.index))
+        ):
+            reindex = self._assign_ordinal()
+            if update_fields is not None:
+                kwargs['update_fields'] = update_fields = {*update_fields, 'ordinal', 'novel'}
+        if (
+            (update_fields is None or 'content_raw' in update_fields)
+            and 'content_raw' not in self.get_deferred_fields()
+            and (self.token_count is None
+                 or self.content_raw != getattr(self, '_loaded_content_raw', None))
+        ):
+            self.token_count = estimate_tokens(self.content_raw)
+            self._loaded_content_raw = self.content_raw
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'token_count'}
+        super().save(*args, **kwargs)
+        self._loaded_position = (self.volume_id, self.index)
+        if reindex:
+            self.novel.reindex_chapters()
+            self.ordinal = Chapter.objects.values_list('ordinal', flat=True).get(pk=self.pk)
+
+    def get_previous_chapter(self):
+        return Chapter.objects.filter(
+            novel_id=self.novel_id, ordinal__lt=self.ordinal
+        ).order_by('-ordinal').first()
+
+    def get_next_chapter(self):
+        return Chapter.objects.filter(
+            novel_id=self.novel_id, ordinal__gt=self.ordinal
+        ).order_by('ordinal').first()
+
+    @property
+    def has_translation(self) -> bool:
+        return bool(self.translation) or self.status == 'translated'
+
+    def merge_segment_translations(self) -> str:
+        """Ghép bản dịch của các segments theo thứ tự (không ghi DB)"""
+        translations = self.segments.exclude(
+            translation__isnull=True
+        ).exclude(translation='').order_by('index').values_list('translation', flat=True)
+        return '\n\n'.join(t.strip() for t in translations)
+
+    @cached_property
+    def full_translation(self) -> str:
+        """
+        Bản dịch đầy đủ của chapter
+        Dùng bản đã finalize nếu có, nếu không thì ghép từ segments khi cần
+        """
+        if self.translation:
+            return self.translation
+        return self.merge_segment_translations()
+
+    def invalidate_full_translation(self):
+        self.__dict__.pop('full_translation', None)
+
+    def finalize_translation(self) -> str:
+        """
+        Ghi bản dịch đã ghép từ segments vào chapter.translation
+
+        Raises:
+            ValueError: Chưa có segment nào được dịch (không ghi gì vào DB)
+        """
+        merged = self.merge_segment_translations()
+        if not merged:
+            raise ValueError('Chưa có segment nào được dịch, không có gì để chốt')
+        self.translation = merged
+        self.status = 'translated'
+        self.invalidate_full_translation()
+        self.save(update_fields=['translation', 'status', 'updated_at'])
+        return self.translation
+
 
 class Segment(models.Model):
     chapter = models.ForeignKey(Chapter, on_delete=models.CASCADE, related_name='segments')
@@ -100,6 +276,10 @@ class Glossary(models.Model):
     term_cn = models.CharField(max_length=128)
     term_vi = models.CharField(max_length=128)
     note = models.TextField(blank=True)
+    needs_review = models.BooleanField(
+        default=False,
+        help_text='Có bản dịch xung đột khi tạo glossary tự động (xem note)'
+    )
 
     class Meta:
         unique_together = ('novel', 'term_cn')
@@ -108,6 +288,85 @@ class Glossary(models.Model):
         return f"{self.term_cn} = {self.term_vi}"
 
 
+class GlossaryRun(models.Model):
+    """Một lần chạy tạo glossary tự động, lưu lại ranh giới batch để resume"""
+    
+    STATUS_CHOICES = [
+        ('running', 'Đang chạy'),
+        ('completed', 'Hoàn tất'),
+        ('failed', 'Lỗi'),
+        ('reset', 'Đã reset'),
+    ]
+    
+    novel = models.ForeignKey(Novel, on_delete=models.CASCADE, related_name='glossary_runs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='running')
+    start_ordinal = models.PositiveIntegerField(default=0, help_text='Checkpoint lúc bắt đầu chạy')
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-id']
+    
+    def __str__(self):
+        return f"{self.novel.title} - Glossary run #{self.id} ({self.status})"
+    
+    @classmethod
+    def latest_for(cls, novel):
+        """Lần chạy gần nhất chưa bị reset"""
+        return cls.objects.filter(novel=novel).exclude(status='reset').first()
+    
+    @classmethod
+    def checkpoint_for(cls, novel) -> int:
+        """
+        Ordinal của chapter cuối đã xử lý xong
+        Chỉ đọc DB, không khởi tạo LLM client
+        """
+        run = cls.latest_for(novel)
+        return run.checkpoint if run else 0
+    
+    @property
+    def checkpoint(self) -> int:
+        """Hết dãy batch 'done' liên tục tính từ batch đầu tiên"""
+        checkpoint = self.start_ordinal
+        for status, end_ordinal in self.batches.order_by('index').values_list('status', 'end_ordinal'):
+            if status != 'done':
+                break
+            checkpoint = end_ordinal
+        return checkpoint
+
+
+class GlossaryBatch(models.Model):
+    """Một batch chapters trong GlossaryRun"""
+    
+    STATUS_CHOICES = [
+        ('pending', 'Chờ xử lý'),
+        ('running', 'Đang xử lý'),
+        ('done', 'Xong'),
+        ('failed', 'Lỗi'),
+    ]
+    
+    run = models.ForeignKey(GlossaryRun, on_delete=models.CASCADE, related_name='batches')
+    index = models.PositiveIntegerField()
+    start_ordinal = models.PositiveIntegerField()
+    end_ordinal = models.PositiveIntegerField()
+    chapter_count = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='pending')
+    new_terms = models.IntegerField(default=0)
+    prompt_tokens = models.IntegerField(default=0)
+    output_tokens = models.IntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_seconds = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+    
+    class Meta:
+        unique_together = ('run', 'index')
+        ordering = ['index']
+    
+    def __str__(self):
+        return f"Run #{self.run_id} - Batch {self.index} (Chap {self.start_ordinal}-{self.end_ordinal})"
+
+
 class APIKey(models.Model):
     """Quản lý Gemini API Keys"""
     
@@ -122,6 +381,11 @@ class APIKey(models.Model):
     name = models.CharField(max_length=100, blank=True, help_text="Tên gợi nhớ, VD: Key 1, Key Production")
     is_active = models.BooleanField(default=True)
     usage_count = models.IntegerField(default=0, help_text="Số lần sử dụng")
+    daily_request_limit = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Quota request/ngày của key ở provider (để trống = không giới hạn), admin hiển thị % đã dùng hôm nay"
+    )
     last_used = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     
@@ -138,4 +402,154 @@ class APIKey(models.Model):
         """Đánh dấu key đã được sử dụng"""
         self.usage_count += 1
         self.last_used = timezone.now()
-        self.save(update_fields=['usage_count', 'last_used'])
\ No newline at end of file
+        self.save(update_fields=['usage_count', 'last_used'])
+
+class TranslationCascadeStats(models.Model):
+    """Thống kê dịch theo tầng (TRANSLATION_CASCADE) của một novel: tỉ lệ phải dịch lại bằng model mạnh, thời gian/chi phí tiết kiệm"""
+    
+    novel = models.OneToOneField(Novel, on_delete=models.CASCADE, related_name='cascade_stats')
+    translations = models.PositiveIntegerField(default=0, help_text="Số bản dịch (segment hoặc chapter trong pack)")
+    escalated = models.PositiveIntegerField(default=0, help_text="Số bản phải dịch lại bằng model mạnh")
+    failed_format = models.PositiveIntegerField(default=0)
+    failed_foreign = models.PositiveIntegerField(default=0)
+    failed_glossary = models.PositiveIntegerField(default=0)
+    failed_length = models.PositiveIntegerField(default=0)
+    fast_seconds = models.FloatField(default=0)
+    strong_seconds = models.FloatField(default=0)
+    direct_seconds = models.FloatField(default=0, help_text="Ước tính nếu mọi bản đều dịch thẳng bằng model mạnh")
+    fast_cost = models.FloatField(default=0, help_text="USD")
+    strong_cost = models.FloatField(default=0, help_text="USD")
+    direct_cost = models.FloatField(default=0, help_text="USD, ước tính nếu mọi bản đều dịch thẳng bằng model mạnh")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Translation cascade stats'
+        verbose_name_plural = 'Translation cascade stats'
+    
+    def __str__(self):
+        return f"{self.novel.title} - Cascade ({self.escalated}/{self.translations} escalated)"
+    
+    @classmethod
+    def record(cls, novel, info: dict):
+        """Cộng dồn kết quả một lần cascade (cascade._tier_info), cập nhật bằng F() nên an toàn khi chạy song song"""
+        stats, _created = cls.objects.get_or_create(novel=novel)
+        updates = {
+            'translations': models.F('translations') + 1,
+            'updated_at': timezone.now(),
+        }
+        if info['escalated']:
+            updates['escalated'] = models.F('escalated') + 1
+        for check in info['failed_checks']:
+            updates[f'failed_{check}'] = models.F(f'failed_{check}') + 1
+        for field in ('fast_seconds', 'strong_seconds', 'direct_seconds', 'fast_cost', 'strong_cost', 'direct_cost'):
+            updates[field] = models.F(field) + info[field]
+        cls.objects.filter(pk=stats.pk).update(**updates)
+    
+    @property
+    def escalation_rate(self) -> float:
+        return self.escalated / self.translations if self.translations else 0.0
+    
+    @property
+    def saved_seconds(self) -> float:
+        return self.direct_seconds - self.fast_seconds - self.strong_seconds
+    
+    @property
+    def saved_cost(self) -> float:
+        return self.direct_cost - self.fast_cost - self.strong_cost
+    
+    def as_dict(self) -> dict:
+        return {
+            'translations': self.translations,
+            'escalated': self.escalated,
+            'escalation_rate': round(self.escalation_rate, 3),
+            'failed_checks': {
+                'format': self.failed_format,
+                'foreign': self.failed_foreign,
+                'glossary': self.failed_glossary,
+                'length': self.failed_length,
+            },
+            'seconds': round(self.fast_seconds + self.strong_seconds, 1),
+            'saved_seconds': round(self.saved_seconds, 1),
+            'cost': round(self.fast_cost + self.strong_cost, 4),
+            'saved_cost': round(self.saved_cost, 4),
+        }
+
+
+class TranslationBatch(models.Model):
+    """Một job dịch offline qua batch API của provider (xem core/utils/batch_translator.py)"""
+    
+    STATUS_CHOICES = [
+        ('submitted', 'Đã gửi'),
+        ('running', 'Provider đang xử lý'),
+        ('succeeded', 'Provider xử lý xong'),
+        ('ingested', 'Đã ghi bản dịch'),
+        ('failed', 'Lỗi'),
+        ('cancelled', 'Đã hủy'),
+    ]
+    
+    novel = models.ForeignKey(Novel, on_delete=models.CASCADE, related_name='translation_batches')
+    provider = models.CharField(max_length=20, help_text="gemini, openai hoặc local (giả lập bằng file)")
+    model = models.CharField(max_length=100, blank=True)
+    api_key_id = models.IntegerField(null=True, blank=True, help_text="Job thuộc về key đã gửi")
+    job_id = models.CharField(max_length=255, blank=True, help_text="ID/tên job phía provider")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='submitted')
+    input_file = models.CharField(max_length=500)
+    output_file = models.CharField(max_length=500, blank=True)
+    request_count = models.PositiveIntegerField(default=0)
+    translated_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.IntegerField(default=0)
+    output_tokens = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    
+    class Meta:
+        ordering = ['-id']
+    
+    def __str__(self):
+        return f"{self.novel.title} - Batch #{self.id} ({self.provider}, {self.status})"
+    
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ('ingested', 'failed', 'cancelled')
+
+
+class LLMCallLog(models.Model):
+    """Một lần gọi LLM (ghi bởi core/utils/llm_tracing.py)"""
+    
+    OUTCOME_CHOICES = [
+        ('ok', 'Thành công'),
+        ('error', 'Lỗi'),
+        ('cancelled', 'Bị hủy giữa chừng'),
+    ]
+    
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    operation = models.CharField(max_length=32, help_text="translate, translate_fast, review, glossary...")
+    provider = models.CharField(max_length=20)
+    model = models.CharField(max_length=100, blank=True)
+    api_key = models.ForeignKey(APIKey, on_delete=models.SET_NULL, null=True, blank=True, related_name='call_logs')
+    novel = models.ForeignKey(Novel, on_delete=models.SET_NULL, null=True, blank=True, related_name='llm_calls')
+    chapter = models.ForeignKey(Chapter, on_delete=models.SET_NULL, null=True, blank=True, related_name='llm_calls')
+    segment = models.ForeignKey(Segment, on_delete=models.SET_NULL, null=True, blank=True, related_name='llm_calls')
+    prompt_tokens = models.IntegerField(default=0)
+    output_tokens = models.IntegerField(default=0)
+    cached_tokens = models.IntegerField(default=0, help_text="Token prompt đọc từ context cache")
+    cost = models.FloatField(default=0, help_text="USD theo LLM_PRICES (batch: nhân LLM_BATCH_PRICE_RATIO)")
+    latency = models.FloatField(default=0, help_text="Giây, gồm cả thời gian thử lại")
+    retries = models.PositiveIntegerField(default=0)
+    outcome = models.CharField(max_length=16, choices=OUTCOME_CHOICES, default='ok')
+    error = models.TextField(blank=True)
+    prompt_sample = models.TextField(blank=True, help_text="Chỉ lưu cho một phần request (LLM_TRACE_SAMPLE_RATE) và request lỗi")
+    response_sample = models.TextField(blank=True)
+    
+    class Meta:
+        ordering = ['-id']
+        verbose_name = 'LLM call'
+        verbose_name_plural = 'LLM calls'
+        indexes = [
+            models.Index(fields=['operation', 'created_at'], name='core_llmcall_op_created'),
+        ]
+    
+    def __str__(self):
+        return f"#{self.id} {self.operation} {self.provider}/{self.model} ({self.outcome}, {self.latency:.1f}s)"
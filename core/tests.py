@@ -1,3 +1,665 @@
-from django.test import TestCase
+import io
+import math
+import random
+import threading
+import time
+from contextlib import redirect_stdout
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .models import APIKey, Novel, Volume, Chapter, Segment, Glossary, GlossaryBatch
+from .utils import ai_client, fake_llm, resilience
+from .utils.fake_llm import FakeLLMError
+from .utils.chapter_translator import PACK_MARKER_TOKENS, ChapterTranslator
+from .utils.gemini_client import parse_packed_translation
+from .utils.glossary_generator import GlossaryGenerator
+from .utils.postprocess import GlossarySubstituter
+from .utils.segment_processor import SegmentProcessor
+from .utils.tokens import estimate_tokens, token_weight
+
+FAKE_LLM = {'time_scale': 0}  # LLM giả lập không chờ, không cần API key/network
+
+
+def silence_stdout(test):
+    """Ẩn log print của các utils trong lúc chạy test"""
+    stdout = redirect_stdout(io.StringIO())
+    stdout.__enter__()
+    test.addCleanup(stdout.__exit__, None, None, None)
+
+
+@override_settings(LLM_FAKE=FAKE_LLM)
+class FakeLLMTestCase(TestCase):
+    """TestCase dùng FakeLLM mới cho mỗi test, ẩn log print của các utils"""
+
+    def setUp(self):
+        fake_llm._fake = None
+        self.addCleanup(setattr, fake_llm, '_fake', None)
+        silence_stdout(self)
+
+
+def create_novel(chapter_contents, title='Test'):
+    """Novel một volume, mỗi nội dung một chapter"""
+    novel = Novel.objects.create(title=title)
+    volume = Volume.objects.create(novel=novel, index=1)
+    for index, content in enumerate(chapter_contents, start=1):
+        Chapter.objects.create(volume=volume, index=index, title=f'第{index}章', content_raw=content)
+    return novel
+
+
+class ChapterOrdinalTests(TestCase):
+    """Chapter.ordinal đúng với mọi đường ghi (ORM, admin, view)"""
+
+    def setUp(self):
+        self.novel = Novel.objects.create(title='Test')
+        self.volume = Volume.objects.create(novel=self.novel, index=1)
+
+    def ordinals(self):
+        return list(
+            Chapter.objects.filter(novel=self.novel)
+            .order_by('ordinal')
+            .values_list('volume__index', 'index', 'ordinal')
+        )
+
+    def test_create_appends(self):
+        chapters = [Chapter.objects.create(volume=self.volume, index=i) for i in range(1, 11)]
+
+        self.assertEqual([c.ordinal for c in chapters], list(range(1, 11)))
+        self.assertEqual(chapters[4].get_next_chapter(), chapters[5])
+        self.assertEqual(chapters[4].get_previous_chapter(), chapters[3])
+
+    def test_insert_and_move_reindex(self):
+        second = Volume.objects.create(novel=self.novel, index=2)
+        for i in (1, 2):
+            Chapter.objects.create(volume=second, index=i)
+        inserted = Chapter.objects.create(volume=self.volume, index=1)
+        self.assertEqual(inserted.ordinal, 1)
+        self.assertEqual(self.ordinals(), [(1, 1, 1), (2, 1, 2), (2, 2, 3)])
+
+        inserted.index = 5
+        inserted.volume = second
+        inserted.save()
+        self.assertEqual(inserted.ordinal, 3)
+        self.assertEqual(self.ordinals(), [(2, 1, 1), (2, 2, 2), (2, 5, 3)])
+
+    def test_volume_reorder_reindexes(self):
+        second = Volume.objects.create(novel=self.novel, index=2)
+        Chapter.objects.create(volume=self.volume, index=1)
+        Chapter.objects.create(volume=second, index=1)
+
+        self.volume.index = 3
+        self.volume.save()
+        self.assertEqual(self.ordinals(), [(2, 1, 1), (3, 1, 2)])
+
+
+class PrepareChapterTests(TestCase):
+    """Chia lại segments xóa bản dịch cũ thì chapter phải trở về trạng thái chưa dịch"""
+
+    def setUp(self):
+        novel = Novel.objects.create(title='Test')
+        volume = Volume.objects.create(novel=novel, index=1)
+        self.chapter = Chapter.objects.create(volume=volume, index=1, content_raw='李明走了。\n他回来了。')
+        Segment.objects.create(chapter=self.chapter, index=1, content_raw='李明走了。', translation='Lý Minh đi rồi.')
+        self.chapter.status = 'translated'
+        self.chapter.foreign_char_warning = 'x'
+        self.chapter.save()
+
+    def test_prepare_resets_translated_chapter(self):
+        response = self.client.post(reverse('core:prepare_chapter', args=[self.chapter.id]))
+        self.assertTrue(response.json()['ok'])
+
+        chapter = Chapter.objects.get(pk=self.chapter.id)
+        self.assertEqual(chapter.status, 'imported')
+        self.assertIsNone(chapter.foreign_char_warning)
+        self.assertFalse(chapter.has_translation)
+        self.assertEqual(chapter.full_translation, '')
+        self.assertFalse(Chapter.objects.filter(pk=chapter.id).translated().exists())
+        self.assertTrue(chapter.segments.exists())
+
+    def test_first_prepare_keeps_imported_translation(self):
+        self.chapter.segments.all().delete()
+        Chapter.objects.filter(pk=self.chapter.id).update(translation='Bản dịch nhập sẵn')
+
+        self.client.post(reverse('core:prepare_chapter', args=[self.chapter.id]))
+        self.assertEqual(Chapter.objects.get(pk=self.chapter.id).translation, 'Bản dịch nhập sẵn')
+
+
+class ChapterDetailTests(TestCase):
+    """chapter_detail không tải nguyên văn/bản dịch đầy đủ của chapter"""
+
+    def setUp(self):
+        novel = Novel.objects.create(title='Test')
+        volume = Volume.objects.create(novel=novel, index=1)
+        self.chapter = Chapter.objects.create(volume=volume, index=1, content_raw='李明走了。')
+        Segment.objects.create(chapter=self.chapter, index=1, content_raw='李明走了。', translation='Lý Minh đi rồi.')
+
+    def test_finalized_translation_is_deferred(self):
+        self.chapter.finalize_translation()
+
+        response = self.client.get(reverse('core:chapter_detail', args=[self.chapter.id]))
+        self.assertEqual(response.status_code, 200)
+        chapter = response.context['chapter']
+        self.assertTrue({'content_raw', 'translation'} <= chapter.get_deferred_fields())
+        self.assertEqual(response.context['translation_chars'], len('Lý Minh đi rồi.'))
+        self.assertTrue(response.context['finalized'])
+        self.assertTrue(response.context['has_translation'])
+
+    def test_unfinalized_chapter(self):
+        response = self.client.get(reverse('core:chapter_detail', args=[self.chapter.id]))
+        self.assertEqual(response.context['translation_chars'], len('Lý Minh đi rồi.'))
+        self.assertFalse(response.context['finalized'])
+        self.assertFalse(response.context['has_translation'])
+
+
+class GlossaryMergeTests(FakeLLMTestCase):
+    """Gộp glossary song song theo thứ tự chapter, xung đột và resume từ GlossaryBatch"""
+
+    CHAPTERS = 6
+
+    def setUp(self):
+        super().setUp()
+        self.novel = create_novel(['李明说话。' * 20] * self.CHAPTERS)
+        Glossary.objects.create(novel=self.novel, term_cn='王', term_vi='Vương')
+        self.fail_ordinals = set()
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def fake_request(self, chapters, existing_glossary):
+        """Mỗi batch một chapter; batch sau xong trước để thứ tự hoàn thành ngược thứ tự chapter"""
+        ordinal = chapters[0].ordinal
+        with self.lock:
+            self.requested.append(ordinal)
+        time.sleep((self.CHAPTERS - ordinal) * 0.01)
+        if ordinal in self.fail_ordinals:
+            raise RuntimeError('boom')
+        text = f"李明 = Li Minh {ordinal}\n张{ordinal} = Trương {ordinal}\n王 = vương"
+        return text, {'prompt_tokens': 10, 'output_tokens': 5}
+
+    def generator(self):
+        generator = GlossaryGenerator(self.novel)
+        generator.MAX_TOKENS_PER_BATCH = 1  # Mỗi chapter một batch
+        generator._request_glossary = self.fake_request
+        return generator
+
+    def conflict_options(self, term_cn):
+        return GlossaryGenerator._conflict_options(Glossary.objects.get(novel=self.novel, term_cn=term_cn).note)
+
+    def test_merge_candidates_first_occurrence_wins(self):
+        generator = GlossaryGenerator(self.novel)
+        new_terms, conflicts = generator.merge_candidates([
+            ('李明', 'Lý Minh'), ('李明', 'Li Ming'), ('王', 'VƯƠNG'), ('王', 'Vua'), ('李明', 'Li Ming'),
+        ])
+
+        self.assertEqual((new_terms, conflicts), (1, 2))
+        li_ming = Glossary.objects.get(novel=self.novel, term_cn='李明')
+        self.assertEqual(li_ming.term_vi, 'Lý Minh')
+        self.assertTrue(li_ming.needs_review)
+        self.assertEqual(li_ming.note, f'{GlossaryGenerator.CONFLICT_NOTE_PREFIX}Li Ming')
+        wang = Glossary.objects.get(novel=self.novel, term_cn='王')
+        self.assertEqual(wang.term_vi, 'Vương')
+        self.assertEqual(self.conflict_options('王'), ['Vua'])
+
+    def test_parallel_merge_follows_chapter_order(self):
+        summary = self.generator().generate(parallel=True, max_workers=3)
+
+        self.assertEqual(summary['total_batches'], self.CHAPTERS)
+        self.assertEqual(summary['checkpoint'], self.CHAPTERS)
+        li_ming = Glossary.objects.get(novel=self.novel, term_cn='李明')
+        self.assertEqual(li_ming.term_vi, 'Li Minh 1')
+        self.assertTrue(li_ming.needs_review)
+        self.assertEqual(self.conflict_options('李明'), [f'Li Minh {i}' for i in range(2, self.CHAPTERS + 1)])
+        self.assertFalse(Glossary.objects.get(novel=self.novel, term_cn='王').needs_review)
+        self.assertEqual(self.novel.glossaries.count(), 2 + self.CHAPTERS)
+
+    def test_parallel_matches_sequential(self):
+        self.generator().generate(parallel=True, max_workers=3)
+        parallel = list(self.novel.glossaries.order_by('term_cn').values_list('term_cn', 'term_vi', 'note'))
+
+        self.novel.glossaries.exclude(term_cn='王').delete()
+        Glossary.objects.filter(novel=self.novel).update(note='', needs_review=False)
+        self.generator().generate(start_from_checkpoint=False)
+        sequential = list(self.novel.glossaries.order_by('term_cn').values_list('term_cn', 'term_vi', 'note'))
+
+        self.assertEqual(parallel, sequential)
+
+    def test_resume_after_failed_batch(self):
+        self.fail_ordinals = {4}
+        with self.assertRaises(RuntimeError):
+            self.generator().generate(parallel=True, max_workers=3)
+
+        # Checkpoint chỉ tiến qua các batch đã gộp liên tục, batch sau batch lỗi chờ chạy lại
+        self.assertEqual(self.generator().get_checkpoint(), 3)
+        statuses = dict(GlossaryBatch.objects.filter(run__novel=self.novel).values_list('index', 'status'))
+        self.assertEqual([statuses[i] for i in (1, 2, 3, 4)], ['done', 'done', 'done', 'failed'])
+        self.assertNotIn('done', [statuses[i] for i in (5, 6)])
+        self.assertFalse(self.novel.glossaries.filter(term_cn='张5').exists())
+
+        self.fail_ordinals = set()
+        self.requested = []
+        summary = self.generator().generate(parallel=True, max_workers=3)
+
+        self.assertEqual(sorted(self.requested), [4, 5, 6])
+        self.assertEqual(summary['checkpoint'], self.CHAPTERS)
+        self.assertEqual(self.conflict_options('李明'), [f'Li Minh {i}' for i in range(2, self.CHAPTERS + 1)])
+        self.assertEqual(self.novel.glossaries.count(), 2 + self.CHAPTERS)
+
+
+class GenerateGlossaryCommandTests(FakeLLMTestCase):
+    """python manage.py generate_glossary"""
+
+    NAMES = ['李明轩', '赵云', '天元城']
+    COMMON = '的了是在我他她你们这那不一有着就也都说和地得个上下来去到又被把还很没天人大中小心手眼看走想知道时候'
+
+    def chapter_text(self, rng, length=3000):
+        parts = []
+        for _ in range(length):
+            parts.append(rng.choice(self.NAMES) if rng.random() < 0.05 else rng.choice(self.COMMON))
+            if rng.random() < 0.06:
+                parts.append('。')
+        return ''.join(parts)
+
+    def call(self, *args):
+        out = io.StringIO()
+        call_command('generate_glossary', '--novel-id', str(self.novel.id), *args, stdout=out)
+        return out.getvalue()
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(3)
+        self.novel = create_novel([self.chapter_text(rng) for _ in range(3)])
+
+    def test_unknown_novel(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_glossary', '--novel-id', '999999', stdout=io.StringIO())
+
+    def test_mine(self):
+        output = self.call('--mine')
+
+        self.assertIn('Ứng viên', output)
+        self.assertGreater(self.novel.glossaries.count(), 0)
+        self.assertIn(f'Terms mới: {self.novel.glossaries.count()}', output)
+        # Chế độ khai phá không tạo GlossaryRun (không gửi nội dung chapters theo batch)
+        self.assertFalse(self.novel.glossary_runs.exists())
+
+    def test_batch_size_limits_batch_tokens(self):
+        chapter_tokens = list(self.novel.chapters.order_by('ordinal').values_list('token_count', flat=True))
+        budget = chapter_tokens[0] + chapter_tokens[1]
+
+        output = self.call('--batch-size', str(budget))
+
+        batches = list(self.novel.glossary_runs.get().batches.order_by('index'))
+        self.assertEqual([(b.start_ordinal, b.end_ordinal) for b in batches], [(1, 2), (3, 3)])
+        self.assertTrue(all(b.status == 'done' for b in batches))
+        self.assertIn('Checkpoint: 3', output)
+
+
+class ParsePackedTranslationTests(TestCase):
+
+    def test_title_and_content_per_chapter(self):
+        text = (
+            "Ghi chú thừa trước chương đầu\n"
+            "###CHAPTER 11###\n###TITLE###\nChương 1: Khởi đầu\n###CONTENT###\nĐoạn một.\n\nĐoạn hai.\n\n"
+            "###CHAPTER 12###\nChỉ có nội dung, thiếu tiêu đề.\n"
+            "###CHAPTER 13###\n###TITLE###\nChương 3\n###CONTENT###\n\n"
+            "  ###CHAPTER 11###  \n###TITLE###\nBản lặp\n###CONTENT###\nBị bỏ qua.\n"
+        )
+
+        self.assertEqual(parse_packed_translation(text), {
+            '11': ('Chương 1: Khởi đầu', 'Đoạn một.\n\nĐoạn hai.'),
+            '12': ('', 'Chỉ có nội dung, thiếu tiêu đề.'),
+        })
+
+    def test_no_markers(self):
+        self.assertEqual(parse_packed_translation('Không có chương nào'), {})
+        self.assertEqual(parse_packed_translation(None), {})
+
+
+class ChapterPackTests(FakeLLMTestCase):
+    """Gộp chapters ngắn vào một request và dịch riêng chapter bị thiếu trong kết quả"""
+
+    def setUp(self):
+        super().setUp()
+        self.novel = create_novel([f'第{i}段。\n' + '李明来了。\n他走了。\n' * 20 for i in range(1, 8)])
+        self.chapters = list(self.novel.chapters.order_by('ordinal'))
+        self.translator = ChapterTranslator(self.novel)
+
+    def pack_tokens(self, chapter):
+        return chapter.token_count + estimate_tokens(chapter.title) + PACK_MARKER_TOKENS
+
+    @override_settings(TRANSLATION_PACK_MAX_CHAPTERS=3)
+    def test_packs_limited_by_max_chapters(self):
+        packs = list(self.translator.iter_packs(self.chapters))
+        self.assertEqual([len(pack) for pack in packs], [3, 3, 1])
+        self.assertEqual([chapter for pack in packs for chapter in pack], self.chapters)
+
+    @override_settings(TRANSLATION_PACK_MAX_CHAPTERS=3)
+    def test_long_and_translated_chapters_stand_alone(self):
+        long_chapter = self.chapters[1]
+        long_chapter.content_raw = '李明走了很远的路。' * 2000
+        long_chapter.save()
+        Segment.objects.create(chapter=self.chapters[4], index=1, content_raw='x', translation='y')
+
+        packs = list(self.translator.iter_packs(self.chapters))
+        self.assertEqual(
+            [[chapter.index for chapter in pack] for pack in packs],
+            [[1], [2], [3, 4], [5], [6, 7]]
+        )
+        self.assertEqual([len(pack) for pack in self.translator.iter_packs(self.chapters, pack=False)], [1] * 7)
+
+    @override_settings(TRANSLATION_PACK_MAX_CHAPTERS=8, SEGMENT_MAX_TOKENS=1)
+    def test_packs_limited_by_token_budget(self):
+        budget = SegmentProcessor.segment_budget()  # SEGMENT_MAX_TOKENS nhỏ -> MIN_SEGMENT_TOKENS
+        per_chapter = self.pack_tokens(self.chapters[0])
+        per_pack = budget // per_chapter
+
+        packs = list(self.translator.iter_packs(self.chapters))
+        self.assertTrue(1 < per_pack < len(self.chapters))
+        self.assertEqual([len(pack) for pack in packs[:-1]], [per_pack] * (len(packs) - 1))
+        for pack in packs:
+            self.assertLessEqual(sum(self.pack_tokens(chapter) for chapter in pack), budget)
+
+    def test_missing_chapter_falls_back_to_translate_chapter(self):
+        pack = self.chapters[:3]
+        missing = pack[1]
+
+        def drop_one(**request):
+            translations = ai_client.translate_pack(**request)
+            translations.pop(str(missing.id))
+            return translations
+
+        with mock.patch('core.utils.chapter_translator.translate_pack', side_effect=drop_one), \
+                mock.patch.object(self.translator, 'translate_chapter', wraps=self.translator.translate_chapter) as single:
+            result = self.translator.translate_pack(pack)
+
+        self.assertEqual(result['translated'], [pack[0].id, pack[2].id])
+        self.assertEqual(result['fallback'], [missing.id])
+        single.assert_called_once_with(missing, force=True, escalation=None)
+        for chapter in pack:
+            chapter = Chapter.objects.get(pk=chapter.id)
+            self.assertTrue(chapter.has_translation)
+            self.assertTrue(chapter.full_translation)
+        for chapter in (pack[0], pack[2]):
+            chapter = Chapter.objects.get(pk=chapter.id)
+            self.assertEqual(chapter.segments.count(), 1)
+            self.assertTrue(chapter.title_translation.startswith(f'Chương {chapter.index}'))
+
+
+class ClassifyErrorTests(TestCase):
+
+    def test_http_errors(self):
+        self.assertEqual(resilience.classify_error(FakeLLMError(429, 'RESOURCE_EXHAUSTED')), resilience.RATE_LIMIT)
+        self.assertEqual(resilience.classify_error(FakeLLMError(503, 'UNAVAILABLE')), resilience.TRANSIENT)
+        self.assertEqual(resilience.classify_error(FakeLLMError(500, 'INTERNAL')), resilience.TRANSIENT)
+        self.assertEqual(resilience.classify_error(FakeLLMError(401, 'UNAUTHENTICATED')), resilience.AUTH)
+        self.assertEqual(resilience.classify_error(FakeLLMError(403, 'PERMISSION_DENIED')), resilience.AUTH)
+        self.assertEqual(resilience.classify_error(FakeLLMError(400, 'INVALID_ARGUMENT')), resilience.FATAL)
+
+    def test_errors_without_status(self):
+        self.assertEqual(resilience.classify_error(TimeoutError()), resilience.TRANSIENT)
+        self.assertEqual(resilience.classify_error(Exception('Quota exceeded')), resilience.RATE_LIMIT)
+        self.assertEqual(resilience.classify_error(Exception('Server overloaded, try again')), resilience.TRANSIENT)
+        self.assertEqual(resilience.classify_error(ValueError('bad prompt')), resilience.FATAL)
+
+    def test_retry_after(self):
+        self.assertEqual(resilience.retry_after_seconds(FakeLLMError(429, 'RESOURCE_EXHAUSTED', retry_after=7)), 7.0)
+        self.assertIsNone(resilience.retry_after_seconds(FakeLLMError(503, 'UNAVAILABLE')))
+
+
+class BackoffDelayTests(TestCase):
+
+    @override_settings(LLM_BACKOFF_BASE=1.0, LLM_BACKOFF_MAX=5.0)
+    def test_bounds(self):
+        random.seed(0)
+        for attempt in range(8):
+            ceiling = min(5.0, 2 ** attempt)
+            delays = [resilience.backoff_delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= ceiling for delay in delays))
+            self.assertGreater(max(delays), ceiling / 2)  # Full jitter trải khắp khoảng
+
+
+@override_settings(LLM_BREAKER_THRESHOLD=3, LLM_BREAKER_COOLDOWN=300, LLM_RATE_LIMIT_COOLDOWN=60)
+class KeyCircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        self.breaker = resilience.KeyCircuitBreaker('test', 1)
+        self.now = 1000.0
+        clock = mock.patch('core.utils.resilience.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_opens_after_consecutive_transient_errors(self):
+        self.assertFalse(self.breaker.record_failure(resilience.TRANSIENT))
+        self.assertFalse(self.breaker.record_failure(resilience.TRANSIENT))
+        self.assertFalse(self.breaker.is_open())
+        self.assertTrue(self.breaker.record_failure(resilience.TRANSIENT))
+        self.assertTrue(self.breaker.is_open())
+        self.assertEqual(self.breaker.open_until(), 1300.0)
+
+    def test_cooldown_then_half_open(self):
+        self.assertTrue(self.breaker.record_failure(resilience.RATE_LIMIT, retry_after=30))
+        self.assertTrue(self.breaker.is_open())
+
+        self.now += 31
+        self.assertFalse(self.breaker.is_open())
+        # Half-open: lỗi tiếp theo mở lại ngay, thành công thì đóng hẳn
+        self.assertTrue(self.breaker.record_failure(resilience.RATE_LIMIT))
+        self.assertEqual(self.breaker.open_until(), self.now + 60)
+        self.now += 61
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.record_failure(resilience.TRANSIENT))
+
+    def test_auth_opens_immediately(self):
+        self.assertTrue(self.breaker.record_failure(resilience.AUTH))
+        self.assertEqual(self.breaker.open_until(), 1300.0)
+
+
+class _ListPool(resilience.APIKeyPool):
+    """Pool của các APIKey 'test', client chính là chuỗi key"""
+
+    def _make_client(self, api_key):
+        return api_key
+
+
+@override_settings(LLM_MAX_RETRIES=4, LLM_BREAKER_THRESHOLD=3)
+class CallWithRetriesTests(TestCase):
+
+    def setUp(self):
+        self.keys = [APIKey.objects.create(provider='test', key=f'key-{i}') for i in (1, 2)]
+        self.pool = _ListPool('test')
+        self.calls = []
+        sleep = mock.patch('core.utils.resilience.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+        silence_stdout(self)
+
+    def failing_on(self, errors):
+        """func(client) raise errors[client] (nếu có), ngược lại trả về client"""
+        def func(client):
+            self.calls.append(client)
+            if client in errors:
+                raise errors[client]
+            return client
+        return func
+
+    def test_rate_limit_fails_over_to_second_key(self):
+        error = FakeLLMError(429, 'RESOURCE_EXHAUSTED', retry_after=30)
+        result = resilience.call_with_retries(self.pool, self.failing_on({'key-1': error}))
+
+        self.assertEqual(result, 'key-2')
+        self.assertEqual(self.calls, ['key-1', 'key-2'])
+        self.assertTrue(self.pool.breaker(self.keys[0].id).is_open())
+        self.assertFalse(self.pool.breaker(self.keys[1].id).is_open())
+        self.sleep.assert_called_once_with(0)
+        # Lần gọi sau bỏ qua key đang bị khóa
+        self.assertEqual(resilience.call_with_retries(self.pool, self.failing_on({})), 'key-2')
+
+    def test_transient_errors_back_off(self):
+        errors = {'key-1': FakeLLMError(503, 'UNAVAILABLE'), 'key-2': FakeLLMError(503, 'UNAVAILABLE')}
+        func = self.failing_on(errors)
+
+        def recover(client):
+            if len(self.calls) == 2:
+                errors.clear()
+            return func(client)
+
+        self.assertEqual(resilience.call_with_retries(self.pool, recover), 'key-1')
+        self.assertEqual(self.calls, ['key-1', 'key-2', 'key-1'])
+        self.assertEqual(self.sleep.call_count, 2)
+        self.assertFalse(self.pool.breaker(self.keys[0].id).is_open())
+
+    def test_fatal_error_is_not_retried(self):
+        with self.assertRaises(FakeLLMError):
+            resilience.call_with_retries(self.pool, self.failing_on({'key-1': FakeLLMError(400, 'INVALID_ARGUMENT')}))
+        self.assertEqual(self.calls, ['key-1'])
+        self.assertFalse(self.pool.breaker(self.keys[0].id).is_open())
+
+    def test_all_keys_unavailable(self):
+        error = FakeLLMError(429, 'RESOURCE_EXHAUSTED', retry_after=600)
+        with self.assertRaises(resilience.AllKeysUnavailable) as raised:
+            resilience.call_with_retries(
+                self.pool, self.failing_on({'key-1': error, 'key-2': error}), max_wait=0
+            )
+        self.assertEqual(self.calls, ['key-1', 'key-2'])
+        self.assertGreater(raised.exception.wait, 500)
+
+
+class GlossarySubstituterTests(TestCase):
+
+    def setUp(self):
+        self.substituter = GlossarySubstituter([
+            ('李明', 'Lý Minh'), ('李明轩', 'Lý Minh Hiên'), ('Li', 'Lý'), ('李明', 'Bị bỏ qua'), ('王', ''),
+        ])
+
+    def test_longest_match_first(self):
+        self.assertEqual(self.substituter.substitute('李明轩'), ('Lý Minh Hiên', 1))
+        self.assertEqual(
+            self.substituter.substitute('Hắn là 李明轩, bạn của 李明.'),
+            ('Hắn là Lý Minh Hiên, bạn của Lý Minh.', 2)
+        )
+        self.assertEqual(self.substituter.substitute('李明李明轩'), ('Lý Minh Lý Minh Hiên', 2))
+
+    def test_only_han_spans(self):
+        # Term không phải chữ Hán (Li) nằm ngoài đoạn chữ Hán thì không bị thay
+        self.assertEqual(self.substituter.substitute('Li nói với 李明'), ('Li nói với Lý Minh', 1))
+        self.assertEqual(self.substituter.substitute('李明さん와李明'), ('Lý Minhさん와Lý Minh', 2))
+        # Chỉ quét các span được truyền vào
+        self.assertEqual(
+            self.substituter.substitute('李明 và 李明', spans=[(0, 2, 'chinese'), (6, 8, 'japanese')]),
+            ('Lý Minh và 李明', 1)
+        )
+
+    def test_spacing_and_counts(self):
+        self.assertEqual(self.substituter.substitute('Hắn gặp李明rồi'), ('Hắn gặp Lý Minh rồi', 1))
+        self.assertEqual(self.substituter.substitute('Không có chữ Hán'), ('Không có chữ Hán', 0))
+        self.assertEqual(self.substituter.substitute('王来了'), ('王来了', 0))
+        self.assertEqual(GlossarySubstituter([]).substitute('李明'), ('李明', 0))
+
+    def test_context_for_matching_terms(self):
+        self.assertEqual(self.substituter.context_for(['李明轩 đi', None, 'Li']), '李明轩 → Lý Minh Hiên\nLi → Lý')
+        self.assertEqual(self.substituter.context_for(['không có']), '')
+
+
+class IterSegmentsTests(TestCase):
+    """Bất biến của SegmentProcessor.iter_segments"""
+
+    HAN = '的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会'
+    WORDS = 'hắn nàng kiếm khí linh lực tu luyện sư phụ đệ tử tông môn cảnh giới'.split()
+
+    def sentence(self, rng, max_chars=40):
+        if rng.random() < 0.2:
+            return ' '.join(rng.choice(self.WORDS) for _ in range(rng.randint(3, max_chars // 2))) + '.'
+        return ''.join(rng.choice(self.HAN) for _ in range(rng.randint(3, max_chars))) + rng.choice('。！？')
+
+    def novel_text(self, rng, paragraphs, sentences=(1, 6), max_chars=40):
+        return '\n\n'.join(
+            ''.join(self.sentence(rng, max_chars) for _ in range(rng.randint(*sentences)))
+            for _ in range(paragraphs)
+        )
+
+    def segments(self, text, max_tokens):
+        return list(SegmentProcessor.iter_segments(text, max_tokens))
+
+    def assert_reproduces(self, text, segments):
+        """Mỗi segment là một lát cắt liên tiếp của văn bản, giữa các lát chỉ có khoảng trắng"""
+        position = 0
+        for segment in segments:
+            start = text.index(segment, position)
+            self.assertEqual(text[position:start].strip(), '')
+            position = start + len(segment)
+        self.assertEqual(text[position:].strip(), '')
+
+    def optimal_count(self, text, max_tokens):
+        """Số segments ít nhất khi chỉ cắt ở cuối câu (gom tham lam là tối ưu)"""
+        count, current = 0, max_tokens + 1
+        for _start, _end, tokens in SegmentProcessor.iter_sentences(text):
+            if current + tokens > max_tokens:
+                count, current = count + 1, 0
+            current += tokens
+        return count
+
+    def test_invariants_on_random_texts(self):
+        rng = random.Random(7)
+        for case in range(60):
+            text = self.novel_text(rng, rng.randint(5, 80))
+            max_tokens = rng.choice([120, 300, 800, 2000])
+            segments = self.segments(text, max_tokens)
+
+            with self.subTest(case=case, max_tokens=max_tokens):
+                self.assert_reproduces(text, segments)
+                for segment in segments:
+                    self.assertLessEqual(estimate_tokens(segment), max_tokens)
+                self.assertEqual(len(segments), max(self.optimal_count(text, max_tokens), 1))
+                self.assertGreaterEqual(len(segments), math.ceil(estimate_tokens(text) / max_tokens))
+
+    def test_minimum_count_when_achievable(self):
+        rng = random.Random(11)
+        checked = 0
+        for _ in range(40):
+            text = self.novel_text(rng, rng.randint(20, 60), max_chars=12)
+            max_tokens = rng.choice([300, 500, 1000])
+            minimum = math.ceil(estimate_tokens(text) / max_tokens)
+            if self.optimal_count(text, max_tokens) != minimum:
+                continue
+            checked += 1
+            self.assertEqual(len(self.segments(text, max_tokens)), minimum)
+        self.assertGreater(checked, 20)
+
+    def test_balanced_sizes(self):
+        text = self.novel_text(random.Random(3), 60, max_chars=12)
+        segments = self.segments(text, 1000)
+        sizes = [token_weight(segment) for segment in segments]
+        self.assertEqual(len(segments), math.ceil(estimate_tokens(text) / 1000))
+        self.assertLess(max(sizes) - min(sizes), 100)
+
+    def test_cuts_at_paragraph_ends(self):
+        rng = random.Random(5)
+        paragraphs = [
+            ''.join(''.join(rng.choice(self.HAN) for _ in range(12)) + '。' for _ in range(6))
+            for _ in range(10)
+        ]
+        text = '\n\n'.join(paragraphs)
+
+        # Cắt giữa đoạn văn cũng không giảm được số segments (3) -> chỉ cắt ở cuối đoạn
+        segments = self.segments(text, 300)
+        self.assertEqual(len(segments), 3)
+        for segment in segments:
+            # Cắt ở cuối đoạn văn, xuống dòng giữa các đoạn trong segment được giữ nguyên
+            self.assertTrue(set(segment.split('\n\n')) <= set(paragraphs))
+        self.assertEqual('\n\n'.join(segments), text)
+
+    def test_long_sentence_stands_alone(self):
+        long_sentence = self.HAN * 20 + '。'
+        text = '短句。' * 30 + '\n' + long_sentence + '\n' + '短句。' * 30
+
+        segments = self.segments(text, 200)
+        self.assert_reproduces(text, segments)
+        self.assertIn(long_sentence, segments)
+        for segment in segments:
+            if segment != long_sentence:
+                self.assertLessEqual(estimate_tokens(segment), 200)
+
+    def test_short_text_single_segment(self):
+        self.assertEqual(self.segments('  李明走了。\n他回来了。  ', 100), ['李明走了。\n他回来了。'])
+        self.assertEqual(self.segments('   ', 100), [])
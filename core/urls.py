@@ -20,10 +20,21 @@ urlpatterns = [
     path('chapter/<int:chapter_id>/prepare/', views.prepare_chapter_view, name='prepare_chapter'),
     path('chapter/<int:chapter_id>/translate/', views.translate_chapter_auto_view, name='translate_chapter'),
     path('chapter/<int:chapter_id>/retranslate/', views.retranslate_chapter_view, name='retranslate_chapter'),
+    path('chapter/<int:chapter_id>/translate/stream/', views.translate_chapter_stream_view, name='translate_chapter_stream'),
+    path('chapter/<int:chapter_id>/finalize/', views.finalize_chapter_view, name='finalize_chapter'),
+    path('chapter/<int:chapter_id>/segments/', views.chapter_segments_api_view, name='chapter_segments_api'),
+    path('chapter/<int:chapter_id>/translation/', views.chapter_translation_api_view, name='chapter_translation_api'),
+    path('novel/<int:novel_id>/prepare/', views.prepare_novel_view, name='prepare_novel'),
+    path('novel/<int:novel_id>/translate-all/', views.translate_novel_view, name='translate_novel'),
     
     path('segment/<int:segment_id>/translate/', views.translate_segment_view, name='translate_segment'),
     path('segment/<int:segment_id>/retranslate/', views.retranslate_segment_view, name='retranslate_segment'),
+    path('segment/<int:segment_id>/translate/stream/', views.translate_segment_stream_view, name='translate_segment_stream'),
     path('segment/<int:segment_id>/highlight-foreign/', views.highlight_foreign_chars_view, name='highlight_foreign'),
+    path('novel/<int:novel_id>/scan-foreign/', views.scan_foreign_chars_view, name='scan_foreign_chars'),
+    
+    # Background jobs
+    path('jobs/<str:job_id>/', views.job_status_view, name='job_status'),
     
     # Translation style endpoint
     path('novel/<int:novel_id>/update-translation-style/', views.update_translation_style_view, name='update_translation_style'),
@@ -1,49 +1,111 @@
 
 """
 AI Client cho việc dịch và review translation
-Sử dụng Gemini API với rotation key tự động
+Provider (Gemini, OpenAI-compatible, Anthropic) được chọn theo từng request bởi llm_router,
+mỗi provider tự retry và đổi key khi bị rate limit
+Phần đầu prompt dịch cố định theo novel được gửi riêng (prefix) để provider cache lại
 """
-from typing import Tuple
-from .gemini_client import translate_with_gemini, review_with_gemini, get_gemini_client
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .gemini_client import (
+    _parse_title_content,
+    build_packed_translation_prefix,
+    build_packed_translation_suffix,
+    build_review_prompt,
+    build_translation_prefix,
+    build_translation_suffix,
+    parse_packed_translation,
+    parse_review_score,
+)
+from .llm_router import get_router
+
+
+def translate_segment(
+    source_text: str,
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = ""
+) -> Tuple[str, str]:
+    """
+    Dịch một segment bằng provider được router chọn (tham số giống translate_with_gemini)
+
+    Returns:
+        Tuple (title_translation, content_translation)
+    """
+    try:
+        text, _usage = get_router().complete(
+            'translate', build_translation_suffix(source_text, pre_chapters), temperature=0.3,
+            output_ratio=getattr(settings, 'TRANSLATION_OUTPUT_RATIO', 1.8),
+            prefix=build_translation_prefix(glossary_context, translation_style)
+        )
+    except Exception as e:
+        raise Exception(f"Lỗi khi dịch: {str(e)}")
+    return _parse_title_content(text.strip())
+
+
+def translate_pack(
+    chapters: List[Tuple[str, str, str]],
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = ""
+) -> Dict:
+    """
+    Dịch nhiều chương ngắn trong một request (tham số giống translate_pack_with_gemini)
+
+    Returns:
+        Dict {id: (title_translation, content_translation)}
+    """
+    try:
+        text, _usage = get_router().complete(
+            'translate', build_packed_translation_suffix(chapters, pre_chapters), temperature=0.3,
+            output_ratio=getattr(settings, 'TRANSLATION_OUTPUT_RATIO', 1.8),
+            prefix=build_packed_translation_prefix(glossary_context, translation_style)
+        )
+    except Exception as e:
+        raise Exception(f"Lỗi khi dịch: {str(e)}")
+    return parse_packed_translation(text)
 
 
 def translate_text(source_text: str, glossary_context: str = "", pre_chapters: str = "") -> str:
     """
-    Dịch văn bản từ tiếng Trung sang tiếng Việt bằng Gemini
-    
+    Dịch văn bản từ tiếng Trung sang tiếng Việt
+
     Args:
         source_text: Văn bản gốc cần dịch
         glossary_context: Glossary thuật ngữ để dịch chính xác
         pre_chapters: Các chương đã dịch trước đó để tham khảo
-    
+
     Returns:
         Bản dịch tiếng Việt (chỉ content, không có title)
     """
-    try:
-        title_trans, content_trans = translate_with_gemini(
-            source_text=source_text,
-            glossary_context=glossary_context,
-            pre_chapters=pre_chapters
-        )
-        # Trả về content, hoặc cả title+content nếu cần
-        return content_trans if content_trans else title_trans
-    except Exception as e:
-        raise Exception(f"Lỗi khi dịch: {str(e)}")
+    title_trans, content_trans = translate_segment(
+        source_text=source_text,
+        glossary_context=glossary_context,
+        pre_chapters=pre_chapters
+    )
+    # Trả về content, hoặc cả title+content nếu cần
+    return content_trans if content_trans else title_trans
 
 
-def review_translation(source_text: str, translated_text: str) -> Tuple[float, str]:
+def review_translation(source_text: str, translated_text: str) -> Tuple[Optional[float], str]:
     """
-    Review chất lượng bản dịch và cho điểm bằng Gemini
-    
+    Review chất lượng bản dịch và cho điểm
+
     Args:
         source_text: Văn bản gốc (tiếng Trung)
         translated_text: Bản dịch (tiếng Việt)
-    
+
     Returns:
         Tuple of (score: float 0-100, review_report: str)
+        score = None nếu review thất bại (không ghi đè điểm cũ)
     """
     try:
-        score, report = review_with_gemini(source_text, translated_text)
-        return score, report
+        text, _usage = get_router().complete(
+            'review', build_review_prompt(source_text, translated_text), temperature=0.2, output_ratio=0.05
+        )
+        review_text = text.strip()
+        return parse_review_score(review_text), review_text
     except Exception as e:
-        return 0.0, f"Lỗi khi review: {str(e)}"
\ No newline at end of file
+        return None, f"Lỗi khi review: {str(e)}"
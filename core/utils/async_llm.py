@@ -0,0 +1,79 @@
+"""
+Chạy code gọi LLM từ async view mà không chặn event loop (chạy bằng ASGI: uvicorn, gunicorn + UvicornWorker)
+- Client LLM (google-genai, openai, requests) và pipeline dịch/review đều đồng bộ -> chạy trong thread pool riêng
+  (LLM_ASYNC_THREADS thread), event loop chỉ chờ kết quả nên vẫn phục vụ các request khác
+- Dưới ASGI mọi view đồng bộ của Django dùng chung một thread: view gọi LLM phải là async, nếu không một lần
+  "Dịch chapter" sẽ chặn cả các lần tải trang
+- Mỗi thread có DB connection riêng, đóng theo CONN_MAX_AGE trước/sau mỗi lần chạy (giống jobs.start_job)
+- contextvars (trace_context của llm_tracing) được copy sang thread
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+
+
+def llm_executor() -> ThreadPoolExecutor:
+    """Thread pool dùng chung cho các lần gọi LLM từ async view (tạo khi cần)"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'LLM_ASYNC_THREADS', 16),
+            thread_name_prefix='llm'
+        )
+    return _executor
+
+
+def _with_connections(func: Callable) -> Callable:
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return run
+
+
+async def run_llm(func: Callable, *args, **kwargs) -> Any:
+    """
+    await func(*args, **kwargs) chạy trong thread pool LLM (func đồng bộ, có thể gọi LLM và ORM)
+
+    Usage:
+        title, content = await run_llm(translator.translate_request, request)
+    """
+    return await sync_to_async(_with_connections(func), thread_sensitive=False, executor=llm_executor())(*args, **kwargs)
+
+
+async def iterate_in_thread(iterable: Iterable) -> AsyncIterator:
+    """
+    Đọc một iterator đồng bộ (VD generator stream dịch) từ async code, mỗi phần tử lấy trong thread pool LLM
+    Async iterator bị đóng giữa chừng (client ngắt SSE) thì iterator đồng bộ được close() trong thread pool,
+    sau khi lần next() đang chạy (nếu có) xong
+    """
+    iterator = iter(iterable)
+    lock = threading.Lock()
+    done = object()
+
+    def step():
+        with lock:
+            return next(iterator, done)
+
+    def close():
+        with lock:
+            iterator.close()
+
+    try:
+        while True:
+            item = await run_llm(step)
+            if item is done:
+                return
+            yield item
+    finally:
+        if hasattr(iterator, 'close'):
+            # Không await: khi bị hủy, chỉ cần lên lịch đóng iterator
+            llm_executor().submit(_with_connections(close))
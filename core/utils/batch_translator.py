@@ -0,0 +1,467 @@
+"""
+Dịch offline cả novel qua batch API của provider (không cần độ trễ tương tác, giá thường rẻ hơn ~50%)
+1. submit: chia segments, ghi prompt của mọi segment chưa dịch vào file JSONL theo format batch của provider và gửi job
+2. poll: hỏi trạng thái job, xong thì tải file kết quả
+3. ingest: hậu xử lý như dịch thường, ghi bản dịch vào Segment bằng bulk_update, gộp bản dịch chapter
+
+Backend: gemini (Gemini Batch API), openai (OpenAI Batch API hoặc server tương thích có /v1/batches),
+local (giả lập bằng file + FakeLLM, không cần mạng/API key - để test)
+"""
+import json
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import LLMCallLog, Novel, Segment, TranslationBatch
+from .chapter_translator import ChapterTranslator, previous_chapters_context
+from .gemini_client import _parse_title_content, build_translation_prompt
+from .llm_router import usage_cost
+
+KEY_PREFIX = 'segment-'
+
+
+def batch_dir(novel: Novel) -> Path:
+    path = Path(getattr(settings, 'BATCH_TRANSLATION_DIR', settings.BASE_DIR / 'batch_jobs')) / f'novel_{novel.id}'
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class BatchBackend:
+    """
+    Interface chung cho batch API của provider
+    Mỗi dòng kết quả được parse thành (key, text, usage, error) - text None khi request lỗi
+    """
+
+    name = ''
+
+    def __init__(self, key_id: Optional[int] = None):
+        self.key_id = key_id
+
+    def model(self) -> str:
+        raise NotImplementedError
+
+    def write_input(self, path: Path, requests: List[Tuple[str, str]], model: str, temperature: float = 0.3):
+        """Ghi file JSONL, mỗi dòng một request (key, prompt)"""
+        raise NotImplementedError
+
+    def submit(self, path: Path, model: str) -> str:
+        """Gửi job, trả về job id (self.key_id được gán key đã dùng)"""
+        raise NotImplementedError
+
+    def status(self, job_id: str) -> Tuple[str, str]:
+        """Trả về (trạng thái: running/succeeded/failed/cancelled, thông báo lỗi)"""
+        raise NotImplementedError
+
+    def download(self, job_id: str, path: Path):
+        raise NotImplementedError
+
+    def parse_output(self, path: Path) -> Iterator[Tuple[str, Optional[str], Dict, str]]:
+        raise NotImplementedError
+
+
+class GeminiBatchBackend(BatchBackend):
+    """Gemini Batch API: file JSONL {key, request: GenerateContentRequest} upload qua Files API"""
+
+    name = 'gemini'
+    STATES = {
+        'JOB_STATE_SUCCEEDED': 'succeeded',
+        'JOB_STATE_FAILED': 'failed',
+        'JOB_STATE_EXPIRED': 'failed',
+        'JOB_STATE_CANCELLED': 'cancelled',
+    }
+
+    def _client(self):
+        from .gemini_client import get_gemini_manager
+        manager = get_gemini_manager()
+        if self.key_id is None:
+            client, self.key_id = manager.get_client()
+            return client
+        return manager.client_for(self.key_id)
+
+    def model(self) -> str:
+        return getattr(settings, 'TRANSLATION_MODEL', 'gemini-2.5-pro')
+
+    def write_input(self, path, requests, model, temperature=0.3):
+        from .gemini_client import _safety_settings
+        safety = [
+            {'category': setting.category.value, 'threshold': setting.threshold.value}
+            for setting in _safety_settings()
+        ]
+        with open(path, 'w', encoding='utf-8') as f:
+            for key, prompt in requests:
+                f.write(json.dumps({
+                    'key': key,
+                    'request': {
+                        'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+                        'generation_config': {'temperature': temperature},
+                        'safety_settings': safety,
+                    },
+                }, ensure_ascii=False) + '\n')
+
+    def submit(self, path, model):
+        from google.genai import types
+        client = self._client()
+        uploaded = client.files.upload(
+            file=str(path), config=types.UploadFileConfig(display_name=path.name, mime_type='jsonl')
+        )
+        job = client.batches.create(
+            model=model, src=uploaded.name, config=types.CreateBatchJobConfig(display_name=path.stem)
+        )
+        return job.name
+
+    def status(self, job_id):
+        job = self._client().batches.get(name=job_id)
+        state = getattr(job.state, 'name', str(job.state))
+        error = getattr(job, 'error', None)
+        return self.STATES.get(state, 'running'), str(error) if error else ''
+
+    def download(self, job_id, path):
+        client = self._client()
+        job = client.batches.get(name=job_id)
+        path.write_bytes(client.files.download(file=job.dest.file_name))
+
+    def parse_output(self, path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get('response')
+                if not response:
+                    yield item.get('key', ''), None, {}, json.dumps(item.get('error') or item, ensure_ascii=False)
+                    continue
+                candidates = response.get('candidates') or [{}]
+                parts = (candidates[0].get('content') or {}).get('parts') or []
+                usage = response.get('usageMetadata') or response.get('usage_metadata') or {}
+                yield item.get('key', ''), ''.join(part.get('text', '') for part in parts), {
+                    'prompt_tokens': usage.get('promptTokenCount') or usage.get('prompt_token_count') or 0,
+                    'output_tokens': usage.get('candidatesTokenCount') or usage.get('candidates_token_count') or 0,
+                }, ''
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI Batch API: file JSONL {custom_id, method, url, body} cho /v1/chat/completions, cửa sổ 24h"""
+
+    name = 'openai'
+    STATES = {
+        'completed': 'succeeded',
+        'failed': 'failed',
+        'expired': 'failed',
+        'cancelling': 'cancelled',
+        'cancelled': 'cancelled',
+    }
+
+    def _provider(self):
+        from .llm_providers import get_providers
+        provider = get_providers().get('openai')
+        if provider is None:
+            raise ValueError("⚠️ Không có API key active nào cho provider openai!")
+        return provider
+
+    def _client(self):
+        keys = self._provider().keys
+        if self.key_id is None:
+            client, self.key_id = keys.get_client()
+            return client
+        return keys.client_for(self.key_id)
+
+    def model(self) -> str:
+        return self._provider().model_for('translate')
+
+    def write_input(self, path, requests, model, temperature=0.3):
+        with open(path, 'w', encoding='utf-8') as f:
+            for key, prompt in requests:
+                f.write(json.dumps({
+                    'custom_id': key,
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': {
+                        'model': model,
+                        'messages': [{'role': 'user', 'content': prompt}],
+                        'temperature': temperature,
+                    },
+                }, ensure_ascii=False) + '\n')
+
+    def submit(self, path, model):
+        client = self._client()
+        with open(path, 'rb') as f:
+            uploaded = client.files.create(file=f, purpose='batch')
+        job = client.batches.create(
+            input_file_id=uploaded.id, endpoint='/v1/chat/completions', completion_window='24h'
+        )
+        return job.id
+
+    def status(self, job_id):
+        job = self._client().batches.retrieve(job_id)
+        errors = getattr(job, 'errors', None)
+        error = '; '.join(e.message or '' for e in (getattr(errors, 'data', None) or [])) if errors else ''
+        return self.STATES.get(job.status, 'running'), error
+
+    def download(self, job_id, path):
+        client = self._client()
+        job = client.batches.retrieve(job_id)
+        # Request lỗi nằm trong file lỗi riêng
+        content = ''.join(
+            client.files.content(file_id).text
+            for file_id in (job.output_file_id, job.error_file_id) if file_id
+        )
+        path.write_text(content, encoding='utf-8')
+
+    def parse_output(self, path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get('response') or {}
+                body = response.get('body') or {}
+                if item.get('error') or response.get('status_code') != 200:
+                    error = item.get('error') or body.get('error') or f"HTTP {response.get('status_code')}"
+                    yield item.get('custom_id', ''), None, {}, json.dumps(error, ensure_ascii=False)
+                    continue
+                usage = body.get('usage') or {}
+                yield item.get('custom_id', ''), body['choices'][0]['message'].get('content') or '', {
+                    'prompt_tokens': usage.get('prompt_tokens') or 0,
+                    'output_tokens': usage.get('completion_tokens') or 0,
+                }, ''
+
+
+class LocalBatchBackend(OpenAIBatchBackend):
+    """
+    Giả lập batch API bằng file (format giống OpenAI): job là một thư mục trong BATCH_TRANSLATION_DIR/local,
+    lần poll đầu tiên xử lý toàn bộ file bằng FakeLLM (settings.LLM_FAKE, không chờ) - lỗi giả lập thành dòng lỗi
+    """
+
+    name = 'local'
+
+    def _job_dir(self, job_id: str) -> Path:
+        return Path(getattr(settings, 'BATCH_TRANSLATION_DIR', settings.BASE_DIR / 'batch_jobs')) / 'local' / job_id
+
+    def model(self) -> str:
+        return 'fake'
+
+    def submit(self, path, model):
+        job_id = f'local-{uuid.uuid4().hex[:12]}'
+        job_dir = self._job_dir(job_id)
+        job_dir.mkdir(parents=True)
+        shutil.copy(path, job_dir / 'input.jsonl')
+        return job_id
+
+    def _process(self, job_dir: Path):
+        from .fake_llm import FakeLLM, FakeLLMError
+        fake = FakeLLM({**(getattr(settings, 'LLM_FAKE', None) or {}), 'time_scale': 0})
+        with open(job_dir / 'input.jsonl', encoding='utf-8') as src, \
+                open(job_dir / 'output.jsonl.tmp', 'w', encoding='utf-8') as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                prompt = item['body']['messages'][0]['content']
+                try:
+                    text, usage = fake.generate(prompt)
+                except FakeLLMError as e:
+                    result = {'status_code': e.code, 'body': {'error': {'message': str(e)}}}
+                else:
+                    result = {'status_code': 200, 'body': {
+                        'choices': [{'message': {'role': 'assistant', 'content': text}}],
+                        'usage': {'prompt_tokens': usage['prompt_tokens'], 'completion_tokens': usage['output_tokens']},
+                    }}
+                dst.write(json.dumps({'custom_id': item['custom_id'], 'response': result}, ensure_ascii=False) + '\n')
+        (job_dir / 'output.jsonl.tmp').rename(job_dir / 'output.jsonl')
+
+    def status(self, job_id):
+        job_dir = self._job_dir(job_id)
+        if not (job_dir / 'input.jsonl').exists():
+            return 'failed', f'Không tìm thấy job {job_id}'
+        if not (job_dir / 'output.jsonl').exists():
+            self._process(job_dir)
+        return 'succeeded', ''
+
+    def download(self, job_id, path):
+        shutil.copy(self._job_dir(job_id) / 'output.jsonl', path)
+
+
+BATCH_BACKENDS = {
+    'gemini': GeminiBatchBackend,
+    'openai': OpenAIBatchBackend,
+    'local': LocalBatchBackend,
+}
+
+
+def get_backend(batch: TranslationBatch) -> BatchBackend:
+    return BATCH_BACKENDS[batch.provider](key_id=batch.api_key_id)
+
+
+def pending_segments(novel: Novel, limit: Optional[int] = None, force: bool = False) -> Iterator[Tuple[Segment, Dict]]:
+    """
+    Các segment cần dịch (chia segments nếu chapter chưa có) kèm tham số prompt
+    Ngữ cảnh các chương trước lấy theo bản dịch đã có lúc gửi (các chương trong cùng batch chưa có bản dịch)
+    force: gửi lại cả segment đã dịch, giữ nguyên segments hiện có (không chia lại) - bản dịch cũ chỉ bị ghi đè
+    khi ingest_batch có kết quả, job lỗi/hết hạn thì không mất gì
+    """
+    translator = ChapterTranslator(novel)
+    chapters = novel.chapters.exclude(content_raw__isnull=True).exclude(content_raw='').order_by('ordinal')
+    if not force:
+        chapters = chapters.exclude(pk__in=novel.chapters.translated().values('pk'))
+    if limit:
+        chapters = chapters[:limit]
+
+    for chapter in chapters:
+        pre_chapters = previous_chapters_context(chapter, limit=3)
+        translator.prepare_segments(chapter, pre_chapters)
+        for segment in chapter.segments.all():
+            if force or not segment.translation:
+                yield segment, translator.segment_request(segment, pre_chapters)
+
+
+def submit_batch(
+    novel: Novel,
+    provider: Optional[str] = None,
+    limit: Optional[int] = None,
+    force: bool = False
+) -> Optional[TranslationBatch]:
+    """
+    Ghi prompt của mọi segment chưa dịch vào file JSONL và gửi batch job
+
+    Returns:
+        TranslationBatch đã gửi, None nếu không còn segment nào cần dịch
+
+    Raises:
+        ValueError: Novel đang có batch chưa xong (tránh gửi trùng segment)
+    """
+    provider = provider or getattr(settings, 'BATCH_TRANSLATION_PROVIDER', 'gemini')
+    running = novel.translation_batches.exclude(status__in=('ingested', 'failed', 'cancelled')).first()
+    if running:
+        raise ValueError(f"⚠️ Novel đang có batch #{running.id} ({running.status}) chưa xong")
+
+    requests = [
+        (f'{KEY_PREFIX}{segment.id}', build_translation_prompt(**request))
+        for segment, request in pending_segments(novel, limit, force)
+    ]
+    if not requests:
+        return None
+
+    backend = BATCH_BACKENDS[provider]()
+    model = backend.model()
+    path = batch_dir(novel) / f"batch_{timezone.now():%Y%m%d_%H%M%S}_{provider}_input.jsonl"
+    backend.write_input(path, requests, model)
+
+    batch = TranslationBatch.objects.create(
+        novel=novel, provider=provider, model=model, input_file=str(path), request_count=len(requests)
+    )
+    try:
+        batch.job_id = backend.submit(path, model)
+    except Exception as e:
+        batch.status = 'failed'
+        batch.error = str(e)
+        batch.save(update_fields=['status', 'error'])
+        raise
+    batch.api_key_id = backend.key_id
+    batch.save(update_fields=['job_id', 'api_key_id'])
+    print(f"📤 Đã gửi batch #{batch.id}: {len(requests)} segments ({provider}, {model})")
+    return batch
+
+
+def ingest_batch(batch: TranslationBatch) -> Dict:
+    """
+    Tải kết quả job, hậu xử lý và ghi bản dịch vào các Segment bằng bulk_update
+
+    Returns:
+        Dict: translated_segments, merged_chapters, failed, substituted, repaired, foreign_warnings
+    """
+    backend = get_backend(batch)
+    path = Path(batch.input_file).with_name(Path(batch.input_file).name.replace('_input', '_output'))
+    backend.download(batch.job_id, path)
+
+    outputs = {}
+    usages = {}
+    errors = []
+    usage_totals = {'prompt_tokens': 0, 'output_tokens': 0}
+    for key, text, usage, error in backend.parse_output(path):
+        if not key.startswith(KEY_PREFIX):
+            continue
+        if text is None or not text.strip():
+            errors.append(f"{key}: {error or 'Kết quả rỗng'}")
+            continue
+        outputs[int(key[len(KEY_PREFIX):])] = text
+        usages[int(key[len(KEY_PREFIX):])] = usage
+        for field in usage_totals:
+            usage_totals[field] += usage.get(field, 0)
+
+    # Segment bị chia lại/xóa sau khi gửi thì bỏ qua
+    segments = list(Segment.objects.filter(pk__in=outputs, chapter__novel=batch.novel).select_related('chapter'))
+    translator = ChapterTranslator(batch.novel)
+    result = translator.save_segments(
+        (segment, *_parse_title_content(outputs[segment.id].strip())) for segment in segments
+    )
+    _log_calls(batch, segments, usages)
+
+    batch.status = 'ingested'
+    batch.output_file = str(path)
+    batch.translated_count = result['translated_segments']
+    batch.failed_count = batch.request_count - result['translated_segments']
+    batch.prompt_tokens = usage_totals['prompt_tokens']
+    batch.output_tokens = usage_totals['output_tokens']
+    batch.completed_at = timezone.now()
+    batch.error = '\n'.join(errors[:20])
+    batch.save()
+    print(f"📥 Batch #{batch.id}: đã ghi {batch.translated_count}/{batch.request_count} segments")
+    return {**result, 'failed': errors}
+
+
+def _log_calls(batch: TranslationBatch, segments: List[Segment], usages: Dict[int, Dict]):
+    """Ghi mỗi kết quả batch thành một LLMCallLog (sổ cái chi phí, xem usage_stats), giá nhân LLM_BATCH_PRICE_RATIO"""
+    if not getattr(settings, 'LLM_TRACE', True):
+        return
+    ratio = getattr(settings, 'LLM_BATCH_PRICE_RATIO', 0.5)
+    LLMCallLog.objects.bulk_create([
+        LLMCallLog(
+            operation='translate_batch',
+            provider=batch.provider,
+            model=batch.model,
+            # Key 0 = batch giả lập, không có trong bảng APIKey
+            api_key_id=batch.api_key_id or None,
+            novel_id=batch.novel_id,
+            chapter_id=segment.chapter_id,
+            segment_id=segment.id,
+            prompt_tokens=usages[segment.id].get('prompt_tokens', 0),
+            output_tokens=usages[segment.id].get('output_tokens', 0),
+            cost=usage_cost(batch.model, usages[segment.id]) * ratio,
+        )
+        for segment in segments
+    ], batch_size=500)
+
+
+def poll_batch(batch: TranslationBatch) -> TranslationBatch:
+    """Cập nhật trạng thái job từ provider, xong thì ingest kết quả"""
+    if batch.is_finished:
+        return batch
+    status, error = get_backend(batch).status(batch.job_id)
+    if status == 'succeeded':
+        ingest_batch(batch)
+    elif status != batch.status:
+        batch.status = status
+        batch.error = error
+        if status in ('failed', 'cancelled'):
+            batch.completed_at = timezone.now()
+        batch.save(update_fields=['status', 'error', 'completed_at'])
+    return batch
+
+
+def wait_batch(
+    batch: TranslationBatch,
+    interval: Optional[float] = None,
+    progress: Optional[Callable] = None
+) -> TranslationBatch:
+    """Poll đến khi job kết thúc (mặc định mỗi BATCH_TRANSLATION_POLL_INTERVAL giây)"""
+    interval = interval if interval is not None else getattr(settings, 'BATCH_TRANSLATION_POLL_INTERVAL', 60)
+    while not poll_batch(batch).is_finished:
+        if progress:
+            progress(batch)
+        time.sleep(interval)
+    return batch
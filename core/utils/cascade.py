@@ -0,0 +1,217 @@
+"""
+Dịch theo tầng (cascade): model nhanh (task 'translate_fast') dịch trước, bản dịch được kiểm tra cục bộ
+(format, ký tự ngoại ngữ, thuật ngữ glossary, tỉ lệ độ dài) - chỉ bản không đạt mới dịch lại bằng model mạnh (task 'translate')
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .gemini_client import (
+    _parse_title_content,
+    build_packed_translation_prefix,
+    build_packed_translation_suffix,
+    build_translation_prefix,
+    build_translation_suffix,
+    parse_packed_translation,
+)
+from .llm_router import get_router, usage_cost
+from .postprocess import GlossarySubstituter, foreign_char_count
+from .tokens import estimate_tokens
+
+FAST_TASK = 'translate_fast'
+STRONG_TASK = 'translate'
+CHECKS = ('format', 'foreign', 'glossary', 'length')
+
+MIN_LENGTH_CHECK_TOKENS = 50  # Bản gốc ngắn hơn thì không kiểm tra tỉ lệ độ dài
+
+
+def check_translation(
+    source_text: str,
+    title: str,
+    content: str,
+    glossary: Optional[GlossarySubstituter] = None,
+    parsed: bool = True
+) -> List[str]:
+    """
+    Kiểm tra cục bộ bản dịch (không gọi AI)
+
+    Args:
+        parsed: Output có đúng format ###TITLE###/###CONTENT### không
+
+    Returns:
+        Tên các kiểm tra không đạt (trong CHECKS), rỗng = đạt
+    """
+    failed = []
+    if not parsed or not content.strip():
+        failed.append('format')
+
+    if foreign_char_count(content) > getattr(settings, 'TRANSLATION_CASCADE_MAX_FOREIGN', 5):
+        failed.append('foreign')
+
+    if glossary and glossary.pattern:
+        terms = {match.group() for match in glossary.pattern.finditer(source_text)}
+        if terms:
+            translated = f"{title}\n{content}".lower()
+            missing = sum(1 for term in terms if glossary.mapping[term].lower() not in translated)
+            if missing / len(terms) > getattr(settings, 'TRANSLATION_CASCADE_GLOSSARY_MISS', 0.2):
+                failed.append('glossary')
+
+    source_tokens = estimate_tokens(source_text)
+    if source_tokens >= MIN_LENGTH_CHECK_TOKENS:
+        low, high = getattr(settings, 'TRANSLATION_CASCADE_LENGTH_RATIO', (0.8, 3.5))
+        ratio = estimate_tokens(f"{title}\n{content}") / source_tokens
+        if not low <= ratio <= high:
+            failed.append('length')
+
+    return failed
+
+
+def _call(task: str, prompt: Tuple[str, str]) -> Tuple[str, Dict]:
+    """Gọi router với prompt (prefix, suffix), usage có thêm seconds và cost (USD)"""
+    prefix, suffix = prompt
+    started = time.monotonic()
+    text, usage = get_router().complete(
+        task, suffix, temperature=0.3, output_ratio=getattr(settings, 'TRANSLATION_OUTPUT_RATIO', 1.8),
+        prefix=prefix
+    )
+    usage['seconds'] = time.monotonic() - started
+    usage['cost'] = usage_cost(usage['model'], usage)
+    return text, usage
+
+
+def _direct_estimate(usage: Dict) -> Tuple[float, float]:
+    """
+    Ước tính (giây, chi phí) nếu request đã được gửi thẳng cho model mạnh của cùng provider:
+    giá model mạnh x token thực tế, độ trễ theo số liệu router của task mạnh (chưa có thì bằng thời gian thực tế)
+    """
+    router = get_router()
+    provider = router.providers.get(usage['provider'])
+    strong_model = provider.model_for(STRONG_TASK) if provider else usage['model']
+    cost = usage_cost(strong_model, usage)
+
+    latency = router.stats(usage['provider'], STRONG_TASK)['latency']
+    seconds = latency * max(usage['output_tokens'] / 1000, 0.1) if latency is not None else usage['seconds']
+    return seconds, cost
+
+
+def _tier_info(failed_checks: List[str], fast: Dict, strong: Optional[Dict], share: float = 1.0) -> Dict:
+    """
+    Số liệu một lần cascade để ghi TranslationCascadeStats
+
+    Args:
+        share: Phần của request nhanh tính cho bản dịch này (chapter trong pack dùng chung một request)
+    """
+    if strong:
+        direct_seconds, direct_cost = strong['seconds'], strong['cost']
+    else:
+        direct_seconds, direct_cost = _direct_estimate(fast)
+        direct_seconds, direct_cost = direct_seconds * share, direct_cost * share
+    return {
+        'escalated': strong is not None,
+        'failed_checks': failed_checks,
+        'fast_seconds': fast['seconds'] * share,
+        'fast_cost': fast['cost'] * share,
+        'strong_seconds': strong['seconds'] if strong else 0.0,
+        'strong_cost': strong['cost'] if strong else 0.0,
+        'direct_seconds': direct_seconds,
+        'direct_cost': direct_cost,
+    }
+
+
+def translate_cascade(
+    source_text: str,
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = "",
+    glossary: Optional[GlossarySubstituter] = None
+) -> Tuple[str, str, Dict]:
+    """
+    Dịch một segment theo tầng (tham số giống translate_segment)
+
+    Returns:
+        Tuple (title_translation, content_translation, info cho TranslationCascadeStats)
+    """
+    prompt = (build_translation_prefix(glossary_context, translation_style),
+              build_translation_suffix(source_text, pre_chapters))
+    try:
+        text, fast = _call(FAST_TASK, prompt)
+        parsed = "###TITLE###" in text and "###CONTENT###" in text
+        title, content = _parse_title_content(text.strip())
+        failed = check_translation(source_text, title, content, glossary, parsed)
+        if not failed:
+            return title, content, _tier_info([], fast, None)
+
+        print(f"⬆️ Bản dịch nhanh không đạt ({', '.join(failed)}), dịch lại bằng model mạnh")
+        text, strong = _call(STRONG_TASK, prompt)
+    except Exception as e:
+        raise Exception(f"Lỗi khi dịch: {str(e)}")
+    title, content = _parse_title_content(text.strip())
+    return title, content, _tier_info(failed, fast, strong)
+
+
+def translate_escalated(
+    source_text: str,
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = "",
+    failed_checks: Optional[List[str]] = None,
+    fast: Optional[Dict] = None,
+    share: float = 1.0
+) -> Tuple[str, str, Dict]:
+    """
+    Dịch bằng model mạnh một bản đã bị loại ở tầng nhanh (VD chapter trong pack không đạt kiểm tra)
+
+    Args:
+        failed_checks, fast, share: Kết quả tầng nhanh (xem translate_pack_fast)
+    """
+    prompt = (build_translation_prefix(glossary_context, translation_style),
+              build_translation_suffix(source_text, pre_chapters))
+    try:
+        text, strong = _call(STRONG_TASK, prompt)
+    except Exception as e:
+        raise Exception(f"Lỗi khi dịch: {str(e)}")
+    title, content = _parse_title_content(text.strip())
+    fast = fast or {'seconds': 0.0, 'cost': 0.0}
+    return title, content, _tier_info(failed_checks or [], fast, strong, share)
+
+
+def translate_pack_fast(
+    chapters: List[Tuple[str, str, str]],
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = "",
+    glossary: Optional[GlossarySubstituter] = None
+) -> Tuple[Dict, Dict, Dict]:
+    """
+    Dịch pack bằng model nhanh và kiểm tra từng chương (tham số giống translate_pack)
+
+    Returns:
+        Tuple (
+            {id: (title, content)} các chương đạt,
+            {id: info cho TranslationCascadeStats} các chương đạt,
+            {id: tham số escalation cho translate_escalated} các chương không đạt hoặc bị thiếu
+        )
+    """
+    prompt = (build_packed_translation_prefix(glossary_context, translation_style),
+              build_packed_translation_suffix(chapters, pre_chapters))
+    try:
+        text, fast = _call(FAST_TASK, prompt)
+    except Exception as e:
+        raise Exception(f"Lỗi khi dịch: {str(e)}")
+    translations = parse_packed_translation(text)
+
+    share = 1 / len(chapters)
+    accepted, infos, escalations = {}, {}, {}
+    for chapter_id, title, content in chapters:
+        if chapter_id in translations:
+            title_trans, content_trans = translations[chapter_id]
+            failed = check_translation(f"{title}\n\n{content}", title_trans, content_trans, glossary)
+        else:
+            failed = ['format']
+        if failed:
+            escalations[chapter_id] = {'failed_checks': failed, 'fast': fast, 'share': share}
+            continue
+        accepted[chapter_id] = translations[chapter_id]
+        infos[chapter_id] = _tier_info([], fast, None, share)
+    return accepted, infos, escalations
@@ -0,0 +1,492 @@
+"""
+Dịch chapter theo segments và dịch hàng loạt chapters của một novel
+
+Chế độ đóng gói (pack): nhiều chapter ngắn liên tiếp được dịch chung trong một request,
+phần prompt cố định (vai trò, glossary, phong cách, các chương trước) chỉ gửi một lần.
+Tiêu đề/nội dung từng chapter được tách lại theo id và ghi vào đúng chapter/segment của nó.
+"""
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+from ..models import Novel, Chapter, Segment, TranslationCascadeStats
+from .ai_client import translate_pack, translate_segment
+from .cascade import translate_cascade, translate_escalated, translate_pack_fast
+from .foreign_char_detector import ForeignCharDetector
+from .gemini_client import (
+    TranslationStream,
+    stream_translation_with_gemini,
+    translation_prompt_overhead,
+)
+from .llm_tracing import segment_trace, trace_context
+from .postprocess import postprocess_translation, GlossarySubstituter
+from .segment_processor import SegmentProcessor
+from .tokens import estimate_tokens
+
+PACK_MARKER_TOKENS = 16  # Token của các dòng ###CHAPTER/TITLE/CONTENT### mỗi chapter trong pack
+
+
+def previous_chapters_context(chapter: Chapter, limit: int = 3) -> str:
+    """
+    Lấy nội dung các chương trước để làm context
+    """
+    # N chapters đã dịch gần nhất trước chapter hiện tại (theo thứ tự global)
+    previous_chapters = chapter.novel.chapters.translated().filter(
+        ordinal__lt=chapter.ordinal
+    ).order_by('-ordinal')
+    if limit:
+        previous_chapters = previous_chapters[:limit]
+    previous_chapters = reversed(list(previous_chapters))
+
+    # Format context
+    context_parts = []
+    for ch in previous_chapters:
+        title = ch.title_translation or ch.title
+        content = ch.full_translation[:20000]  # Giới hạn 20000 ký tự
+        context_parts.append(f"=== {title} ===\n{content}...")
+
+    return "\n\n".join(context_parts)
+
+
+def merge_chapter_translation(chapter: Chapter):
+    """
+    Gộp tất cả translations của segments thành bản dịch hoàn chỉnh
+    - eager: lưu vào chapter.translation
+    - lazy: chỉ đánh dấu đã dịch, bản dịch được ghép khi cần (xem Chapter.full_translation)
+    """
+    update_fields = ['status', 'foreign_char_warning', 'updated_at']
+
+    if getattr(settings, 'CHAPTER_TRANSLATION_MODE', 'eager') == 'lazy':
+        # Bản finalize cũ (nếu có) không còn khớp với segments
+        if chapter.translation is not None:
+            chapter.translation = None
+            update_fields.append('translation')
+    else:
+        chapter.translation = chapter.merge_segment_translations()
+        update_fields.append('translation')
+
+    chapter.status = 'translated'
+    chapter.invalidate_full_translation()
+
+    # Tổng hợp foreign warnings từ các segments
+    chapter.foreign_char_warning = ForeignCharDetector.aggregate_segment_warnings(
+        chapter.segments.exclude(
+            foreign_char_warning__isnull=True
+        ).exclude(foreign_char_warning='').order_by('index').values_list('index', 'foreign_char_warning')
+    )
+
+    chapter.save(update_fields=update_fields)
+
+
+class ChapterTranslator:
+    """Dịch chapters của một novel với glossary/phong cách dịch được load một lần"""
+
+    def __init__(self, novel: Novel):
+        self.novel = novel
+        glossary_terms = list(novel.glossaries.values_list('term_cn', 'term_vi'))
+        self.glossary_context = "\n".join(f"{term_cn} → {term_vi}" for term_cn, term_vi in glossary_terms)
+        self.glossary = GlossarySubstituter(glossary_terms)
+        self.translation_style = novel.translation_style or ""
+
+    def _apply_translation(self, segment, content_trans: str) -> Dict:
+        """Hậu xử lý bản dịch, ghi vào segment (chưa save) và trả về kết quả postprocess"""
+        processed = postprocess_translation(
+            segment.content_raw, content_trans, self.glossary_context, glossary=self.glossary
+        )
+        segment.translation = processed['translation']
+        detection = processed['detection']
+        segment.foreign_char_warning = detection['warning_message'] if detection['has_foreign'] else None
+        return processed
+
+    def prepare_segments(self, chapter: Chapter, pre_chapters: str, force: bool = False):
+        """Chia segments nếu chưa có hoặc force, kích thước theo model và phần prompt cố định"""
+        if force or not chapter.segments.exists():
+            overhead = translation_prompt_overhead(self.glossary_context, pre_chapters, self.translation_style)
+            SegmentProcessor.create_segments(
+                chapter, SegmentProcessor.segment_budget(overhead_tokens=overhead)
+            )
+
+    def segment_request(self, segment, pre_chapters: Optional[str] = None) -> Dict:
+        """Tham số gọi translate_segment / stream_translation_with_gemini cho một segment"""
+        chapter = segment.chapter
+        if pre_chapters is None:
+            pre_chapters = previous_chapters_context(chapter, limit=3)
+        return {
+            # ✅ THÊM TIÊU ĐỀ VÀO SOURCE_TEXT
+            'source_text': f"{chapter.title}\n\n{segment.content_raw}",
+            'glossary_context': self.glossary_context,
+            'pre_chapters': pre_chapters,
+            'translation_style': self.translation_style,
+        }
+
+    def translate_request(self, request: Dict, escalation: Optional[Dict] = None) -> Tuple[str, str]:
+        """
+        Dịch một segment (tham số từ segment_request)
+        TRANSLATION_CASCADE bật: model nhanh trước, không đạt kiểm tra mới dùng model mạnh, ghi TranslationCascadeStats
+
+        Args:
+            escalation: Kết quả tầng nhanh đã không đạt (xem cascade.translate_pack_fast) -> dịch thẳng bằng model mạnh
+        """
+        if escalation is not None:
+            title_trans, content_trans, info = translate_escalated(**request, **escalation)
+        elif getattr(settings, 'TRANSLATION_CASCADE', False):
+            title_trans, content_trans, info = translate_cascade(**request, glossary=self.glossary)
+        else:
+            return translate_segment(**request)
+        TranslationCascadeStats.record(self.novel, info)
+        return title_trans, content_trans
+
+    def save_segment(self, segment, title_trans: str, content_trans: str) -> Dict:
+        """
+        Hậu xử lý và lưu bản dịch segment, lưu tiêu đề vào CHAPTER nếu là segment đầu tiên
+
+        Returns:
+            Kết quả postprocess_translation (translation, detection, spans, substituted, repaired)
+        """
+        processed = self._apply_translation(segment, content_trans)
+        segment.save()
+        if segment.index == 1 and title_trans:
+            segment.chapter.title_translation = title_trans
+            segment.chapter.save(update_fields=['title_translation'])
+        return processed
+
+    def save_segments(self, results: Iterable[Tuple[Segment, str, str]]) -> Dict:
+        """
+        Hậu xử lý và lưu hàng loạt bản dịch (segment, title, content) bằng bulk_update (VD kết quả batch job)
+        Gộp bản dịch các chapters đã dịch đủ segments
+
+        Returns:
+            Dict: translated_segments, merged_chapters, substituted, repaired, foreign_warnings
+        """
+        result = {'translated_segments': 0, 'merged_chapters': 0, 'substituted': 0, 'repaired': 0, 'foreign_warnings': []}
+        segments = []
+        chapters = {}
+        titled = {}
+        now = timezone.now()
+
+        for segment, title_trans, content_trans in results:
+            processed = self._apply_translation(segment, content_trans)
+            segment.updated_at = now  # bulk_update không tự cập nhật auto_now
+            segments.append(segment)
+            result['substituted'] += processed['substituted']
+            result['repaired'] += processed['repaired']
+            if segment.foreign_char_warning:
+                result['foreign_warnings'].append(f"{segment}: {segment.foreign_char_warning}")
+
+            chapters[segment.chapter_id] = segment.chapter
+            if segment.index == 1 and title_trans:
+                segment.chapter.title_translation = title_trans
+                titled[segment.chapter_id] = segment.chapter
+
+        Segment.objects.bulk_update(segments, ['translation', 'foreign_char_warning', 'updated_at'], batch_size=500)
+        Chapter.objects.bulk_update(list(titled.values()), ['title_translation'], batch_size=500)
+        result['translated_segments'] = len(segments)
+
+        for chapter in chapters.values():
+            if SegmentProcessor.get_translation_progress(chapter)['remaining'] == 0:
+                merge_chapter_translation(chapter)
+                result['merged_chapters'] += 1
+
+        return result
+
+    def translate_chapter(self, chapter: Chapter, force: bool = False, escalation: Optional[Dict] = None) -> Dict:
+        """
+        Dịch chapter theo từng segment (tự động chia segments nếu chưa có hoặc force)
+
+        Args:
+            escalation: Chapter bị loại ở tầng nhanh của pack -> dịch bằng model mạnh (xem translate_request)
+
+        Returns:
+            Dict: translated_segments, substituted, repaired, foreign_warnings
+        """
+        pre_chapters = previous_chapters_context(chapter, limit=3)
+        self.prepare_segments(chapter, pre_chapters, force)
+
+        result = {'translated_segments': 0, 'substituted': 0, 'repaired': 0, 'foreign_warnings': []}
+
+        for segment in chapter.segments.all():
+            if segment.translation and not force:
+                continue
+
+            with trace_context(**segment_trace(segment)):
+                title_trans, content_trans = self.translate_request(self.segment_request(segment, pre_chapters), escalation)
+            if escalation:
+                # Request nhanh của pack chỉ tính một lần cho chapter
+                escalation = {**escalation, 'share': 0.0}
+
+            # Sửa câu còn sót ký tự ngoại ngữ + phát hiện
+            processed = self._apply_translation(segment, content_trans)
+            result['substituted'] += processed['substituted']
+            result['repaired'] += processed['repaired']
+
+            # Lưu tiêu đề vào CHAPTER cho segment đầu tiên
+            chapter.title_translation = title_trans
+
+            if segment.foreign_char_warning:
+                result['foreign_warnings'].append(f"Segment {segment.index}: {segment.foreign_char_warning}")
+
+            segment.save()
+            result['translated_segments'] += 1
+
+        # Lưu title translation vào chapter
+        if chapter.title_translation:
+            chapter.save(update_fields=['title_translation'])
+
+        # Gộp translations
+        merge_chapter_translation(chapter)
+
+        # Tổng hợp cảnh báo vào chapter
+        if result['foreign_warnings']:
+            chapter.foreign_char_warning = "\n\n".join(result['foreign_warnings'])
+            chapter.save(update_fields=['foreign_char_warning'])
+
+        return result
+
+    # ==================== STREAMING ====================
+
+    def stream_segment(self, segment, pre_chapters: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        Dịch segment và trả về từng phần bản dịch ngay khi model sinh ra, lưu bản dịch khi stream kết thúc
+
+        Yields:
+            ('delta', {segment_id, title, content}) - content là phần nội dung mới
+            ('segment_done', {...}) - bản dịch cuối (đã hậu xử lý) và kết quả phát hiện ký tự ngoại ngữ
+        """
+        stream = TranslationStream()
+        title = ""
+        request = self.segment_request(segment, pre_chapters)
+        for chunk in stream_translation_with_gemini(**request, trace=segment_trace(segment)):
+            new_title, delta = stream.feed(chunk)
+            if delta or new_title != title:
+                title = new_title
+                yield 'delta', {'segment_id': segment.id, 'title': title, 'content': delta}
+
+        title_trans, content_trans = stream.result()
+        processed = self.save_segment(segment, title_trans, content_trans)
+        detection = processed['detection']
+        yield 'segment_done', {
+            'segment_id': segment.id,
+            'index': segment.index,
+            'translation': processed['translation'],
+            'title_translation': title_trans if segment.index == 1 else None,
+            'foreign_detection': detection,
+            'substituted_terms': processed['substituted'],
+            'repaired_sentences': processed['repaired'],
+            'highlighted_text': ForeignCharDetector.highlight_html(
+                processed['translation'], processed['spans']
+            ) if detection['has_foreign'] else None,
+        }
+
+    def stream_chapter(self, chapter: Chapter, segments: Optional[List[Segment]] = None,
+                       force: bool = False) -> Iterator[Tuple[str, Dict]]:
+        """
+        Stream bản dịch các segments của chapter lần lượt (mặc định: chia segments nếu cần và dịch các segment chưa dịch)
+        Gộp bản dịch chapter khi tất cả segments đã dịch
+
+        Yields:
+            ('segment', {segment_id, index, position, total}), các event của stream_segment, ('done', {progress})
+        """
+        pre_chapters = previous_chapters_context(chapter, limit=3)
+        if segments is None:
+            self.prepare_segments(chapter, pre_chapters, force)
+            segments = [segment for segment in chapter.segments.all() if force or not segment.translation]
+
+        for position, segment in enumerate(segments, start=1):
+            yield 'segment', {
+                'segment_id': segment.id, 'index': segment.index, 'position': position, 'total': len(segments)
+            }
+            yield from self.stream_segment(segment, pre_chapters)
+
+        progress = SegmentProcessor.get_translation_progress(chapter)
+        if progress['remaining'] == 0:
+            merge_chapter_translation(chapter)
+        yield 'done', {'translated_segments': len(segments), 'progress': progress}
+
+    # ==================== CHẾ ĐỘ ĐÓNG GÓI ====================
+
+    @staticmethod
+    def is_packable(chapter: Chapter, force: bool = False) -> bool:
+        """Chapter ngắn, chưa dịch dở dang (segments đã dịch sẽ bị thay bằng một segment duy nhất)"""
+        max_tokens = getattr(settings, 'TRANSLATION_PACK_CHAPTER_TOKENS', 2000)
+        if not chapter.content_raw:
+            return False
+        if chapter.token_count is None:
+            chapter.token_count = estimate_tokens(chapter.content_raw)
+        if chapter.token_count > max_tokens:
+            return False
+        return force or not chapter.segments.exclude(translation__isnull=True).exclude(translation='').exists()
+
+    def iter_packs(self, chapters: Iterable[Chapter], pack: bool = True,
+                   force: bool = False) -> Iterator[List[Chapter]]:
+        """
+        Nhóm các chapters liên tiếp: chapters ngắn được gộp đến khi chạm token budget của model
+        hoặc TRANSLATION_PACK_MAX_CHAPTERS, chapter dài (hoặc pack=False) đứng riêng
+        """
+        max_chapters = getattr(settings, 'TRANSLATION_PACK_MAX_CHAPTERS', 8)
+        current = []
+        current_tokens = 0
+        budget = 0
+
+        for chapter in chapters:
+            if not pack or max_chapters <= 1 or not self.is_packable(chapter, force):
+                if current:
+                    yield current
+                    current, current_tokens = [], 0
+                yield [chapter]
+                continue
+
+            tokens = chapter.token_count + estimate_tokens(chapter.title) + PACK_MARKER_TOKENS
+            if current and (len(current) >= max_chapters or current_tokens + tokens > budget):
+                yield current
+                current, current_tokens = [], 0
+            if not current:
+                # Budget theo phần prompt cố định của chapter đầu pack (các chương trước của nó)
+                overhead = translation_prompt_overhead(
+                    self.glossary_context, previous_chapters_context(chapter, limit=3), self.translation_style
+                )
+                budget = SegmentProcessor.segment_budget(overhead_tokens=overhead)
+            current.append(chapter)
+            current_tokens += tokens
+
+        if current:
+            yield current
+
+    def translate_pack(self, chapters: List[Chapter]) -> Dict:
+        """
+        Dịch nhiều chapter ngắn trong một request, mỗi chapter được ghi thành một segment duy nhất
+        Chapters AI không trả về được dịch lại riêng theo cách thông thường
+
+        Returns:
+            Dict: translated (chapter ids), fallback (chapter ids dịch riêng), substituted, repaired, foreign_warnings
+        """
+        request = {
+            'chapters': [(str(chapter.id), chapter.title, chapter.content_raw) for chapter in chapters],
+            'glossary_context': self.glossary_context,
+            'pre_chapters': previous_chapters_context(chapters[0], limit=3),
+            'translation_style': self.translation_style,
+        }
+        if getattr(settings, 'TRANSLATION_CASCADE', False):
+            # Chapters không đạt kiểm tra được dịch lại riêng bằng model mạnh
+            with trace_context(novel_id=self.novel.id):
+                translations, infos, escalations = translate_pack_fast(**request, glossary=self.glossary)
+        else:
+            with trace_context(operation='translate_pack', novel_id=self.novel.id):
+                translations, infos, escalations = translate_pack(**request), {}, {}
+
+        result = {'translated': [], 'fallback': [], 'substituted': 0, 'repaired': 0, 'foreign_warnings': []}
+
+        for chapter in chapters:
+            if str(chapter.id) not in translations:
+                escalation = escalations.get(str(chapter.id))
+                if escalation:
+                    print(f"⬆️ Chapter {chapter.id} không đạt ({', '.join(escalation['failed_checks'])}), dịch riêng bằng model mạnh")
+                else:
+                    print(f"⚠️ Pack thiếu chapter {chapter.id}, dịch riêng")
+                single = self.translate_chapter(chapter, force=True, escalation=escalation)
+                result['fallback'].append(chapter.id)
+                result['substituted'] += single['substituted']
+                result['repaired'] += single['repaired']
+                result['foreign_warnings'].extend(f"{chapter}: {w}" for w in single['foreign_warnings'])
+                continue
+
+            title_trans, content_trans = translations[str(chapter.id)]
+
+            # Chapter ngắn -> một segment chứa toàn bộ nội dung
+            chapter.segments.all().delete()
+            segment = Segment(chapter=chapter, index=1, content_raw=chapter.content_raw.strip())
+            processed = self._apply_translation(segment, content_trans)
+            segment.save()
+            result['substituted'] += processed['substituted']
+            result['repaired'] += processed['repaired']
+            if segment.foreign_char_warning:
+                result['foreign_warnings'].append(f"{chapter}: {segment.foreign_char_warning}")
+
+            if title_trans:
+                chapter.title_translation = title_trans
+                chapter.save(update_fields=['title_translation'])
+            merge_chapter_translation(chapter)
+            result['translated'].append(chapter.id)
+            if str(chapter.id) in infos:
+                TranslationCascadeStats.record(self.novel, infos[str(chapter.id)])
+
+        return result
+
+    def translate_chapters(
+        self,
+        chapters: Iterable[Chapter],
+        pack: bool = True,
+        force: bool = False,
+        total: Optional[int] = None,
+        progress: Optional[Callable] = None,
+    ) -> Dict:
+        """
+        Dịch lần lượt các chapters (theo thứ tự), gộp chapters ngắn nếu pack=True
+        Lỗi ở một chapter/pack không dừng cả đợt, chapters lỗi được liệt kê trong 'failed'
+
+        Args:
+            total: Tổng số chapters (để báo tiến độ)
+            progress: Callback progress(translated=..., total=..., requests=...)
+
+        Returns:
+            Dict tổng kết
+        """
+        summary = {
+            'translated_chapters': 0,
+            'packed_chapters': 0,
+            'requests': 0,
+            'substituted_terms': 0,
+            'repaired_sentences': 0,
+            'failed': [],
+            'foreign_warnings': [],
+        }
+
+        for group in self.iter_packs(chapters, pack=pack, force=force):
+            try:
+                if len(group) > 1:
+                    result = self.translate_pack(group)
+                    summary['requests'] += 1 + len(result['fallback'])
+                    summary['translated_chapters'] += len(result['translated']) + len(result['fallback'])
+                    summary['packed_chapters'] += len(result['translated'])
+                    summary['foreign_warnings'].extend(result['foreign_warnings'])
+                else:
+                    chapter = group[0]
+                    result = self.translate_chapter(chapter, force=force)
+                    summary['requests'] += result['translated_segments']
+                    summary['translated_chapters'] += 1
+                    summary['foreign_warnings'].extend(f"{chapter}: {w}" for w in result['foreign_warnings'])
+                summary['substituted_terms'] += result['substituted']
+                summary['repaired_sentences'] += result['repaired']
+            except Exception as e:
+                print(f"❌ Lỗi khi dịch {', '.join(str(chapter) for chapter in group)}: {e}")
+                summary['failed'].extend({'chapter_id': chapter.id, 'error': str(e)} for chapter in group)
+
+            if progress:
+                progress(
+                    translated=summary['translated_chapters'],
+                    total=total,
+                    requests=summary['requests']
+                )
+
+        return summary
+
+
+def translate_novel(
+    novel: Novel,
+    pack: bool = True,
+    force: bool = False,
+    limit: Optional[int] = None,
+    progress: Optional[Callable] = None,
+) -> Dict:
+    """
+    Dịch các chapters chưa dịch của novel theo thứ tự global (force=True: dịch lại tất cả)
+    Dùng cho background job và management command translate_novel
+    """
+    chapters = novel.chapters.exclude(content_raw__isnull=True).exclude(content_raw='').order_by('ordinal')
+    if not force:
+        chapters = chapters.exclude(pk__in=novel.chapters.translated().values('pk'))
+    if limit:
+        chapters = chapters[:limit]
+
+    chapters = list(chapters)
+    translator = ChapterTranslator(novel)
+    return translator.translate_chapters(chapters, pack=pack, force=force, total=len(chapters), progress=progress)
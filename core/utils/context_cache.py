@@ -0,0 +1,154 @@
+"""
+Context cache cho phần đầu prompt cố định theo novel (vai trò, nhiệm vụ, phong cách, glossary, định dạng output)
+- Prompt dịch = prefix (giống nhau cho mọi segment của novel) + suffix (các chương trước, nội dung gốc)
+- Gemini: prefix được tạo thành cached content (client.caches.create) một lần cho mỗi (key, model, prefix),
+  các request sau chỉ gửi suffix kèm tên cache -> token prefix không phải xử lý lại và được tính giá cache
+- Registry (tên cache, hạn dùng) lưu trong Django cache để mọi worker dùng chung; key registry chứa hash của prefix
+  nên khi glossary/translation_style đổi, prefix mới tự có cache mới; registry nhớ prefix hiện tại của từng novel
+  (novel_id của lần gọi đang trace) để xóa luôn cache cũ ở provider thay vì trả phí lưu tới hết TTL
+- OpenAI tự cache prefix giống nhau, Anthropic dùng cache_control (xem llm_providers) - không cần registry
+- CONTEXT_CACHE tắt, prefix ngắn hơn CONTEXT_CACHE_MIN_TOKENS hoặc tạo cache lỗi: no-op, gửi nguyên prompt
+"""
+import hashlib
+import time
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .llm_tracing import current_call
+from .tokens import estimate_tokens
+
+CACHE_PREFIX = 'context_cache:'
+FAILURE_COOLDOWN = 600  # Giây không thử tạo lại cache cho prefix vừa tạo lỗi
+EXPIRY_MARGIN = 60  # Giây, bỏ entry khỏi registry trước khi cache hết hạn ở provider
+
+
+def prefix_hash(prefix: str) -> str:
+    return hashlib.sha1(prefix.encode('utf-8')).hexdigest()[:16]
+
+
+def should_cache(prefix: str) -> bool:
+    """Prefix có đáng cache không (bật CONTEXT_CACHE và đủ dài theo yêu cầu tối thiểu của provider)"""
+    return (
+        bool(prefix)
+        and getattr(settings, 'CONTEXT_CACHE', True)
+        and estimate_tokens(prefix) >= getattr(settings, 'CONTEXT_CACHE_MIN_TOKENS', 2048)
+    )
+
+
+def _registry_key(key_id, model: str, digest: str) -> str:
+    return f'{CACHE_PREFIX}gemini:{key_id}:{model}:{digest}'
+
+
+def _novel_key(key_id, model: str, novel_id) -> str:
+    """Hash prefix hiện tại của novel (để xóa cache của prefix cũ khi glossary/phong cách đổi)"""
+    return f'{CACHE_PREFIX}gemini:{key_id}:{model}:novel:{novel_id}'
+
+
+def gemini_cached_content(client, key_id, model: str, prefix: str) -> Optional[str]:
+    """
+    Tên cached content Gemini chứa prefix: dùng lại cache đã đăng ký (gia hạn khi còn dưới nửa TTL)
+    hoặc tạo mới. Cache thuộc về API key nên mỗi key có cache riêng
+
+    Returns:
+        Tên cache, None = không dùng cache (gửi nguyên prompt)
+    """
+    if not should_cache(prefix):
+        return None
+
+    from google.genai import types
+
+    ttl = int(getattr(settings, 'CONTEXT_CACHE_TTL', 3600))
+    digest = prefix_hash(prefix)
+    registry_key = _registry_key(key_id, model, digest)
+    now = time.time()
+
+    entry = cache.get(registry_key)
+    if entry:
+        if entry['expires'] - now < ttl / 2:
+            try:
+                client.caches.update(name=entry['name'], config=types.UpdateCachedContentConfig(ttl=f'{ttl}s'))
+            except Exception as e:
+                # Cache đã bị xóa/hết hạn ở provider -> tạo lại
+                print(f"⚠️ Không gia hạn được context cache {entry['name']} ({e})")
+                cache.delete(registry_key)
+                entry = None
+            else:
+                entry['expires'] = now + ttl
+                cache.set(registry_key, entry, timeout=ttl - EXPIRY_MARGIN)
+        if entry:
+            return entry['name']
+
+    if cache.get(f'{registry_key}:failed'):
+        return None
+    # Worker khác đang tạo cache cho prefix này -> request này gửi nguyên prompt
+    if not cache.add(f'{registry_key}:lock', True, timeout=60):
+        return None
+    try:
+        cached = client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=[prefix],
+                ttl=f'{ttl}s',
+                display_name=f'novel-translator-{prefix_hash(prefix)}'
+            )
+        )
+    except Exception as e:
+        print(f"⚠️ Không tạo được context cache ({e}), gửi nguyên prompt")
+        cache.set(f'{registry_key}:failed', True, timeout=FAILURE_COOLDOWN)
+        return None
+    finally:
+        cache.delete(f'{registry_key}:lock')
+
+    cache.set(registry_key, {'name': cached.name, 'expires': now + ttl}, timeout=ttl - EXPIRY_MARGIN)
+    print(f"🗄️ Đã tạo context cache {cached.name} (~{estimate_tokens(prefix)} tokens, TTL {ttl}s)")
+
+    call = current_call()
+    novel_id = call.fields.get('novel_id') if call else None
+    if novel_id:
+        novel_key = _novel_key(key_id, model, novel_id)
+        previous = cache.get(novel_key)
+        cache.set(novel_key, digest, timeout=None)
+        if previous and previous != digest:
+            # Glossary/phong cách của novel đã đổi -> cache của prefix cũ không còn được dùng
+            _forget(key_id, model, previous, client)
+    return cached.name
+
+
+def _forget(key_id, model: str, digest: str, client=None):
+    entry = cache.get(_registry_key(key_id, model, digest))
+    cache.delete(_registry_key(key_id, model, digest))
+    if client is None or not entry:
+        return
+    try:
+        client.caches.delete(name=entry['name'])
+    except Exception as e:
+        print(f"⚠️ Không xóa được context cache {entry['name']} ({e})")
+    else:
+        print(f"🗑️ Đã xóa context cache cũ {entry['name']}")
+
+
+def forget_gemini_cache(key_id, model: str, prefix: str, client=None):
+    """
+    Bỏ cache khỏi registry - lần sau sẽ tạo lại
+
+    Args:
+        client: Có thì xóa luôn cache ở provider (None: provider báo cache không còn, chỉ bỏ khỏi registry)
+    """
+    _forget(key_id, model, prefix_hash(prefix), client)
+
+
+def generate_with_gemini_cache(client, key_id, model: str, prefix: str, generate: Callable[[Optional[str]], Any]):
+    """
+    generate(cached_content): gọi Gemini với cached content chứa prefix (None = gửi nguyên prefix + suffix)
+    Cache đã bị xóa/hết hạn ở provider (403/404) -> bỏ khỏi registry và gọi lại không dùng cache
+    """
+    cached_content = gemini_cached_content(client, key_id, model, prefix)
+    try:
+        return generate(cached_content)
+    except Exception as e:
+        if not cached_content or getattr(e, 'code', None) not in (403, 404):
+            raise
+        forget_gemini_cache(key_id, model, prefix)
+        return generate(None)
@@ -0,0 +1,289 @@
+"""
+LLM giả lập để load test / benchmark không cần API key (settings.LLM_FAKE)
+- Trả lời đúng format của từng prompt: dịch (###TITLE###/###CONTENT###), dịch pack (###CHAPTER id###),
+  review (Độ khớp: xx%), sửa câu ([n] ...), glossary (原文 = Dịch)
+- Độ trễ phân phối log-normal + thời gian xử lý token input (trừ phần đọc từ context cache) và sinh token output,
+  lỗi 503 ngẫu nhiên, 429 theo đợt
+- Deterministic: mọi giá trị ngẫu nhiên của request thứ n chỉ phụ thuộc (seed, n)
+
+Dùng qua GeminiClientManager (FakeGeminiClient thay genai.Client) hoặc stub server OpenAI/Anthropic-compatible
+(python manage.py llm_stub_server)
+"""
+import hashlib
+import itertools
+import math
+import random
+import re
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, Iterator, Optional, Tuple
+
+from .tokens import estimate_tokens
+
+DEFAULT_CONFIG = {
+    'latency_median': 0.8,  # Giây, trung vị độ trễ tới token đầu tiên
+    'latency_sigma': 0.4,  # Độ lệch của log-normal (0 = cố định)
+    'seconds_per_1k_output': 1.0,  # Giây sinh mỗi 1000 token output
+    'seconds_per_1k_input': 0.05,  # Giây xử lý mỗi 1000 token input không đọc từ context cache
+    'error_rate': 0.0,  # Tỉ lệ lỗi 503
+    'rate_limit_every': 0,  # Mỗi N request bắt đầu một đợt 429 (0 = tắt)
+    'rate_limit_burst': 0,  # Số request liên tiếp bị 429 mỗi đợt
+    'retry_after': 5,  # Giây gợi ý trong lỗi 429
+    'output_ratio': 1.8,  # Token bản dịch / token bản gốc
+    'review_score': (70, 100),  # Khoảng điểm review
+    'time_scale': 1.0,  # Nhân mọi thời gian chờ (0 = không chờ, chỉ đo overhead)
+    'seed': 42,
+}
+
+VIETNAMESE_WORDS = (
+    'hắn nàng thiên địa kiếm khí linh lực tu luyện sư phụ đệ tử tông môn cảnh giới đột phá '
+    'ánh mắt khẽ cười trầm mặc gió lạnh thổi qua núi xa mây trắng con đường đá xanh trong lòng '
+    'dâng lên cảm giác khó tả nhìn về phía trước bước chân chậm rãi giọng nói mang theo chút lo lắng'
+).split()
+
+HAN_TERM_PATTERN = re.compile(r'[一-鿿]{2,4}')
+PACK_SOURCE_PATTERN = re.compile(
+    r'###CHAPTER (\S+)###\n###TITLE###\n(.*?)\n###CONTENT###\n(.*?)(?=\n\n###CHAPTER |\n\n---\n)', re.S
+)
+FIX_ITEM_PATTERN = re.compile(r'^\[(\d+)\]\nGốc:', re.MULTILINE)
+CONFLICT_LINE_PATTERN = re.compile(r'^([一-鿿]\S*): ([^|\n]+)', re.MULTILINE)
+
+
+class FakeLLMError(Exception):
+    """Lỗi giả lập, có .code/.status như lỗi của SDK để resilience.classify_error phân loại được"""
+
+    def __init__(self, code: int, status: str, retry_after: Optional[float] = None):
+        self.code = code
+        self.status = status
+        self.retry_after = retry_after
+        self.details = {'retryDelay': f'{retry_after}s'} if retry_after else {}
+        super().__init__(f"{code} {status} (fake LLM)")
+
+
+def _section(prompt: str, start: str, end: str = '\n---\n') -> str:
+    """Phần prompt nằm giữa tiêu đề start và dấu phân cách end"""
+    if start not in prompt:
+        return ''
+    body = prompt.split(start, 1)[1]
+    return body.split(end, 1)[0].strip('\n')
+
+
+class FakeLLM:
+    """Sinh response giả cho prompt, thread-safe (mỗi request lấy số thứ tự riêng)"""
+
+    def __init__(self, config: Optional[dict] = None):
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self._counter = itertools.count()
+        self.cached_contents = {}  # Tên cache -> nội dung (FakeGeminiClient.caches)
+
+    # ---------- Nội dung ----------
+
+    def _words(self, seed_text: str, tokens: int) -> str:
+        """Câu tiếng Việt giả dài khoảng `tokens` token, cố định theo seed_text"""
+        rng = random.Random(hashlib.md5(seed_text.encode('utf-8')).hexdigest())
+        words = []
+        length = 0
+        target_chars = max(tokens, 1) * 4
+        while length < target_chars:
+            word = rng.choice(VIETNAMESE_WORDS)
+            words.append(word)
+            length += len(word)
+        sentence = ' '.join(words)
+        return sentence[0].upper() + sentence[1:] + '.'
+
+    def fake_translation(self, text: str) -> str:
+        """Dịch giả từng đoạn văn, giữ số đoạn, dài ~output_ratio lần bản gốc"""
+        ratio = self.config['output_ratio']
+        paragraphs = [p for p in text.split('\n') if p.strip()]
+        return '\n\n'.join(
+            self._words(paragraph, int(estimate_tokens(paragraph) * ratio))
+            for paragraph in paragraphs
+        )
+
+    def _fake_title(self, title: str) -> str:
+        number = re.search(r'\d+', title)
+        return f"Chương {number.group(0)}: {self._words(title, 4)[:-1]}" if number else self._words(title, 4)[:-1]
+
+    def _fake_term(self, term: str) -> str:
+        return ' '.join(word.capitalize() for word in self._words(term, 2)[:-1].split()[:2])
+
+    def reply(self, prompt: str, rng: Optional[random.Random] = None) -> str:
+        """Response đúng format theo loại prompt (không chờ, không lỗi)"""
+        rng = rng or random.Random(self.config['seed'])
+
+        if '原文 = Dịch' in prompt:
+            # Reconcile: chọn phương án đầu tiên; trích xuất/lọc ứng viên: các cụm chữ Hán hay gặp nhất
+            conflicts = CONFLICT_LINE_PATTERN.findall(prompt)
+            if conflicts:
+                return '\n'.join(f"{term} = {options.strip()}" for term, options in conflicts)
+            examples = {'李明', '剑圣', '卡洛斯', '莉亚', '亚瑟', '手机', '椅子', '图书馆', '原文'}
+            counts = Counter(term for term in HAN_TERM_PATTERN.findall(prompt) if term not in examples)
+            return '\n'.join(f"{term} = {self._fake_term(term)}" for term, _count in counts.most_common(20))
+
+        if '译文：' in prompt:
+            low, high = self.config['review_score']
+            return f"Độ khớp: {rng.randint(low, high)}%\nBản dịch giả lập: trôi chảy, giữ đúng tên riêng."
+
+        if '### Các chương cần dịch:' in prompt:
+            return '\n\n'.join(
+                f"###CHAPTER {chapter_id}###\n###TITLE###\n{self._fake_title(title)}\n"
+                f"###CONTENT###\n{self.fake_translation(content)}"
+                for chapter_id, title, content in PACK_SOURCE_PATTERN.findall(prompt)
+            )
+
+        if '### Nội dung gốc cần dịch:' in prompt:
+            source = _section(prompt, '### Nội dung gốc cần dịch:\n')
+            title, _sep, content = source.partition('\n')
+            return f"###TITLE###\n{self._fake_title(title)}\n\n###CONTENT###\n{self.fake_translation(content)}"
+
+        items = FIX_ITEM_PATTERN.findall(prompt)
+        if items:
+            return '\n'.join(f"[{index}] {self._words(index, 12)}" for index in items)
+
+        return self._words(prompt[-200:], 20)
+
+    # ---------- Độ trễ / lỗi ----------
+
+    def _plan(self) -> Tuple[int, random.Random]:
+        index = next(self._counter)
+        return index, random.Random(f"{self.config['seed']}:{index}")
+
+    def _maybe_fail(self, index: int, rng: random.Random):
+        every, burst = self.config['rate_limit_every'], self.config['rate_limit_burst']
+        if every and burst and index % every >= every - burst:
+            raise FakeLLMError(429, 'RESOURCE_EXHAUSTED', retry_after=self.config['retry_after'])
+        if rng.random() < self.config['error_rate']:
+            self._sleep(self._first_token_delay(rng))
+            raise FakeLLMError(503, 'UNAVAILABLE')
+
+    def _first_token_delay(self, rng: random.Random, input_tokens: int = 0) -> float:
+        median, sigma = self.config['latency_median'], self.config['latency_sigma']
+        delay = median * math.exp(rng.gauss(0, sigma)) if sigma else median
+        return delay + input_tokens / 1000 * self.config['seconds_per_1k_input']
+
+    def _sleep(self, seconds: float):
+        seconds *= self.config['time_scale']
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def generate(self, prompt: str, cached_tokens: int = 0) -> Tuple[str, Dict]:
+        """
+        Một request: chờ theo phân phối độ trễ rồi trả về (text, usage)
+
+        Args:
+            cached_tokens: Số token đầu prompt đọc từ context cache (không tính thời gian xử lý)
+
+        Raises:
+            FakeLLMError: 429 (theo đợt) / 503 (ngẫu nhiên)
+        """
+        index, rng = self._plan()
+        self._maybe_fail(index, rng)
+        text = self.reply(prompt, rng)
+        output_tokens = estimate_tokens(text)
+        prompt_tokens = estimate_tokens(prompt)
+        self._sleep(
+            self._first_token_delay(rng, prompt_tokens - cached_tokens)
+            + output_tokens / 1000 * self.config['seconds_per_1k_output']
+        )
+        return text, {'prompt_tokens': prompt_tokens, 'output_tokens': output_tokens, 'cached_tokens': cached_tokens}
+
+    def stream(self, prompt: str, chunk_chars: int = 200, cached_tokens: int = 0) -> Iterator[str]:
+        """Như generate nhưng trả về từng đoạn, thời gian sinh chia đều cho các đoạn"""
+        index, rng = self._plan()
+        self._maybe_fail(index, rng)
+        text = self.reply(prompt, rng)
+        chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or ['']
+        per_chunk = estimate_tokens(text) / 1000 * self.config['seconds_per_1k_output'] / len(chunks)
+        self._sleep(self._first_token_delay(rng, estimate_tokens(prompt) - cached_tokens))
+        for chunk in chunks:
+            yield chunk
+            self._sleep(per_chunk)
+
+
+class FakeGeminiClient:
+    """Thay genai.Client: client.models.generate_content / generate_content_stream / count_tokens, client.caches"""
+
+    def __init__(self, fake: FakeLLM):
+        self.models = _FakeGeminiModels(fake)
+        self.caches = _FakeGeminiCaches(fake)
+
+
+class _FakeGeminiCaches:
+    """Giao diện giống client.caches của google-genai (cached content lưu trong bộ nhớ)"""
+
+    def __init__(self, fake: FakeLLM):
+        self._fake = fake
+
+    def create(self, model: str = None, config=None):
+        content = ''.join(str(part) for part in config.contents)
+        name = f"cachedContents/fake-{hashlib.md5(content.encode('utf-8')).hexdigest()[:12]}"
+        self._fake.cached_contents[name] = content
+        return SimpleNamespace(name=name, model=model)
+
+    def update(self, name: str = None, config=None):
+        if name not in self._fake.cached_contents:
+            raise FakeLLMError(404, 'NOT_FOUND')
+        return SimpleNamespace(name=name)
+
+    def delete(self, name: str = None, config=None):
+        self._fake.cached_contents.pop(name, None)
+
+
+class _FakeGeminiModels:
+
+    def __init__(self, fake: FakeLLM):
+        self._fake = fake
+
+    @staticmethod
+    def _response(text: str, prompt_tokens: int, output_tokens: int, cached_tokens: int = 0):
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                cached_content_token_count=cached_tokens
+            )
+        )
+
+    def _prompt(self, contents, config) -> Tuple[str, int]:
+        """Prompt đầy đủ (nội dung cache + contents) và số token đọc từ cache"""
+        name = getattr(config, 'cached_content', None)
+        if not name:
+            return str(contents), 0
+        if name not in self._fake.cached_contents:
+            raise FakeLLMError(404, 'NOT_FOUND')
+        cached = self._fake.cached_contents[name]
+        return cached + str(contents), estimate_tokens(cached)
+
+    def generate_content(self, model: str = None, contents=None, config=None):
+        prompt, cached_tokens = self._prompt(contents, config)
+        text, usage = self._fake.generate(prompt, cached_tokens)
+        return self._response(text, usage['prompt_tokens'], usage['output_tokens'], cached_tokens)
+
+    def generate_content_stream(self, model: str = None, contents=None, config=None):
+        prompt, cached_tokens = self._prompt(contents, config)
+        # Như Gemini: usage_metadata của mỗi chunk là số token tính đến chunk đó, chunk cuối có usage của cả request
+        text = ''
+        for chunk in self._fake.stream(prompt, cached_tokens=cached_tokens):
+            text += chunk
+            yield self._response(chunk, estimate_tokens(prompt), estimate_tokens(text), cached_tokens)
+
+    def count_tokens(self, model: str = None, contents=None, config=None):
+        return SimpleNamespace(total_tokens=estimate_tokens(str(contents)))
+
+
+_fake = None
+
+
+def get_fake_llm() -> Optional[FakeLLM]:
+    """FakeLLM dùng chung cho process nếu settings.LLM_FAKE được bật, ngược lại None"""
+    global _fake
+    from django.conf import settings
+    config = getattr(settings, 'LLM_FAKE', None)
+    if config is None:
+        return None
+    if _fake is None:
+        _fake = FakeLLM(config)
+    return _fake
+
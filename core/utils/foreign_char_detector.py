@@ -3,7 +3,7 @@ Phát hiện ký tự ngoại ngữ (Hán, Hàn, Nhật, Thái) trong văn bản
 Được tích hợp vào quá trình dịch để cảnh báo người dùng
 """
 import re
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, List, Tuple
 
 
 class ForeignCharDetector:
@@ -15,54 +15,106 @@ class ForeignCharDetector:
     JAPANESE_PATTERN = r'[\u3040-\u309f\u30a0-\u30ff]'  # Hiragana, Katakana
     THAI_PATTERN = r'[\u0e00-\u0e7f]'  # Chữ Thái
     
+    # (key, pattern, cờ, tên, style highlight) - thứ tự hiển thị trong cảnh báo
+    LANGUAGES = (
+        ('chinese', CHINESE_PATTERN, '🇨🇳', 'chữ Hán', 'background: #fee2e2; color: #991b1b; font-weight: 600;'),
+        ('korean', KOREAN_PATTERN, '🇰🇷', 'chữ Hàn', 'background: #fef3c7; color: #92400e; font-weight: 600;'),
+        ('japanese', JAPANESE_PATTERN, '🇯🇵', 'chữ Nhật', 'background: #d1fae5; color: #065f46; font-weight: 600;'),
+        ('thai', THAI_PATTERN, '🇹🇭', 'chữ Thái', 'background: #e9d5ff; color: #6b21a8; font-weight: 600;'),
+    )
+    
+    # Một character class gộp mọi ngôn ngữ: tìm nhanh các dãy ký tự ngoại ngữ liên tiếp
+    FOREIGN_RUN_REGEX = re.compile(
+        '[' + ''.join(pattern[1:-1] for _key, pattern, *_ in LANGUAGES) + ']+'
+    )
+    # Phân loại trong từng dãy: mỗi match là một đoạn cùng ngôn ngữ, lastgroup cho biết ngôn ngữ
+    LANGUAGE_REGEX = re.compile('|'.join(
+        f'(?P<{key}>{pattern}+)' for key, pattern, *_ in LANGUAGES
+    ))
+    
     @classmethod
-    def detect(cls, text: str) -> Dict[str, any]:
+    def scan(cls, text: str) -> List[Tuple[int, int, str]]:
+        """
+        Quét văn bản một lần, trả về các đoạn ký tự ngoại ngữ
+        
+        Returns:
+            List (start, end, language_key) theo thứ tự xuất hiện
+        """
+        if not text or text.isascii():
+            return []
+        
+        spans = []
+        for run in cls.FOREIGN_RUN_REGEX.finditer(text):
+            # Chỉ chạy regex phân loại trên phạm vi của dãy (thường rất ngắn)
+            spans.extend(
+                (m.start(), m.end(), m.lastgroup)
+                for m in cls.LANGUAGE_REGEX.finditer(text, run.start(), run.end())
+            )
+        return spans
+    
+    @classmethod
+    def detect(cls, text: str, spans: List[Tuple[int, int, str]] = None) -> Dict[str, any]:
         """
         Phát hiện ký tự ngoại ngữ trong văn bản
         
+        Args:
+            spans: Kết quả scan() đã có (tránh quét lại khi cần cả highlight_html)
+        
         Returns:
             Dict với thông tin chi tiết về ký tự ngoại ngữ
         """
         if not text:
             return cls._empty_result()
         
-        chinese = list(set(re.findall(cls.CHINESE_PATTERN, text)))
-        korean = list(set(re.findall(cls.KOREAN_PATTERN, text)))
-        japanese = list(set(re.findall(cls.JAPANESE_PATTERN, text)))
-        thai = list(set(re.findall(cls.THAI_PATTERN, text)))
+        if spans is None:
+            spans = cls.scan(text)
         
-        total = len(chinese) + len(korean) + len(japanese) + len(thai)
+        # Ký tự duy nhất theo thứ tự xuất hiện đầu tiên
+        unique = {key: {} for key, *_ in cls.LANGUAGES}
+        for start, end, key in spans:
+            unique[key].update(dict.fromkeys(text[start:end]))
+        chars = {key: list(found) for key, found in unique.items()}
         
         # Tạo cảnh báo
-        warnings = []
-        if chinese:
-            sample = ' '.join(chinese[:10])
-            warnings.append(f"🇨🇳 {len(chinese)} chữ Hán: {sample}")
-        if korean:
-            sample = ' '.join(korean[:10])
-            warnings.append(f"🇰🇷 {len(korean)} chữ Hàn: {sample}")
-        if japanese:
-            sample = ' '.join(japanese[:10])
-            warnings.append(f"🇯🇵 {len(japanese)} chữ Nhật: {sample}")
-        if thai:
-            sample = ' '.join(thai[:10])
-            warnings.append(f"🇹🇭 {len(thai)} chữ Thái: {sample}")
-        
-        warning_msg = "\n".join(warnings) if warnings else ""
+        warnings = [
+            f"{flag} {len(chars[key])} {label}: {' '.join(chars[key][:10])}"
+            for key, _pattern, flag, label, _style in cls.LANGUAGES
+            if chars[key]
+        ]
+        
+        total = sum(len(found) for found in chars.values())
+        warning_msg = "\n".join(warnings)
         severity = cls._calculate_severity(total, len(text))
         
         return {
             'has_foreign': total > 0,
-            'chinese_count': len(chinese),
-            'korean_count': len(korean),
-            'japanese_count': len(japanese),
-            'thai_count': len(thai),
+            'chinese_count': len(chars['chinese']),
+            'korean_count': len(chars['korean']),
+            'japanese_count': len(chars['japanese']),
+            'thai_count': len(chars['thai']),
             'total_count': total,
             'warning_message': warning_msg,
             'severity': severity,
-            'all_chars': chinese + korean + japanese + thai
+            'all_chars': chars['chinese'] + chars['korean'] + chars['japanese'] + chars['thai']
         }
     
+    @classmethod
+    def warning_for(cls, text: str):
+        """Cảnh báo lưu vào foreign_char_warning (None nếu không có ký tự ngoại ngữ)"""
+        detection = cls.detect(text)
+        return detection['warning_message'] if detection['has_foreign'] else None
+    
+    @staticmethod
+    def aggregate_segment_warnings(rows: Iterable[Tuple[int, str]]):
+        """
+        Tổng hợp cảnh báo của các segments thành cảnh báo của chapter
+        
+        Args:
+            rows: (segment.index, foreign_char_warning) theo thứ tự index
+        """
+        warnings = [f"Segment {index}:\n{warning}" for index, warning in rows if warning]
+        return "\n\n".join(warnings) if warnings else None
+    
     @classmethod
     def _empty_result(cls) -> Dict:
         """Kết quả rỗng khi không có text"""
@@ -102,49 +154,49 @@ class ForeignCharDetector:
             return 'low'
     
     @classmethod
-    def highlight_html(cls, text: str) -> str:
+    def highlight_html(cls, text: str, spans: List[Tuple[int, int, str]] = None) -> str:
         """
         Highlight ký tự ngoại ngữ bằng HTML cho hiển thị trên web
+        Dùng lại spans của scan() nếu có, ghép kết quả trong một lượt
         """
         if not text:
             return text
         
-        # Highlight Chinese (đỏ)
-        text = re.sub(
-            cls.CHINESE_PATTERN,
-            r'<mark style="background: #fee2e2; color: #991b1b; font-weight: 600;">\g<0></mark>',
-            text
-        )
-        # Highlight Korean (vàng)
-        text = re.sub(
-            cls.KOREAN_PATTERN,
-            r'<mark style="background: #fef3c7; color: #92400e; font-weight: 600;">\g<0></mark>',
-            text
-        )
-        # Highlight Japanese (xanh lá)
-        text = re.sub(
-            cls.JAPANESE_PATTERN,
-            r'<mark style="background: #d1fae5; color: #065f46; font-weight: 600;">\g<0></mark>',
-            text
-        )
-        # Highlight Thai (tím)
-        text = re.sub(
-            cls.THAI_PATTERN,
-            r'<mark style="background: #e9d5ff; color: #6b21a8; font-weight: 600;">\g<0></mark>',
-            text
-        )
-        
-        return text
+        if spans is None:
+            spans = cls.scan(text)
+        if not spans:
+            return text
+        
+        styles = {key: style for key, _pattern, _flag, _label, style in cls.LANGUAGES}
+        parts = []
+        last = 0
+        for start, end, key in spans:
+            parts.append(text[last:start])
+            parts.append(f'<mark style="{styles[key]}">{text[start:end]}</mark>')
+            last = end
+        parts.append(text[last:])
+        return ''.join(parts)
     
     @classmethod
     def should_warn(cls, text: str, threshold: int = 3) -> bool:
         """
         Kiểm tra có nên hiển thị cảnh báo không
+        Dừng quét ngay khi đã đủ số ký tự ngoại ngữ (khác nhau) tối thiểu
+        
         Args:
             threshold: Số ký tự ngoại ngữ tối thiểu để cảnh báo
         """
-        result = cls.detect(text)
-        return result['total_count'] >= threshold
+        if threshold <= 0:
+            return True
+        if not text or text.isascii():
+            return False
+        
+        seen = set()
+        for match in cls.FOREIGN_RUN_REGEX.finditer(text):
+            seen.update(match.group())
+            if len(seen) >= threshold:
+                return True
+        return False
     
     @classmethod
     def get_warning_badge(cls, severity: str) -> str:
@@ -155,4 +207,14 @@ class ForeignCharDetector:
             'medium': '<span class="badge badge-warning">⚠️ Nhiều ký tự ngoại ngữ</span>',
             'high': '<span class="badge badge-danger">🚨 Rất nhiều ký tự ngoại ngữ - Cần dịch lại!</span>'
         }
-        return badges.get(severity, '')
\ No newline at end of file
+        return badges.get(severity, '')
+
+
+def scan_warnings(rows: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    """
+    Tính cảnh báo cho một đợt (id, translation) - hàm top-level để chạy được trong ProcessPoolExecutor
+    
+    Returns:
+        List (id, foreign_char_warning)
+    """
+    return [(pk, ForeignCharDetector.warning_for(text)) for pk, text in rows]
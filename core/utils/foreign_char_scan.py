@@ -0,0 +1,115 @@
+"""
+Quét lại ký tự ngoại ngữ cho toàn bộ segments (một novel hoặc cả DB)
+Dùng sau khi đổi detector hoặc import bản dịch có sẵn
+"""
+from itertools import groupby
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.db import transaction
+from ..models import Novel, Chapter, Segment
+from .foreign_char_detector import ForeignCharDetector, scan_warnings
+from .parallel import imap_chunks
+
+
+def _read_chunks(queryset, chunk_size: int) -> Iterator[List[Tuple[int, str]]]:
+    """Đọc (id, translation) theo từng đợt, không load toàn bộ segments vào bộ nhớ"""
+    chunk = []
+    for row in queryset.values_list('id', 'translation').iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _save_warnings(results: List[Tuple[int, str]]) -> int:
+    Segment.objects.bulk_update(
+        [Segment(id=pk, foreign_char_warning=warning) for pk, warning in results],
+        ['foreign_char_warning']
+    )
+    return len(results)
+
+
+def scan_segments(
+    novel: Optional[Novel] = None,
+    chunk_size: int = 500,
+    workers: Optional[int] = None,
+    progress: Optional[Callable] = None,
+) -> Dict:
+    """
+    Tính lại foreign_char_warning cho segments đã dịch, sau đó dựng lại cảnh báo của chapters
+
+    Args:
+        novel: Chỉ quét novel này (None = toàn bộ DB)
+        chunk_size: Số segments mỗi đợt gửi cho process pool
+        workers: Số process (mặc định os.cpu_count(); 1 = chạy tuần tự, không tạo process)
+        progress: Callback progress(scanned=..., total=...) để báo tiến độ (dùng bởi background job)
+
+    Returns:
+        Dict tổng kết
+    """
+    segments = Segment.objects.exclude(translation__isnull=True).order_by('id')
+    if novel is not None:
+        segments = segments.filter(chapter__novel=novel)
+
+    total = segments.count()
+    scanned = 0
+    with_warning = 0
+
+    def collect(results):
+        nonlocal scanned, with_warning
+        scanned += _save_warnings(results)
+        with_warning += sum(1 for _pk, warning in results if warning)
+        if progress:
+            progress(scanned=scanned, total=total)
+
+    for results in imap_chunks(scan_warnings, _read_chunks(segments, chunk_size), workers=workers):
+        collect(results)
+
+    chapters = rebuild_chapter_warnings(novel, chunk_size=chunk_size)
+
+    return {
+        'scanned_segments': scanned,
+        'segments_with_warning': with_warning,
+        'chapters_with_warning': chapters,
+    }
+
+
+def rebuild_chapter_warnings(novel: Optional[Novel] = None, chunk_size: int = 500) -> int:
+    """
+    Dựng lại Chapter.foreign_char_warning từ segments, đọc theo thứ tự (chapter, index)
+
+    Returns:
+        Số chapters có cảnh báo
+    """
+    chapters = Chapter.objects.filter(segments__isnull=False)
+    rows = Segment.objects.exclude(
+        foreign_char_warning__isnull=True
+    ).exclude(foreign_char_warning='').order_by('chapter_id', 'index')
+    if novel is not None:
+        chapters = chapters.filter(novel=novel)
+        rows = rows.filter(chapter__novel=novel)
+
+    rows = rows.values_list('chapter_id', 'index', 'foreign_char_warning').iterator(chunk_size=chunk_size)
+
+    count = 0
+    with transaction.atomic():
+        # Chapters có segments nhưng không còn cảnh báo
+        chapters.exclude(foreign_char_warning__isnull=True).update(foreign_char_warning=None)
+
+        batch = []
+        for chapter_id, group in groupby(rows, key=lambda row: row[0]):
+            batch.append(Chapter(
+                id=chapter_id,
+                foreign_char_warning=ForeignCharDetector.aggregate_segment_warnings(
+                    (index, warning) for _chapter_id, index, warning in group
+                )
+            ))
+            if len(batch) >= chunk_size:
+                count += Chapter.objects.bulk_update(batch, ['foreign_char_warning'])
+                batch = []
+        if batch:
+            count += Chapter.objects.bulk_update(batch, ['foreign_char_warning'])
+
+    return count
@@ -1,36 +1,44 @@
 """
 Quản lý Gemini API client với rotation key từ database
 """
+import itertools
 import time
 import re
-from typing import Optional
+from typing import Iterator, Optional
 from google import genai
 from google.genai import types
+from django.conf import settings
 from django.core.cache import cache
-from django.utils import timezone
-from ..models import APIKey
+from .fake_llm import FakeGeminiClient, get_fake_llm
+from .llm_tracing import traced_call
+from .context_cache import generate_with_gemini_cache
+from .resilience import APIKeyPool, call_with_retries
+from .tokens import estimate_tokens
 
 
-class GeminiClientManager:
-    """Quản lý Gemini client với rotation API key mỗi 1 tiếng từ database"""
+class GeminiClientManager(APIKeyPool):
+    """
+    Quản lý Gemini client với rotation API key mỗi 1 tiếng từ database
+    Bỏ qua các key đang bị circuit breaker khóa (xem resilience.KeyCircuitBreaker)
+    """
     
     CACHE_KEY_INDEX = 'gemini_current_key_index'
     CACHE_KEY_TIME = 'gemini_last_switch_time'
     ROTATION_INTERVAL = 3600  # 1 tiếng (3600 giây)
     
     def __init__(self):
-        self.api_keys = self._load_api_keys_from_db()
+        super().__init__('gemini')
+        self.fake = get_fake_llm()
+        if self.fake and not self.api_keys:
+            # LLM giả lập không cần key thật
+            self.api_keys = [(0, 'fake')]
         if not self.api_keys:
             raise ValueError("⚠️ Không có API key nào active trong database!")
     
-    def _load_api_keys_from_db(self) -> list:
-        """Load API keys từ database (chỉ lấy key active)"""
-        keys = APIKey.objects.filter(
-            provider='gemini',
-            is_active=True
-        ).order_by('id').values_list('id', 'key')
-        
-        return [(key_id, key) for key_id, key in keys]
+    def _make_client(self, api_key: str) -> genai.Client:
+        if self.fake:
+            return FakeGeminiClient(self.fake)
+        return genai.Client(api_key=api_key)
     
     def _get_current_index(self) -> int:
         """Lấy index hiện tại từ cache"""
@@ -38,7 +46,7 @@ class GeminiClientManager:
         if index is None:
             cache.set(self.CACHE_KEY_INDEX, 0, timeout=None)
             return 0
-        return int(index)
+        return int(index) % len(self.api_keys)
     
     def _get_last_switch_time(self) -> float:
         """Lấy thời gian switch cuối từ cache"""
@@ -49,29 +57,27 @@ class GeminiClientManager:
             return now
         return float(last_time)
     
+    def _set_index(self, index: int):
+        cache.set(self.CACHE_KEY_INDEX, index, timeout=None)
+        cache.set(self.CACHE_KEY_TIME, time.time(), timeout=None)
+    
     def _rotate_key(self):
         """Đổi sang API key tiếp theo"""
         current_index = self._get_current_index()
         new_index = (current_index + 1) % len(self.api_keys)
-        cache.set(self.CACHE_KEY_INDEX, new_index, timeout=None)
-        cache.set(self.CACHE_KEY_TIME, time.time(), timeout=None)
+        self._set_index(new_index)
         print(f"🔄 Đã đổi API key sang key số {new_index + 1}/{len(self.api_keys)}")
     
-    def _mark_key_used(self, key_id: int):
-        """Cập nhật usage count cho key"""
-        try:
-            api_key = APIKey.objects.get(id=key_id)
-            api_key.mark_used()
-        except APIKey.DoesNotExist:
-            pass
-    
     def get_client(self) -> tuple[genai.Client, int]:
         """
         Trả về Gemini client với API key hiện tại
-        Tự động rotate sau mỗi 1 tiếng
+        Tự động rotate sau mỗi 1 tiếng, bỏ qua key đang bị khóa
         
         Returns:
             Tuple (client, key_id)
+        
+        Raises:
+            resilience.AllKeysUnavailable: mọi key đều đang bị khóa
         """
         now = time.time()
         last_switch = self._get_last_switch_time()
@@ -81,12 +87,18 @@ class GeminiClientManager:
             self._rotate_key()
         
         current_index = self._get_current_index()
-        key_id, api_key = self.api_keys[current_index]
+        index = self._healthy_index(current_index)
+        if index is None:
+            raise self._unavailable()
+        if index != current_index:
+            self._set_index(index)
+            print(f"🔀 Key số {current_index + 1} đang tạm khóa, dùng key số {index + 1}/{len(self.api_keys)}")
+        key_id, api_key = self.api_keys[index]
         
         # Đánh dấu key đã được sử dụng
         self._mark_key_used(key_id)
         
-        return genai.Client(api_key=api_key), key_id
+        return self._make_client(api_key), key_id
     
     def force_rotate(self):
         """Ép buộc đổi key ngay lập tức (dùng khi bị rate limit)"""
@@ -94,55 +106,177 @@ class GeminiClientManager:
         return self.get_client()
 
 
+class ResilientGeminiClient:
+    """
+    Bọc genai.Client: mỗi lần gọi client.models.generate_content / generate_content_stream
+    đều được thử lại, đổi key khi bị rate limit (xem resilience.call_with_retries)
+    và được ghi vào LLMCallLog (xem llm_tracing)
+    """
+
+    def __init__(self, manager: GeminiClientManager, **trace):
+        """
+        Args:
+            trace: Giá trị mặc định khi trace (operation, novel_id...), trace_context bên ngoài được ưu tiên
+        """
+        self.manager = manager
+        self.trace = {'operation': 'gemini', **trace}
+        self.models = _ResilientModels(self)
+
+    def call(self, method: str, *args, **kwargs):
+        def run(client):
+            return getattr(client.models, method)(*args, **kwargs)
+
+        if method != 'generate_content':
+            return call_with_retries(self.manager, run)
+        with traced_call(provider='gemini', model=kwargs.get('model'), prompt=kwargs.get('contents'),
+                         **self.trace) as call:
+            response = call_with_retries(self.manager, run)
+            call.usage, call.response_text = extract_usage(response), getattr(response, 'text', '')
+        return response
+
+    def stream(self, model: str, contents: str, config: types.GenerateContentConfig, prefix: str = "") -> Iterator:
+        """
+        Như call('generate_content_stream') - chỉ thử lại khi chưa nhận được đoạn nào
+        (đã gửi một phần bản dịch cho người dùng thì không thể thử lại trong suốt)
+
+        Args:
+            prefix: Phần đầu prompt cố định theo novel, gửi bằng context cache nếu được (xem context_cache),
+                contents chỉ là phần sau
+        """
+        def start(client, key_id):
+            def generate(cached_content):
+                chunks = iter(client.models.generate_content_stream(
+                    model=model,
+                    contents=contents if cached_content else prefix + contents,
+                    config=config.model_copy(update={'cached_content': cached_content})
+                ))
+                return chunks, next(chunks, None)
+
+            return generate_with_gemini_cache(client, key_id, model, prefix, generate)
+
+        # Không giữ context trace qua các lần yield (generator có thể được đọc ở context khác)
+        with traced_call(provider='gemini', model=model, prompt=prefix + contents,
+                         defer_finish=True, **self.trace) as call:
+            chunks, first = call_with_retries(self.manager, start, pass_key_id=True)
+
+        texts = []
+        last = None
+        outcome, error = 'cancelled', None
+        try:
+            if first is not None:
+                for chunk in itertools.chain([first], chunks):
+                    last = chunk
+                    texts.append(getattr(chunk, 'text', None) or '')
+                    yield chunk
+            outcome = 'ok'
+        except Exception as e:
+            outcome, error = 'error', e
+            raise
+        finally:
+            # Chunk cuối có usage của cả request
+            call.usage, call.response_text = extract_usage(last), ''.join(texts)
+            call.finish(error=error, outcome=outcome)
+
+
+class _ResilientModels:
+    """Giao diện giống client.models của google-genai"""
+
+    def __init__(self, owner: ResilientGeminiClient):
+        self._owner = owner
+
+    def generate_content(self, *args, **kwargs):
+        return self._owner.call('generate_content', *args, **kwargs)
+
+    def generate_content_stream(self, model: str, contents: str, config, prefix: str = ""):
+        return self._owner.stream(model, contents, config, prefix)
+
+    def count_tokens(self, *args, **kwargs):
+        return self._owner.call('count_tokens', *args, **kwargs)
+
+
 # Singleton instance
 _manager = None
 
-def get_gemini_client() -> genai.Client:
-    """
-    Helper function để lấy Gemini client
-    Usage: client = get_gemini_client()
-    """
+def get_gemini_manager() -> GeminiClientManager:
+    """GeminiClientManager dùng chung cho process"""
     global _manager
     if _manager is None:
         _manager = GeminiClientManager()
-    client, _ = _manager.get_client()
-    return client
+    return _manager
 
 
-def translate_with_gemini(
-    source_text: str,
-    glossary_context: str = "",
-    pre_chapters: str = "",
-    translation_style: str = "",
-    model: str = "gemini-2.5-pro"
-) -> tuple[str, str]:
+def get_gemini_client(**trace) -> ResilientGeminiClient:
     """
-    Dịch văn bản bằng Gemini
-    
-    Args:
-        source_text: Văn bản gốc cần dịch
-        glossary_context: Bảng thuật ngữ
-        pre_chapters: Các chương đã dịch trước đó
-        model: Model Gemini sử dụng
-    
-    Returns:
-        Tuple (title_translation, content_translation)
+    Helper function để lấy Gemini client (tự retry, đổi key khi bị rate limit, ghi LLMCallLog)
+    Usage: client = get_gemini_client(operation='review')
     """
-    client = get_gemini_client()
-    style_section = ""
-    if translation_style:
-        style_section = f"""
+    return ResilientGeminiClient(get_gemini_manager(), **trace)
+
+
+def extract_usage(response) -> dict:
+    """Lấy số token prompt/output (và token prompt đọc từ context cache) từ usage_metadata của response Gemini"""
+    usage = getattr(response, 'usage_metadata', None)
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_token_count', None) or 0,
+        'output_tokens': getattr(usage, 'candidates_token_count', None) or 0,
+        'cached_tokens': getattr(usage, 'cached_content_token_count', None) or 0,
+    }
+
+
+def _safety_settings() -> list:
+    """Tắt bộ lọc an toàn (nội dung tiểu thuyết hay bị chặn nhầm)"""
+    return [
+        types.SafetySetting(category=category, threshold=types.HarmBlockThreshold.OFF)
+        for category in (
+            types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+            types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+            types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+            types.HarmCategory.HARM_CATEGORY_HARASSMENT,
+        )
+    ]
+
+
+def _parse_title_content(text: str) -> tuple[str, str]:
+    """Tách ###TITLE### / ###CONTENT### trong kết quả dịch (không đúng format thì coi toàn bộ là content)"""
+    if "###TITLE###" in text and "###CONTENT###" in text:
+        title_part, content_part = text.split("###CONTENT###", 1)
+        return title_part.replace("###TITLE###", "").strip(), content_part.strip()
+    return "", text.strip()
+
+
+def _style_section(translation_style: str) -> str:
+    if not translation_style:
+        return ""
+    return f"""
 ## ✨ Phong cách dịch
 {translation_style}
 """
 
-    prompt = f"""
-# 🌸 Vai trò
+
+TRANSLATOR_ROLE = """# 🌸 Vai trò
 Bạn là một **biên tập viên dịch thuật tài hoa**, với trái tim dành trọn cho từng con chữ.  
 Hãy gìn giữ nguyên vẹn **tinh hoa của từng dòng thơ, từng câu văn** — như những báu vật thiêng liêng của tác phẩm gốc.  
 Sau đó, bằng bàn tay khéo léo và hơi thở của nghệ sĩ, **hãy mài giũa ngôn từ cho long lanh hơn**, khơi dậy linh hồn sâu lắng,  
 để văn bản không chỉ truyền tải mà còn **lay động trái tim người đọc**, như dòng sông quê hương êm đềm mà cuốn cuộn sóng ngầm cảm xúc.
+"""
+
+
+def _glossary_section(glossary_context: str) -> str:
+    return f"""
+## 📚 Dịch đúng theo bảng thuật ngữ tên riêng:
+{glossary_context if glossary_context else "Không có glossary"}
+"""
+
 
+def build_translation_prefix(glossary_context: str = "", translation_style: str = "") -> str:
+    """
+    Phần đầu prompt dịch giống nhau cho mọi segment của novel (vai trò, nhiệm vụ, phong cách, glossary, định dạng output)
+    Đặt trước phần thay đổi để provider cache được (xem context_cache)
+    """
+    style_section = _style_section(translation_style)
+
+    return f"""
+{TRANSLATOR_ROLE}
 ---
 
 # 🎯 Nhiệm vụ
@@ -153,29 +287,80 @@ Dịch **đúng theo bảng thuật ngữ tên riêng bên dưới**.
 {style_section}
 
 ---
+{_glossary_section(glossary_context)}
+---
+
+# ⚠️ Yêu cầu xuất kết quả
+Chỉ xuất đúng theo định dạng sau, **không thêm bất kỳ lời giải thích nào khác**:
+
+###TITLE###
+<tiêu đề dịch>
+
+###CONTENT###
+<nội dung dịch>
+
+---
+"""
+
 
+def build_translation_suffix(source_text: str, pre_chapters: str = "") -> str:
+    """Phần cuối prompt dịch, thay đổi theo từng segment (các chương trước, nội dung gốc)"""
+    return f"""
 ## 📜 Dữ liệu đầu vào
 
 ### Các chương trước (tham khảo ngữ cảnh):
 {pre_chapters if pre_chapters else "Không có"}
 
-### Dịch đúng theo bảng thuật ngữ tên riêng:
-{glossary_context if glossary_context else "Không có glossary"}
-
 ### Nội dung gốc cần dịch:
 {source_text}
 
 ---
+Xuất kết quả đúng định dạng ở phần **Yêu cầu xuất kết quả**.
+"""
 
-# ⚠️ Yêu cầu xuất kết quả
-Chỉ xuất đúng theo định dạng sau, **không thêm bất kỳ lời giải thích nào khác**:
 
-###TITLE###
-<tiêu đề dịch>
+def build_translation_prompt(
+    source_text: str,
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = ""
+) -> str:
+    """Prompt dịch (dùng chung cho việc gọi API và ước lượng phần overhead của prompt)"""
+    return (build_translation_prefix(glossary_context, translation_style)
+            + build_translation_suffix(source_text, pre_chapters))
 
-###CONTENT###
-<nội dung dịch>
-"""
+
+def translation_prompt_overhead(
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = ""
+) -> int:
+    """Số token ước lượng của prompt dịch khi chưa có nội dung cần dịch"""
+    return estimate_tokens(build_translation_prompt("", glossary_context, pre_chapters, translation_style))
+
+
+def translate_with_gemini(
+    source_text: str,
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = "",
+    model: str = None
+) -> tuple[str, str]:
+    """
+    Dịch văn bản bằng Gemini
+    
+    Args:
+        source_text: Văn bản gốc cần dịch
+        glossary_context: Bảng thuật ngữ
+        pre_chapters: Các chương đã dịch trước đó
+        model: Model Gemini sử dụng (mặc định settings.TRANSLATION_MODEL)
+    
+    Returns:
+        Tuple (title_translation, content_translation)
+    """
+    client = get_gemini_client(operation='translate')
+    model = model or getattr(settings, 'TRANSLATION_MODEL', 'gemini-2.5-pro')
+    prompt = build_translation_prompt(source_text, glossary_context, pre_chapters, translation_style)
 
     try:
         response = client.models.generate_content(
@@ -183,67 +368,228 @@ Chỉ xuất đúng theo định dạng sau, **không thêm bất kỳ lời gi
             contents=prompt,
             config=types.GenerateContentConfig(
                 temperature=0.3,
-                safety_settings=[
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                        threshold=types.HarmBlockThreshold.OFF,
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                        threshold=types.HarmBlockThreshold.OFF,
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                        threshold=types.HarmBlockThreshold.OFF,
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                        threshold=types.HarmBlockThreshold.OFF,
-                    ),
-                ]
+                safety_settings=_safety_settings()
             )
         )
-        
-        print(prompt)
-        text = response.text.strip()
-        
-        # Parse kết quả
-        title_trans, content_trans = "", ""
-        if "###TITLE###" in text and "###CONTENT###" in text:
-            parts = text.split("###CONTENT###")
-            title_part = parts[0].replace("###TITLE###", "").strip()
-            content_part = parts[1].strip()
-            title_trans = title_part
-            content_trans = content_part
-        else:
-            # Fallback: nếu không có format chuẩn, lấy toàn bộ text
-            content_trans = text
-        
-        return title_trans, content_trans
+
+        return _parse_title_content(response.text.strip())
         
     except Exception as e:
         raise Exception(f"Lỗi khi dịch với Gemini: {str(e)}")
 
 
-def review_with_gemini(
+def stream_translation_with_gemini(
     source_text: str,
-    translated_text: str,
-    model: str = "gemini-2.5-flash"
-) -> tuple[float, str]:
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = "",
+    model: str = None,
+    trace: Optional[dict] = None
+) -> Iterator[str]:
     """
-    Review chất lượng bản dịch bằng Gemini
+    Như translate_with_gemini nhưng trả về từng đoạn text ngay khi model sinh ra
+    Dùng TranslationStream để tách dần tiêu đề/nội dung
+
+    Args:
+        trace: novel_id/chapter_id/segment_id ghi vào LLMCallLog (generator chạy ngoài trace_context của chỗ gọi)
+    """
+    client = get_gemini_client(operation='translate_stream', **(trace or {}))
+    model = model or getattr(settings, 'TRANSLATION_MODEL', 'gemini-2.5-pro')
+
+    try:
+        for chunk in client.models.generate_content_stream(
+            model=model,
+            contents=build_translation_suffix(source_text, pre_chapters),
+            config=types.GenerateContentConfig(
+                temperature=0.3,
+                safety_settings=_safety_settings()
+            ),
+            # Prefix (glossary, phong cách...) gửi bằng context cache như các lần dịch không stream
+            prefix=build_translation_prefix(glossary_context, translation_style)
+        ):
+            if chunk.text:
+                yield chunk.text
+    except Exception as e:
+        raise Exception(f"Lỗi khi dịch với Gemini: {str(e)}")
+
+
+class TranslationStream:
+    """Gom các đoạn text đang stream và tách dần tiêu đề/nội dung theo format ###TITLE### / ###CONTENT###"""
+
+    # Marker có thể bị cắt giữa hai đoạn stream ("###CONT") -> giữ lại chưa hiển thị
+    PARTIAL_MARKER = re.compile(r'#+[A-Z]*#*$')
+
+    def __init__(self):
+        self.text = ""
+        self.title = ""
+        self.sent_content = 0
+
+    def _partial(self) -> tuple[str, str]:
+        text = self.text.lstrip()
+        if "###CONTENT###" in text:
+            title_part, content = text.split("###CONTENT###", 1)
+            title = title_part.replace("###TITLE###", "").strip()
+            content = content.lstrip()
+        elif text.startswith("#"):
+            # Đang ở phần tiêu đề (hoặc chưa nhận đủ marker ###TITLE###)
+            title = text.split("###TITLE###", 1)[1].strip() if "###TITLE###" in text else ""
+            content = ""
+        else:
+            # Model không theo format -> toàn bộ là nội dung (giống _parse_title_content)
+            title, content = "", text
+        return self.PARTIAL_MARKER.sub("", title).rstrip(), self.PARTIAL_MARKER.sub("", content)
+
+    def feed(self, chunk: str) -> tuple[str, str]:
+        """
+        Thêm một đoạn stream
+
+        Returns:
+            Tuple (tiêu đề hiện tại, phần nội dung mới kể từ lần feed trước)
+        """
+        self.text += chunk
+        self.title, content = self._partial()
+        delta = content[self.sent_content:]
+        self.sent_content = max(self.sent_content, len(content))
+        return self.title, delta
+
+    def result(self) -> tuple[str, str]:
+        """Tiêu đề/nội dung cuối cùng khi stream kết thúc"""
+        return _parse_title_content(self.text.strip())
+
+
+PACK_CHAPTER_PATTERN = re.compile(r'^[ \t]*###CHAPTER[ \t]+(\w+)###[ \t]*$', re.MULTILINE)
+
+
+def build_packed_translation_prefix(glossary_context: str = "", translation_style: str = "") -> str:
+    """Phần đầu prompt dịch pack giống nhau cho mọi pack của novel (xem build_translation_prefix)"""
+    style_section = _style_section(translation_style)
+
+    return f"""
+{TRANSLATOR_ROLE}
+---
+
+# 🎯 Nhiệm vụ
+Dịch **các chương liên tiếp** bên dưới sang **tiếng Việt**, mỗi chương gồm **tiêu đề (title)** và **nội dung (content)**,  
+giữ **văn phong mượt mà, nhất quán** giữa các chương.  
+Đọc **các chương trước** để tham khảo xương hồi và ngữ cảnh để các chương được mạch lạc.  
+Dịch **đúng theo bảng thuật ngữ tên riêng bên dưới**.  
+Mỗi chương bắt đầu bằng dòng `###CHAPTER <id>###`: **giữ nguyên dòng này**, không gộp, không bỏ sót chương nào.
+{style_section}
+
+---
+{_glossary_section(glossary_context)}
+---
+
+# ⚠️ Yêu cầu xuất kết quả
+Chỉ xuất đúng theo định dạng sau cho **từng chương theo đúng thứ tự**, **không thêm bất kỳ lời giải thích nào khác**:
+
+###CHAPTER <id>###
+###TITLE###
+<tiêu đề dịch>
+###CONTENT###
+<nội dung dịch>
+
+---
+"""
+
+
+def build_packed_translation_suffix(chapters: list[tuple[str, str, str]], pre_chapters: str = "") -> str:
+    """
+    Phần cuối prompt dịch pack: các chương trước và các chương cần dịch
     
     Args:
-        source_text: Văn bản gốc
-        translated_text: Bản dịch
-        model: Model Gemini sử dụng
+        chapters: List (id, tiêu đề gốc, nội dung gốc), id dùng để tách kết quả từng chương
+    """
+    source_text = "\n\n".join(
+        f"###CHAPTER {chapter_id}###\n###TITLE###\n{title}\n###CONTENT###\n{content}"
+        for chapter_id, title, content in chapters
+    )
+
+    return f"""
+## 📜 Dữ liệu đầu vào
+
+### Các chương trước (tham khảo ngữ cảnh):
+{pre_chapters if pre_chapters else "Không có"}
+
+### Các chương cần dịch:
+{source_text}
+
+---
+Xuất kết quả đúng định dạng ở phần **Yêu cầu xuất kết quả**, đủ {len(chapters)} chương.
+"""
+
+
+def build_packed_translation_prompt(
+    chapters: list[tuple[str, str, str]],
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = ""
+) -> str:
+    """
+    Prompt dịch nhiều chương ngắn liên tiếp trong một request
+    
+    Args:
+        chapters: List (id, tiêu đề gốc, nội dung gốc), id dùng để tách kết quả từng chương
+    """
+    return (build_packed_translation_prefix(glossary_context, translation_style)
+            + build_packed_translation_suffix(chapters, pre_chapters))
+
+
+def parse_packed_translation(text: str) -> dict:
+    """
+    Tách kết quả dịch nhiều chương theo dòng ###CHAPTER <id>###
     
     Returns:
-        Tuple (score: float 0-100, review_report: str)
+        Dict {id: (title_translation, content_translation)}, chương thiếu/rỗng không có trong dict
+    """
+    markers = list(PACK_CHAPTER_PATTERN.finditer(text or ""))
+    result = {}
+    for marker, following in zip(markers, markers[1:] + [None]):
+        body = text[marker.end():following.start() if following else len(text)]
+        title, content = _parse_title_content(body.strip())
+        if content and marker.group(1) not in result:
+            result[marker.group(1)] = (title, content)
+    return result
+
+
+def translate_pack_with_gemini(
+    chapters: list[tuple[str, str, str]],
+    glossary_context: str = "",
+    pre_chapters: str = "",
+    translation_style: str = "",
+    model: str = None
+) -> dict:
     """
-    client = get_gemini_client()
+    Dịch nhiều chương ngắn trong một request (phần prompt cố định chỉ gửi một lần)
     
-    prompt = f"""
+    Args:
+        chapters: List (id, tiêu đề gốc, nội dung gốc)
+    
+    Returns:
+        Dict {id: (title_translation, content_translation)} - chương AI không trả về sẽ không có trong dict
+    """
+    client = get_gemini_client(operation='translate_pack')
+    model = model or getattr(settings, 'TRANSLATION_MODEL', 'gemini-2.5-pro')
+    prompt = build_packed_translation_prompt(chapters, glossary_context, pre_chapters, translation_style)
+
+    try:
+        response = client.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                temperature=0.3,
+                safety_settings=_safety_settings()
+            )
+        )
+    except Exception as e:
+        raise Exception(f"Lỗi khi dịch với Gemini: {str(e)}")
+
+    return parse_packed_translation(response.text or "")
+
+
+def build_review_prompt(source_text: str, translated_text: str) -> str:
+    """Prompt review bản dịch (dùng chung cho mọi provider, kết quả bắt đầu bằng "Độ khớp: xx%")"""
+    return f"""
 Bạn là biên tập viên kiểm định chất lượng bản dịch song ngữ Trung–Việt.
 
 Nhiệm vụ:
@@ -264,6 +610,40 @@ Yêu cầu định dạng output (chỉ trả về đúng format này):
 译文：
 {translated_text[:40000]}
 """
+
+
+def parse_review_score(review_text: str) -> float:
+    """Lấy điểm % trong kết quả review (không tìm thấy thì 0)"""
+    match = re.search(r'(\d{1,3}(?:\.\d+)?)\s*%', review_text)
+    score = 0.0
+    if match:
+        try:
+            score = float(match.group(1))
+            score = min(max(score, 0.0), 100.0)
+        except ValueError:
+            score = 0.0
+    return score
+
+
+def review_with_gemini(
+    source_text: str,
+    translated_text: str,
+    model: str = "gemini-2.5-flash"
+) -> tuple[Optional[float], str]:
+    """
+    Review chất lượng bản dịch bằng Gemini
+    
+    Args:
+        source_text: Văn bản gốc
+        translated_text: Bản dịch
+        model: Model Gemini sử dụng
+    
+    Returns:
+        Tuple (score: float 0-100, review_report: str)
+        score = None nếu gọi Gemini thất bại (đã hết lượt thử lại) - không phải điểm 0%
+    """
+    client = get_gemini_client(operation='review')
+    prompt = build_review_prompt(source_text, translated_text)
     
     try:
         response = client.models.generate_content(
@@ -271,108 +651,66 @@ Yêu cầu định dạng output (chỉ trả về đúng format này):
             contents=prompt,
             config=types.GenerateContentConfig(
                 temperature=0.2,
-                safety_settings=[
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                        threshold=types.HarmBlockThreshold.OFF,
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                        threshold=types.HarmBlockThreshold.OFF,
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                        threshold=types.HarmBlockThreshold.OFF,
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                        threshold=types.HarmBlockThreshold.OFF,
-                    ),
-                ]
+                safety_settings=_safety_settings()
             )
         )
-        
-        print(prompt)
-        print("⚡ Gemini review response received.", response)
+
         review_text = response.text.strip()
         
-        # Extract score
-        match = re.search(r'(\d{1,3}(?:\.\d+)?)\s*%', review_text)
-        score = 0.0
-        if match:
-            try:
-                score = float(match.group(1))
-                score = min(max(score, 0.0), 100.0)
-            except ValueError:
-                score = 0.0
-        
-        return score, review_text
+        return parse_review_score(review_text), review_text
         
     except Exception as e:
-        return 0.0, f"Lỗi khi review: {str(e)}"
+        return None, f"Lỗi khi review: {str(e)}"
 
 
-def fix_translation_with_gemini(
-    original_title: str,
-    original_content: str,
-    translated_title: str,
-    translated_content: str,
+def fix_sentences_with_gemini(
+    items: list[tuple[str, str]],
     glossary_context: str = "",
-    model: str = "gemini-2.0-flash"
-) -> tuple[str, str]:
+    model: str = "gemini-2.5-flash"
+) -> tuple[list, dict]:
     """
-    Sửa bản dịch còn sót ký tự ngoại ngữ
+    Sửa các câu dịch còn sót ký tự ngoại ngữ (chỉ gửi các câu lỗi, không gửi cả segment)
+    
+    Args:
+        items: List (câu gốc tham khảo, câu dịch lỗi)
     
     Returns:
-        Tuple (fixed_title, fixed_content)
+        Tuple (câu đã sửa theo đúng thứ tự items - None nếu AI không trả về, usage)
     """
-    client = get_gemini_client()
+    client = get_gemini_client(operation='fix_sentences')
+    
+    numbered = "\n\n".join(
+        f"[{i}]\nGốc: {source}\nDịch: {translated}"
+        for i, (source, translated) in enumerate(items, 1)
+    )
     
     prompt = f"""
-Bạn là dịch giả tiểu thuyết chuyên nghiệp.
-Bản dịch dưới đây vẫn còn sót chữ Hán hoặc các ký tự ngoại ngữ.
-Hãy dịch lại thành bản hoàn chỉnh 100% tiếng Việt, giữ nguyên phong cách và nội dung.
+Bạn là dịch giả tiểu thuyết Trung–Việt chuyên nghiệp.
+Các câu dịch dưới đây vẫn còn sót chữ Hán hoặc ký tự ngoại ngữ.
+Hãy sửa lại từng câu thành 100% tiếng Việt, giữ nguyên ý và văn phong, dựa vào câu gốc để tham khảo.
 
 Glossary (ưu tiên sử dụng):
 {glossary_context if glossary_context else "Không có"}
 
 ---
-Tiêu đề gốc: {original_title}
-Tiêu đề dịch hiện tại: {translated_title}
-
-Nội dung gốc:
-{original_content[:40000]}
-
-Nội dung dịch hiện tại:
-{translated_content[:40000]}
-
+{numbered}
 ---
-⚠️ Xuất kết quả theo định dạng:
-
-###TITLE###
-<tiêu đề dịch hoàn chỉnh>
 
-###CONTENT###
-<nội dung dịch hoàn chỉnh>
+⚠️ Chỉ xuất các câu đã sửa, mỗi câu một dòng đúng số thứ tự, không giải thích:
+[1] <câu đã sửa>
+[2] <câu đã sửa>
 """
     
-    try:
-        response = client.models.generate_content(
-            model=model,
-            contents=prompt,
-            config=types.GenerateContentConfig(temperature=0.3)
-        )
-        
-        text = response.text.strip()
-        
-        title_new, content_new = translated_title, translated_content
-        if "###TITLE###" in text and "###CONTENT###" in text:
-            parts = text.split("###CONTENT###")
-            title_new = parts[0].replace("###TITLE###", "").strip()
-            content_new = parts[1].strip()
-        
-        return title_new, content_new
-        
-    except Exception as e:
-        print(f"⚠️ Lỗi khi fix translation: {e}")
-        return translated_title, translated_content
\ No newline at end of file
+    response = client.models.generate_content(
+        model=model,
+        contents=prompt,
+        config=types.GenerateContentConfig(temperature=0.2)
+    )
+    
+    fixed = [None] * len(items)
+    for match in re.finditer(r'^\s*\[(\d+)\]\s*(.*\S)', response.text or "", re.MULTILINE):
+        index = int(match.group(1)) - 1
+        if 0 <= index < len(items):
+            fixed[index] = match.group(2)
+    
+    return fixed, extract_usage(response)
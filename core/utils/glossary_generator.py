@@ -1,29 +1,34 @@
 """
 Tự động tạo glossary từ nội dung chapters
 """
-import re
-from typing import List, Dict, Tuple
-from django.db import transaction
-from ..models import Novel, Chapter, Glossary
-from .gemini_client import get_gemini_client
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Tuple, Iterator
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from ..models import Novel, Chapter, Glossary, GlossaryRun, GlossaryBatch
+from .gemini_client import get_gemini_client, extract_usage
+from .tokens import estimate_tokens
 from google.genai import types
 
 
 class GlossaryGenerator:
     """Tạo glossary tự động từ chapters"""
     
-    MAX_WORDS_PER_BATCH = 80000  # Mỗi batch tối đa 20k từ
+    MAX_TOKENS_PER_BATCH = 60000  # Token ước lượng tối đa của nội dung mỗi batch
+    CONFLICT_NOTE_PREFIX = '⚠️ Bản dịch khác: '
     
     def __init__(self, novel: Novel):
         self.novel = novel
-        self.client = get_gemini_client()
+        self._client = None
     
-    @staticmethod
-    def count_words(text: str) -> int:
-        """Đếm số từ (ký tự Hán + từ Latin)"""
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text))
-        other_words = len(re.findall(r'\b\w+\b', text))
-        return chinese_chars + other_words
+    @property
+    def client(self):
+        """Chỉ khởi tạo Gemini client khi thực sự gọi API"""
+        if self._client is None:
+            self._client = get_gemini_client(operation='glossary', novel_id=self.novel.id)
+        return self._client
     
     def get_existing_glossary(self) -> str:
         """Lấy glossary hiện có để tham khảo"""
@@ -36,84 +41,85 @@ class GlossaryGenerator:
     
     def get_checkpoint(self) -> int:
         """
-        Lấy vị trí checkpoint (chapter cuối cùng đã xử lý)
-        Lưu trong field description của novel
+        Lấy vị trí checkpoint (ordinal của chapter cuối cùng đã xử lý)
+        Đọc từ GlossaryRun/GlossaryBatch, không gọi LLM
         """
-        # Parse checkpoint từ description (format: "checkpoint:123")
-        if self.novel.description:
-            match = re.search(r'checkpoint:(\d+)', self.novel.description)
-            if match:
-                return int(match.group(1))
-        return 0
+        return GlossaryRun.checkpoint_for(self.novel)
     
-    def save_checkpoint(self, chapter_index: int):
-        """Lưu checkpoint vào novel description"""
-        if not self.novel.description:
-            self.novel.description = f"checkpoint:{chapter_index}"
-        else:
-            # Replace existing checkpoint or append
-            if 'checkpoint:' in self.novel.description:
-                self.novel.description = re.sub(
-                    r'checkpoint:\d+',
-                    f'checkpoint:{chapter_index}',
-                    self.novel.description
-                )
-            else:
-                self.novel.description += f"\ncheckpoint:{chapter_index}"
-        self.novel.save(update_fields=['description'])
+    def reset_checkpoint(self):
+        """Bỏ qua các lần chạy trước, lần tạo tiếp theo xử lý từ đầu"""
+        GlossaryRun.objects.filter(novel=self.novel).exclude(status='reset').update(status='reset')
     
-    def batch_chapters(self, start_chapter: int = 0) -> List[List[Chapter]]:
+    def fill_token_counts(self, chunk_size: int = 200) -> int:
         """
-        Chia chapters thành các batch ~20k từ
+        Tính token_count cho các chapters chưa có (dữ liệu cũ), đọc nội dung theo từng đợt
+        
+        Returns:
+            Số chapters được cập nhật
+        """
+        pending = self.novel.chapters.filter(
+            token_count__isnull=True
+        ).only('id', 'content_raw').iterator(chunk_size=chunk_size)
+        
+        updated = 0
+        chunk = []
+        for chapter in pending:
+            chapter.token_count = estimate_tokens(chapter.content_raw)
+            chunk.append(chapter)
+            if len(chunk) >= chunk_size:
+                updated += Chapter.objects.bulk_update(chunk, ['token_count'])
+                chunk = []
+        if chunk:
+            updated += Chapter.objects.bulk_update(chunk, ['token_count'])
+        return updated
+    
+    def batch_chapters(self, start_chapter: int = 0) -> Iterator[List[Chapter]]:
+        """
+        Chia chapters thành các batch tối đa MAX_TOKENS_PER_BATCH token (ước lượng)
+        Chỉ đọc ordinal và token_count, không load nội dung; chapter dài hơn giới hạn
+        sẽ thành một batch riêng chứ không bị cắt bớt.
         
         Args:
-            start_chapter: Index chapter bắt đầu (0-based)
+            start_chapter: Checkpoint - ordinal của chapter cuối đã xử lý (0 = từ đầu)
         
-        Returns:
-            List of chapter batches
+        Yields:
+            List chapters của từng batch (chỉ có id, ordinal, token_count)
         """
-        all_chapters = []
-        for volume in self.novel.volumes.all().order_by('index'):
-            chapters = volume.chapters.filter(
-                content_raw__isnull=False
-            ).order_by('index')
-            all_chapters.extend(chapters)
+        self.fill_token_counts()
         
-        # Skip đến start_chapter
-        all_chapters = all_chapters[start_chapter:]
+        # Chapters sau checkpoint theo thứ tự global (dùng index (novel, ordinal))
+        chapters = self.novel.chapters.filter(
+            ordinal__gt=start_chapter,
+            token_count__gt=0
+        ).only('id', 'ordinal', 'token_count').order_by('ordinal')
         
-        batches = []
         current_batch = []
-        current_word_count = 0
+        current_tokens = 0
         
-        for chapter in all_chapters:
-            if not chapter.content_raw:
-                continue
-            
-            chapter_words = self.count_words(chapter.content_raw)
-            
-            # Nếu thêm chapter này vượt quá limit, lưu batch hiện tại
-            if current_word_count + chapter_words > self.MAX_WORDS_PER_BATCH and current_batch:
-                batches.append(current_batch)
-                current_batch = [chapter]
-                current_word_count = chapter_words
-            else:
-                current_batch.append(chapter)
-                current_word_count += chapter_words
+        for chapter in chapters.iterator():
+            # Nếu thêm chapter này vượt quá limit, trả về batch hiện tại
+            if current_batch and current_tokens + chapter.token_count > self.MAX_TOKENS_PER_BATCH:
+                yield current_batch
+                current_batch = []
+                current_tokens = 0
+            current_batch.append(chapter)
+            current_tokens += chapter.token_count
         
-        # Thêm batch cuối
+        # Batch cuối
         if current_batch:
-            batches.append(current_batch)
-        
-        return batches
+            yield current_batch
     
-    def extract_glossary_from_batch(
+    def _request_glossary(
         self,
         chapters: List[Chapter],
         existing_glossary: str
-    ) -> str:
-        """Gọi Gemini để trích xuất glossary từ batch chapters"""
+    ) -> Tuple[str, Dict]:
+        """
+        Gọi Gemini trích xuất glossary, lỗi sẽ được raise để batch được đánh dấu failed
         
+        Returns:
+            Tuple (glossary_text, usage)
+        """
         # Ghép nội dung chapters
         content = "\n\n".join([
             f"=== {ch.title} ===\n{ch.content_raw}"
@@ -122,7 +128,7 @@ class GlossaryGenerator:
         ])
         
         if not content.strip():
-            return ""
+            return "", extract_usage(None)
         
         prompt = f"""
 # 🧙 Vai trò
@@ -134,8 +140,7 @@ Bạn là **công cụ hỗ trợ dịch thuật chuyên cho truyện tiểu thu
 Hãy **trích xuất và bổ sung BẢNG THUẬT NGỮ (Glossary)** từ văn bản sau:
 
 ---
-{content[:75000]}  
-(... và các chương tiếp theo)
+{content}
 ---
 
 ---
@@ -179,20 +184,31 @@ Ví dụ:
 剑圣 = Kiếm Thánh
 """
 
-        try:
-            response = self.client.models.generate_content(
-                model="gemini-2.5-pro",
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.3,
-                )
+        response = self.client.models.generate_content(
+            model="gemini-2.5-pro",
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                temperature=0.3,
             )
+        )
+        
+        return (response.text or "").strip(), extract_usage(response)
+    
+    @staticmethod
+    def parse_glossary_text(glossary_text: str) -> List[Tuple[str, str]]:
+        """Parse các dòng '原文 = Dịch' thành list (term_cn, term_vi) theo thứ tự"""
+        pairs = []
+        for line in glossary_text.strip().split('\n'):
+            line = line.strip()
+            if not line or '=' not in line:
+                continue
             
-            return response.text.strip()
-            
-        except Exception as e:
-            print(f"⚠️ Lỗi khi tạo glossary: {e}")
-            return ""
+            # Parse: 原文 = Dịch
+            term_cn, term_vi = (part.strip() for part in line.split('=', 1))
+            if not term_cn or not term_vi or len(term_cn) > 128 or len(term_vi) > 128:
+                continue
+            pairs.append((term_cn, term_vi))
+        return pairs
     
     def parse_and_save_glossary(self, glossary_text: str) -> int:
         """
@@ -204,115 +220,452 @@ Ví dụ:
         if not glossary_text.strip():
             return 0
         
-        lines = glossary_text.strip().split('\n')
-        new_count = 0
+        new_count, _ = self.merge_candidates(self.parse_glossary_text(glossary_text))
+        return new_count
+    
+    def merge_candidates(self, candidates: List[Tuple[str, str]]) -> Tuple[int, int]:
+        """
+        Gộp candidates (đã theo thứ tự chapter) vào glossary
+        - Term chưa có: thêm mới, lần xuất hiện đầu tiên thắng
+        - Term đã có nhưng bản dịch khác: giữ bản dịch cũ, đánh dấu needs_review
+          và ghi bản dịch khác vào note để review/reconcile
+        
+        Returns:
+            Tuple (số terms mới, số terms bị đánh dấu xung đột)
+        """
+        if not candidates:
+            return 0, 0
+        
+        entries = {
+            term.term_cn: term
+            for term in self.novel.glossaries.filter(term_cn__in={cn for cn, _ in candidates})
+        }
+        existing_terms = set(entries)
+        new_entries = []
+        flagged = {}
+        
+        for term_cn, term_vi in candidates:
+            entry = entries.get(term_cn)
+            if entry is None:
+                entry = Glossary(novel=self.novel, term_cn=term_cn, term_vi=term_vi, note='')
+                entries[term_cn] = entry
+                new_entries.append(entry)
+                continue
+            
+            if entry.term_vi.casefold() == term_vi.casefold():
+                continue
+            conflict_line = f"{self.CONFLICT_NOTE_PREFIX}{term_vi}"
+            if conflict_line in (entry.note or ''):
+                continue
+            entry.note = f"{entry.note}\n{conflict_line}".strip() if entry.note else conflict_line
+            entry.needs_review = True
+            flagged[term_cn] = entry
         
         with transaction.atomic():
-            for line in lines:
-                line = line.strip()
-                if not line or '=' not in line:
-                    continue
-                
-                # Parse: 原文 = Dịch
-                parts = line.split('=', 1)
-                if len(parts) != 2:
-                    continue
-                
-                term_cn = parts[0].strip()
-                term_vi = parts[1].strip()
-                
-                if not term_cn or not term_vi:
+            Glossary.objects.bulk_create(new_entries, ignore_conflicts=True)
+            Glossary.objects.bulk_update(
+                [entry for term_cn, entry in flagged.items() if term_cn in existing_terms],
+                ['note', 'needs_review']
+            )
+        
+        if flagged:
+            print(f"   ⚠️ {len(flagged)} terms có bản dịch xung đột, cần review")
+        return len(new_entries), len(flagged)
+    
+    def reconcile_conflicts(self, chunk_size: int = 200) -> int:
+        """
+        Gọi Gemini chọn bản dịch cuối cùng cho các terms đang bị đánh dấu xung đột
+        
+        Returns:
+            Số terms đã được reconcile
+        """
+        terms = list(self.novel.glossaries.filter(needs_review=True).order_by('term_cn'))
+        reconciled = 0
+        
+        for start in range(0, len(terms), chunk_size):
+            chunk = {term.term_cn: term for term in terms[start:start + chunk_size]}
+            lines = []
+            for term in chunk.values():
+                options = [term.term_vi] + self._conflict_options(term.note)
+                lines.append(f"{term.term_cn}: {' | '.join(options)}")
+            
+            prompt = f"""
+# 🧾 Nhiệm vụ
+Các thuật ngữ sau trong bảng thuật ngữ của truyện có nhiều bản dịch khác nhau.
+Với mỗi thuật ngữ, hãy chọn (hoặc sửa lại) **một** bản dịch tiếng Việt phù hợp và nhất quán nhất.
+
+{chr(10).join(lines)}
+
+# ⚠️ Định dạng đầu ra
+Chỉ xuất thuần văn bản, mỗi dòng một mục, theo dạng:
+原文 = Dịch
+"""
+            response = self.client.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=prompt,
+                config=types.GenerateContentConfig(temperature=0.2)
+            )
+            
+            resolved = []
+            for term_cn, term_vi in self.parse_glossary_text(response.text or ""):
+                term = chunk.get(term_cn)
+                if term is None:
                     continue
-                
-                # Tạo hoặc update
-                _, created = Glossary.objects.get_or_create(
-                    novel=self.novel,
-                    term_cn=term_cn,
-                    defaults={'term_vi': term_vi}
+                term.term_vi = term_vi
+                term.needs_review = False
+                term.note = "\n".join(
+                    line for line in (term.note or '').split('\n')
+                    if not line.startswith(self.CONFLICT_NOTE_PREFIX)
                 )
+                resolved.append(term)
+            
+            Glossary.objects.bulk_update(resolved, ['term_vi', 'needs_review', 'note'])
+            reconciled += len(resolved)
+        
+        return reconciled
+    
+    @classmethod
+    def _conflict_options(cls, note: str) -> List[str]:
+        return [
+            line[len(cls.CONFLICT_NOTE_PREFIX):].strip()
+            for line in (note or '').split('\n')
+            if line.startswith(cls.CONFLICT_NOTE_PREFIX)
+        ]
+    
+    def _start_run(self, start_chapter: int) -> GlossaryRun:
+        """Tạo GlossaryRun mới và lưu trước ranh giới của tất cả batches"""
+        with transaction.atomic():
+            run = GlossaryRun.objects.create(novel=self.novel, start_ordinal=start_chapter)
+            GlossaryBatch.objects.bulk_create(
+                (
+                    GlossaryBatch(
+                        run=run,
+                        index=i,
+                        start_ordinal=batch[0].ordinal,
+                        end_ordinal=batch[-1].ordinal,
+                        chapter_count=len(batch),
+                    )
+                    for i, batch in enumerate(self.batch_chapters(start_chapter), 1)
+                ),
+                batch_size=500
+            )
+        return run
+    
+    def _resumable_run(self):
+        """Lần chạy gần nhất bị gián đoạn (còn batch chưa xong), nếu có"""
+        run = GlossaryRun.latest_for(self.novel)
+        if run and run.status in ('running', 'failed'):
+            return run
+        return None
+    
+    def _load_batch_chapters(self, batch: GlossaryBatch) -> List[Chapter]:
+        """Chỉ load nội dung của batch đang xử lý"""
+        return list(self.novel.chapters.filter(
+            ordinal__gte=batch.start_ordinal,
+            ordinal__lte=batch.end_ordinal,
+            token_count__gt=0
+        ).only('id', 'ordinal', 'title', 'content_raw').order_by('ordinal'))
+    
+    def _mark_batch_running(self, batch: GlossaryBatch):
+        batch.status = 'running'
+        batch.started_at = timezone.now()
+        batch.error = ''
+        batch.save(update_fields=['status', 'started_at', 'error'])
+    
+    def _mark_batch_failed(self, batch: GlossaryBatch, error: Exception):
+        batch.status = 'failed'
+        batch.error = str(error)
+        batch.finished_at = timezone.now()
+        batch.duration_seconds = (batch.finished_at - batch.started_at).total_seconds()
+        batch.save(update_fields=['status', 'error', 'finished_at', 'duration_seconds'])
+    
+    def _mark_batch_done(self, batch: GlossaryBatch, new_terms: int, usage: Dict, elapsed: float):
+        batch.status = 'done'
+        batch.new_terms = new_terms
+        batch.prompt_tokens = usage['prompt_tokens']
+        batch.output_tokens = usage['output_tokens']
+        batch.finished_at = timezone.now()
+        batch.duration_seconds = elapsed
+        batch.save(update_fields=[
+            'status', 'new_terms', 'prompt_tokens', 'output_tokens',
+            'finished_at', 'duration_seconds',
+        ])
+    
+    def _timed_request(self, chapters: List[Chapter], existing_glossary: str) -> Tuple[str, Dict, float]:
+        started = time.monotonic()
+        glossary_text, usage = self._request_glossary(chapters, existing_glossary)
+        return glossary_text, usage, time.monotonic() - started
+    
+    def _threaded_request(self, chapters: List[Chapter], existing_glossary: str) -> Tuple[str, Dict, float]:
+        """_timed_request chạy trong worker thread: đóng DB connection của thread (mở khi ghi LLMCallLog...)"""
+        close_old_connections()
+        try:
+            return self._timed_request(chapters, existing_glossary)
+        finally:
+            close_old_connections()
+    
+    def _process_batch(self, batch: GlossaryBatch, existing_glossary: str) -> Tuple[int, int]:
+        """Xử lý một batch và ghi lại trạng thái, token, thời gian"""
+        self._mark_batch_running(batch)
+        
+        try:
+            chapters = self._load_batch_chapters(batch)
+            glossary_text, usage, elapsed = self._timed_request(chapters, existing_glossary)
+            new_terms, conflicts = self.merge_candidates(self.parse_glossary_text(glossary_text))
+        except Exception as e:
+            self._mark_batch_failed(batch, e)
+            raise
+        
+        self._mark_batch_done(batch, new_terms, usage, elapsed)
+        return new_terms, conflicts
+    
+    def _run_sequential(self, run: GlossaryRun, pending: List[GlossaryBatch]) -> Dict:
+        """Xử lý lần lượt, mỗi batch gửi kèm glossary đã cập nhật từ batch trước"""
+        total_batches = run.batches.count()
+        existing_glossary = self.get_existing_glossary()
+        stats = {'new_terms': 0, 'conflicts': 0, 'processed_chapters': 0, 'processed_batches': 0}
+        
+        for batch in pending:
+            print(f"\n▶ Batch {batch.index}/{total_batches}: {batch.chapter_count} chapters")
+            
+            new_terms, conflicts = self._process_batch(batch, existing_glossary)
+            
+            stats['new_terms'] += new_terms
+            stats['conflicts'] += conflicts
+            stats['processed_chapters'] += batch.chapter_count
+            stats['processed_batches'] += 1
+            print(f"   ✅ Thêm {new_terms} terms mới ({batch.prompt_tokens:,} tokens vào, {batch.duration_seconds:.1f}s)")
+            
+            # Cập nhật existing glossary
+            existing_glossary = self.get_existing_glossary()
+            print(f"   💾 Checkpoint saved: Chapter {batch.end_ordinal}")
+        
+        return stats
+    
+    def _run_parallel(self, run: GlossaryRun, pending: List[GlossaryBatch], max_workers: int) -> Dict:
+        """
+        Gửi nhiều batch cùng lúc (tối đa max_workers request)
+        
+        Các batch dùng chung glossary tại thời điểm bắt đầu. Kết quả được gộp theo thứ tự
+        batch (không phụ thuộc thứ tự hoàn thành) nên lần xuất hiện đầu tiên theo chapter
+        luôn thắng, và checkpoint chỉ tiến qua các batch đã được gộp liên tục.
+        Nếu có batch lỗi: dừng gửi thêm, các batch sau nó được trả về 'pending' để resume.
+        """
+        existing_glossary = self.get_existing_glossary()
+        self.client  # Khởi tạo client (có truy cập DB) ở main thread trước khi chạy song song
+        
+        stats = {'new_terms': 0, 'conflicts': 0, 'processed_chapters': 0, 'processed_batches': 0}
+        queue = list(pending)
+        in_flight = {}
+        results = {}
+        next_flush = 0
+        failure = None
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while in_flight or (queue and failure is None):
+                # Trạng thái batch/glossary chỉ ghi ở main thread; worker thread gọi API qua ResilientGeminiClient,
+                # client này cũng dùng DB (LLMCallLog, APIKey.mark_used, trạng thái breaker trong DB cache)
+                while queue and failure is None and len(in_flight) < max_workers:
+                    batch = queue.pop(0)
+                    self._mark_batch_running(batch)
+                    chapters = self._load_batch_chapters(batch)
+                    in_flight[executor.submit(self._threaded_request, chapters, existing_glossary)] = batch
+                
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    try:
+                        results[batch.index] = future.result()
+                    except Exception as e:
+                        print(f"   ❌ Batch {batch.index} lỗi: {e}")
+                        self._mark_batch_failed(batch, e)
+                        failure = failure or e
                 
-                if created:
-                    new_count += 1
+                # Gộp theo thứ tự batch
+                while next_flush < len(pending) and pending[next_flush].index in results:
+                    batch = pending[next_flush]
+                    glossary_text, usage, elapsed = results.pop(batch.index)
+                    new_terms, conflicts = self.merge_candidates(self.parse_glossary_text(glossary_text))
+                    self._mark_batch_done(batch, new_terms, usage, elapsed)
+                    
+                    stats['new_terms'] += new_terms
+                    stats['conflicts'] += conflicts
+                    stats['processed_chapters'] += batch.chapter_count
+                    stats['processed_batches'] += 1
+                    next_flush += 1
+                    print(f"   ✅ Batch {batch.index}: +{new_terms} terms ({elapsed:.1f}s) - checkpoint Chapter {batch.end_ordinal}")
         
-        return new_count
+        if failure is not None:
+            # Kết quả nằm sau batch lỗi chưa thể gộp đúng thứ tự, sẽ chạy lại khi resume
+            GlossaryBatch.objects.filter(
+                run=run, index__in=list(results)
+            ).update(status='pending', started_at=None)
+            raise failure
+        
+        return stats
     
-    def generate(self, start_from_checkpoint: bool = True) -> Dict:
+    def generate(
+        self,
+        start_from_checkpoint: bool = True,
+        parallel: bool = False,
+        max_workers: int = None,
+        reconcile: bool = False
+    ) -> Dict:
         """
         Chạy quy trình tạo glossary
         
         Args:
             start_from_checkpoint: Tiếp tục từ checkpoint hay bắt đầu từ đầu
+            parallel: Gửi nhiều batch song song thay vì lần lượt
+            max_workers: Số request song song tối đa (mặc định settings.GLOSSARY_PARALLEL_WORKERS)
+            reconcile: Chạy thêm bước chọn bản dịch cho các terms bị xung đột
         
         Returns:
             Dict với thông tin tổng kết
         """
-        # Lấy checkpoint
-        start_chapter = self.get_checkpoint() if start_from_checkpoint else 0
+        # Tiếp tục lần chạy bị gián đoạn với đúng ranh giới batch cũ, hoặc tạo lần chạy mới
+        run = self._resumable_run() if start_from_checkpoint else None
+        if run is None:
+            if not start_from_checkpoint:
+                self.reset_checkpoint()
+            start_chapter = self.get_checkpoint()
+            run = self._start_run(start_chapter)
+        else:
+            run.status = 'running'
+            run.save(update_fields=['status'])
         
         print(f"📚 Bắt đầu tạo glossary cho: {self.novel.title}")
-        print(f"📍 Checkpoint: Chapter {start_chapter}")
-        
-        # Lấy glossary hiện có
-        existing_glossary = self.get_existing_glossary()
+        print(f"📍 Checkpoint: Chapter {run.checkpoint} (run #{run.id})")
         print(f"📖 Glossary hiện có: {self.novel.glossaries.count()} terms")
         
-        # Chia batches
-        batches = self.batch_chapters(start_chapter)
-        print(f"📦 Tổng số batches: {len(batches)}")
+        pending = list(run.batches.exclude(status='done').order_by('index'))
+        print(f"📦 Tổng số batches: {run.batches.count()} (còn {len(pending)})")
         
-        total_new_terms = 0
-        processed_chapters = 0
+        try:
+            if parallel and len(pending) > 1:
+                max_workers = max_workers or getattr(settings, 'GLOSSARY_PARALLEL_WORKERS', 4)
+                print(f"⚡ Chế độ song song: {max_workers} request cùng lúc")
+                stats = self._run_parallel(run, pending, max_workers)
+            else:
+                stats = self._run_sequential(run, pending)
+        except Exception:
+            run.status = 'failed'
+            run.save(update_fields=['status'])
+            raise
         
-        for i, batch in enumerate(batches, 1):
-            print(f"\n▶ Batch {i}/{len(batches)}: {len(batch)} chapters")
-            
-            # Tính word count
-            word_count = sum(self.count_words(ch.content_raw or '') for ch in batch)
-            print(f"   📊 ~{word_count:,} từ")
-            
-            # Trích xuất glossary
-            glossary_text = self.extract_glossary_from_batch(batch, existing_glossary)
-            
-            # Parse và lưu
-            new_terms = self.parse_and_save_glossary(glossary_text)
-            total_new_terms += new_terms
-            
-            print(f"   ✅ Thêm {new_terms} terms mới")
-            
-            # Cập nhật existing glossary
-            existing_glossary = self.get_existing_glossary()
-            
-            # Lưu checkpoint (chapter cuối của batch)
-            last_chapter = batch[-1]
-            chapter_index = self._get_chapter_global_index(last_chapter)
-            self.save_checkpoint(chapter_index)
-            processed_chapters += len(batch)
-            
-            print(f"   💾 Checkpoint saved: Chapter {chapter_index}")
+        run.status = 'completed'
+        run.finished_at = timezone.now()
+        run.save(update_fields=['status', 'finished_at'])
+        
+        reconciled = self.reconcile_conflicts() if reconcile else 0
         
         summary = {
-            'total_batches': len(batches),
-            'processed_chapters': processed_chapters,
-            'new_terms': total_new_terms,
+            'run_id': run.id,
+            'total_batches': stats['processed_batches'],
+            'processed_chapters': stats['processed_chapters'],
+            'new_terms': stats['new_terms'],
+            'conflicts': stats['conflicts'],
+            'reconciled': reconciled,
             'total_terms': self.novel.glossaries.count(),
-            'checkpoint': self.get_checkpoint()
+            'checkpoint': run.checkpoint
         }
         
         print(f"\n🎉 Hoàn tất!")
         print(f"📊 Tổng kết:")
-        print(f"   - Đã xử lý: {processed_chapters} chapters")
-        print(f"   - Terms mới: {total_new_terms}")
+        print(f"   - Đã xử lý: {stats['processed_chapters']} chapters")
+        print(f"   - Terms mới: {stats['new_terms']}")
+        print(f"   - Xung đột: {stats['conflicts']} (đã reconcile: {reconciled})")
         print(f"   - Tổng terms: {summary['total_terms']}")
         
         return summary
     
-    def _get_chapter_global_index(self, chapter: Chapter) -> int:
-        """Lấy index global của chapter (qua tất cả volumes)"""
-        count = 0
-        for volume in self.novel.volumes.all().order_by('index'):
-            if volume.index < chapter.volume.index:
-                count += volume.chapters.count()
-            elif volume.index == chapter.volume.index:
-                count += chapter.index
-                break
-        return count
\ No newline at end of file
+    def generate_from_candidates(self, chunk_size: int = 150, **miner_options) -> Dict:
+        """
+        Tạo glossary từ thuật ngữ ứng viên được khai phá cục bộ (TermMiner)
+        Thay vì gửi toàn bộ nội dung chapters, chỉ gửi các ứng viên chưa có trong
+        glossary kèm một đoạn ngữ cảnh ngắn.
+        
+        Args:
+            chunk_size: Số ứng viên mỗi request
+            miner_options: Tham số cho TermMiner (min_freq, min_entropy, max_candidates...)
+        
+        Returns:
+            Dict với thông tin tổng kết
+        """
+        from .term_miner import TermMiner  # Cần numpy
+        
+        text = "\n".join(
+            self.novel.chapters.filter(content_raw__isnull=False)
+            .order_by('ordinal')
+            .values_list('content_raw', flat=True)
+            .iterator()
+        )
+        
+        miner = TermMiner(**miner_options)
+        started = time.monotonic()
+        candidates = miner.exclude_known(
+            miner.mine(text),
+            self.novel.glossaries.values_list('term_cn', flat=True)
+        )
+        print(f"🔎 {len(candidates)} ứng viên mới từ {len(text):,} ký tự ({time.monotonic() - started:.1f}s)")
+        
+        total_new_terms = 0
+        total_conflicts = 0
+        prompt_chars = 0
+        usage_total = {'prompt_tokens': 0, 'output_tokens': 0}
+        
+        for start in range(0, len(candidates), chunk_size):
+            chunk = candidates[start:start + chunk_size]
+            lines = "\n".join(
+                f"{c.term} | {miner.context(text, c)}"
+                for c in chunk
+            )
+            
+            prompt = f"""
+# 🧙 Vai trò
+Bạn là **công cụ hỗ trợ dịch thuật chuyên cho truyện tiểu thuyết**.
+
+# 🧾 Nhiệm vụ
+Dưới đây là các cụm từ ứng viên được trích tự động từ truyện, mỗi dòng gồm `cụm từ | ngữ cảnh`.
+Hãy giữ lại những cụm là **tên riêng nhân vật, địa danh, danh hiệu, xưng hô, kỹ năng/chiêu thức, thuật ngữ đặc biệt**
+và dịch sang tiếng Việt. **Bỏ qua** từ phổ thông và các cụm bị cắt dở không có nghĩa.
+
+- Tên riêng ngoại lai (phiên âm Trung, ví dụ: 卡洛斯) → chuyển về dạng La-tinh gốc: `卡洛斯 = Carlos`
+- Thuật ngữ, danh hiệu, địa danh → dịch sang tiếng Việt tự nhiên
+
+---
+{lines}
+---
+
+# ⚠️ Định dạng đầu ra
+Chỉ xuất thuần văn bản, mỗi dòng một mục, theo dạng:
+原文 = Dịch
+"""
+            prompt_chars += len(prompt)
+            response = self.client.models.generate_content(
+                model="gemini-2.5-pro",
+                contents=prompt,
+                config=types.GenerateContentConfig(temperature=0.3)
+            )
+            usage = extract_usage(response)
+            usage_total['prompt_tokens'] += usage['prompt_tokens']
+            usage_total['output_tokens'] += usage['output_tokens']
+            
+            new_terms, conflicts = self.merge_candidates(self.parse_glossary_text(response.text or ""))
+            total_new_terms += new_terms
+            total_conflicts += conflicts
+            print(f"   ✅ Ứng viên {start + 1}-{start + len(chunk)}: +{new_terms} terms")
+        
+        summary = {
+            'candidates': len(candidates),
+            'source_chars': len(text),
+            'prompt_chars': prompt_chars,
+            'prompt_tokens': usage_total['prompt_tokens'],
+            'output_tokens': usage_total['output_tokens'],
+            'new_terms': total_new_terms,
+            'conflicts': total_conflicts,
+            'total_terms': self.novel.glossaries.count(),
+        }
+        
+        print(f"\n🎉 Hoàn tất! Prompt {prompt_chars:,} ký tự so với {len(text):,} ký tự nội dung gốc")
+        return summary
@@ -0,0 +1,65 @@
+"""
+Chạy tác vụ dài (quét toàn novel, chuẩn bị dữ liệu...) ở background thread
+Trạng thái được lưu trong Django cache để view khác (hoặc process khác) đọc được
+"""
+import threading
+import traceback
+import uuid
+from typing import Callable, Dict, Optional
+
+from django.core.cache import cache
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+JOB_CACHE_PREFIX = 'job:'
+JOB_TTL = 60 * 60 * 24  # Giữ trạng thái job 1 ngày
+
+
+def _cache_key(job_id: str) -> str:
+    return f'{JOB_CACHE_PREFIX}{job_id}'
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    """Trạng thái job: kind, status (queued/running/completed/failed), progress, result, error"""
+    return cache.get(_cache_key(job_id))
+
+
+def update_job(job_id: str, **fields) -> Dict:
+    job = get_job(job_id) or {'id': job_id}
+    job.update(fields)
+    job['updated_at'] = timezone.now().isoformat()
+    cache.set(_cache_key(job_id), job, JOB_TTL)
+    return job
+
+
+def start_job(kind: str, func: Callable, *args, **kwargs) -> str:
+    """
+    Chạy func(*args, progress=..., **kwargs) ở background thread
+
+    func nhận callback progress(**fields) để cập nhật tiến độ, giá trị trả về (dict) được lưu vào 'result'
+
+    Returns:
+        job_id
+    """
+    job_id = uuid.uuid4().hex
+    update_job(job_id, kind=kind, status='queued', progress={}, result=None, error='')
+
+    def progress(**fields):
+        update_job(job_id, progress=fields)
+
+    def run():
+        close_old_connections()
+        update_job(job_id, status='running', started_at=timezone.now().isoformat())
+        try:
+            result = func(*args, progress=progress, **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            update_job(job_id, status='failed', error=str(e))
+        else:
+            update_job(job_id, status='completed', result=result)
+        finally:
+            # Thread riêng có connection riêng, đóng lại khi xong
+            connections.close_all()
+
+    threading.Thread(target=run, name=f'job-{kind}-{job_id[:8]}', daemon=True).start()
+    return job_id
@@ -0,0 +1,234 @@
+"""
+Các provider LLM dùng chung một interface: Gemini, OpenAI-compatible (OpenAI, DeepSeek, vLLM...), Anthropic
+Prompt dùng chung (gemini_client.build_*_prompt), mỗi provider chỉ lo gọi API và đọc usage
+Phần đầu prompt cố định (prefix) được gửi riêng để provider cache lại (xem context_cache)
+API key lấy từ bảng APIKey theo provider, retry/failover key qua resilience.call_with_retries
+"""
+from typing import Dict, Optional, Tuple
+
+import requests
+from django.conf import settings
+
+from .context_cache import generate_with_gemini_cache, should_cache
+from .llm_tracing import traced_call
+from .resilience import APIKeyPool, call_with_retries
+
+
+class _KeyPool(APIKeyPool):
+    """APIKeyPool tạo client bằng hàm của provider"""
+
+    def __init__(self, provider: str, make_client):
+        super().__init__(provider)
+        self._factory = make_client
+
+    def _make_client(self, api_key: str):
+        return self._factory(api_key)
+
+
+class LLMProvider:
+    """
+    Interface chung: complete(prompt, task, prefix=...) -> (text, usage), prompt đầy đủ = prefix + prompt
+
+    Config (settings.LLM_PROVIDERS[name]):
+        models: Model theo task ('translate', 'review'...), 'default' cho task khác
+        timeout: Giây chờ tối đa mỗi request
+    """
+
+    name = ''
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.keys = self._make_pool()
+
+    def _make_pool(self) -> APIKeyPool:
+        return _KeyPool(self.name, self._make_client)
+
+    def _make_client(self, api_key: str):
+        raise NotImplementedError
+
+    def _complete(self, client, prompt: str, model: str, temperature: float,
+                  prefix: str = "", key_id=None) -> Tuple[str, Dict]:
+        """Gọi API một lần, trả về (text, {'prompt_tokens', 'output_tokens', 'cached_tokens'})"""
+        raise NotImplementedError
+
+    def model_for(self, task: str) -> str:
+        models = self.config.get('models', {})
+        return models.get(task) or models.get('default') or next(iter(models.values()))
+
+    def available(self) -> bool:
+        """Có key active và chưa bị khóa hết"""
+        return self.keys.available()
+
+    def complete(
+        self,
+        prompt: str,
+        task: str,
+        temperature: float = 0.3,
+        max_wait: Optional[float] = None,
+        prefix: str = ""
+    ) -> Tuple[str, Dict]:
+        """
+        Gọi model của task, tự retry/đổi key
+
+        Args:
+            max_wait: Thời gian chờ tối đa khi mọi key đều bị khóa (mặc định LLM_BACKOFF_MAX)
+            prefix: Phần đầu prompt giống nhau giữa các request (được cache nếu provider hỗ trợ)
+        """
+        model = self.model_for(task)
+        with traced_call(task, self.name, model, prefix + prompt) as call:
+            text, usage = call_with_retries(
+                self.keys,
+                lambda client, key_id: self._complete(client, prompt, model, temperature, prefix, key_id),
+                max_wait=max_wait,
+                pass_key_id=True
+            )
+            call.usage, call.response_text = usage, text
+        return text, usage
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini - dùng chung GeminiClientManager (rotation key mỗi giờ) với gemini_client"""
+
+    name = 'gemini'
+
+    def _make_pool(self) -> APIKeyPool:
+        from .gemini_client import get_gemini_manager
+        try:
+            return get_gemini_manager()
+        except ValueError:
+            # Chưa có key nào
+            return _KeyPool(self.name, self._make_client)
+
+    def _make_client(self, api_key: str):
+        from google import genai
+        return genai.Client(api_key=api_key)
+
+    def _complete(self, client, prompt, model, temperature, prefix="", key_id=None):
+        from google.genai import types
+        from .gemini_client import _safety_settings, extract_usage
+
+        def generate(cached_content=None):
+            return client.models.generate_content(
+                model=model,
+                contents=prompt if cached_content else prefix + prompt,
+                config=types.GenerateContentConfig(
+                    temperature=temperature,
+                    safety_settings=_safety_settings(),
+                    cached_content=cached_content
+                )
+            )
+
+        response = generate_with_gemini_cache(client, key_id, model, prefix, generate)
+        return response.text or "", extract_usage(response)
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """
+    OpenAI Chat Completions API - cũng dùng được cho các server tương thích (DeepSeek, vLLM, Ollama...)
+    Config thêm: base_url (None = api.openai.com)
+    """
+
+    name = 'openai'
+
+    def _make_client(self, api_key: str):
+        try:
+            from openai import OpenAI
+        except ImportError:
+            raise ImportError("Provider 'openai' cần package openai: pip install openai")
+        # Retry do call_with_retries đảm nhiệm
+        return OpenAI(
+            api_key=api_key,
+            base_url=self.config.get('base_url'),
+            timeout=self.config.get('timeout', 600),
+            max_retries=0
+        )
+
+    def _complete(self, client, prompt, model, temperature, prefix="", key_id=None):
+        # OpenAI tự cache phần đầu prompt giống nhau (>= 1024 token), chỉ cần prefix đứng đầu
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{'role': 'user', 'content': prefix + prompt}],
+            temperature=temperature
+        )
+        usage = response.usage
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return response.choices[0].message.content or "", {
+            'prompt_tokens': getattr(usage, 'prompt_tokens', None) or 0,
+            'output_tokens': getattr(usage, 'completion_tokens', None) or 0,
+            'cached_tokens': getattr(details, 'cached_tokens', None) or 0,
+        }
+
+
+class AnthropicProvider(LLMProvider):
+    """
+    Anthropic Messages API (gọi thẳng bằng requests, không cần SDK)
+    Config thêm: max_tokens (bắt buộc với Messages API), base_url (None = https://api.anthropic.com)
+    """
+
+    name = 'anthropic'
+    API_BASE = 'https://api.anthropic.com'
+    API_VERSION = '2023-06-01'
+
+    def _make_client(self, api_key: str):
+        return api_key
+
+    def _complete(self, client, prompt, model, temperature, prefix="", key_id=None):
+        content = [{'type': 'text', 'text': prompt}]
+        if should_cache(prefix):
+            # Cache prefix phía Anthropic (TTL 5 phút, gia hạn mỗi lần dùng)
+            content.insert(0, {'type': 'text', 'text': prefix, 'cache_control': {'type': 'ephemeral'}})
+        elif prefix:
+            content = [{'type': 'text', 'text': prefix + prompt}]
+        response = requests.post(
+            f"{(self.config.get('base_url') or self.API_BASE).rstrip('/')}/v1/messages",
+            headers={
+                'x-api-key': client,
+                'anthropic-version': self.API_VERSION,
+                'content-type': 'application/json',
+            },
+            json={
+                'model': model,
+                'max_tokens': self.config.get('max_tokens', 16384),
+                'temperature': temperature,
+                'messages': [{'role': 'user', 'content': content}],
+            },
+            timeout=self.config.get('timeout', 600)
+        )
+        # HTTPError giữ response -> resilience đọc được status code và Retry-After
+        response.raise_for_status()
+        data = response.json()
+        usage = data.get('usage') or {}
+        text = "".join(block.get('text', '') for block in data.get('content', []) if block.get('type') == 'text')
+        # input_tokens không gồm phần đọc/ghi cache
+        cached_tokens = usage.get('cache_read_input_tokens') or 0
+        return text, {
+            'prompt_tokens': (usage.get('input_tokens') or 0) + cached_tokens
+                             + (usage.get('cache_creation_input_tokens') or 0),
+            'output_tokens': usage.get('output_tokens', 0),
+            'cached_tokens': cached_tokens,
+        }
+
+
+PROVIDER_CLASSES = {
+    'gemini': GeminiProvider,
+    'openai': OpenAICompatibleProvider,
+    'anthropic': AnthropicProvider,
+}
+
+_providers = None
+
+
+def get_providers() -> Dict[str, LLMProvider]:
+    """
+    Các provider trong settings.LLM_PROVIDERS có API key active (theo thứ tự khai báo)
+    Key được load một lần mỗi process (như GeminiClientManager)
+    """
+    global _providers
+    if _providers is None:
+        providers = {}
+        for name, config in getattr(settings, 'LLM_PROVIDERS', {}).items():
+            provider = PROVIDER_CLASSES[name](config)
+            if provider.keys.api_keys:
+                providers[name] = provider
+        _providers = providers
+    return _providers
@@ -0,0 +1,163 @@
+"""
+Chọn provider LLM cho từng task theo độ trễ, tỉ lệ lỗi và chi phí đo được
+Thống kê (EWMA) lưu trong Django cache để mọi worker dùng chung; provider bị rate limit
+có tỉ lệ lỗi tăng và hết key khỏe nên lưu lượng tự chuyển sang provider khác
+"""
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .llm_providers import LLMProvider, get_providers
+from .tokens import estimate_tokens
+
+
+def model_price(model: str) -> Tuple[float, float]:
+    """Giá (USD / 1 triệu token input, output) của model - model không có trong LLM_PRICES coi như miễn phí (tự host)"""
+    return tuple(getattr(settings, 'LLM_PRICES', {}).get(model, (0.0, 0.0))[:2])
+
+
+def cached_input_price(model: str) -> float:
+    """Giá (USD / 1 triệu token) input đọc từ context cache: phần tử thứ 3 trong LLM_PRICES nếu có"""
+    prices = getattr(settings, 'LLM_PRICES', {}).get(model, (0.0, 0.0))
+    if len(prices) > 2:
+        return prices[2]
+    return prices[0] * getattr(settings, 'LLM_CACHED_INPUT_RATIO', 0.25)
+
+
+def usage_cost(model: str, usage: Dict) -> float:
+    """Chi phí (USD) của một request theo usage (prompt_tokens, output_tokens, cached_tokens)"""
+    price_in, price_out = model_price(model)
+    cached = min(usage.get('cached_tokens') or 0, usage.get('prompt_tokens') or 0)
+    return (
+        ((usage.get('prompt_tokens') or 0) - cached) * price_in
+        + cached * cached_input_price(model)
+        + (usage.get('output_tokens') or 0) * price_out
+    ) / 1_000_000
+
+
+class LLMRouter:
+    """
+    Xếp hạng các provider cho một task, gọi provider tốt nhất và chuyển sang provider tiếp theo khi lỗi
+
+    Điểm của provider (thấp hơn tốt hơn) = tổng có trọng số LLM_ROUTER_WEIGHTS của:
+    - latency: giây / 1000 token output (EWMA), chia cho giá trị lớn nhất giữa các provider
+    - errors: tỉ lệ lỗi (EWMA, 0-1)
+    - cost: chi phí ước tính của request, chia cho giá trị lớn nhất giữa các provider
+    Provider chưa có số liệu được coi là nhanh nhất để được thử; LLM_ROUTER_EXPLORE là tỉ lệ
+    request đưa provider ngẫu nhiên lên đầu để số liệu của các provider khác không bị cũ
+    """
+
+    CACHE_PREFIX = 'llm_router:'
+
+    def __init__(self, providers: Optional[Dict[str, LLMProvider]] = None):
+        self.providers = providers if providers is not None else get_providers()
+
+    def _cache_key(self, provider: str, task: str) -> str:
+        return f'{self.CACHE_PREFIX}{provider}:{task}'
+
+    def stats(self, provider: str, task: str) -> Dict:
+        return cache.get(self._cache_key(provider, task)) or {'latency': None, 'errors': 0.0, 'calls': 0}
+
+    def record(self, provider: str, task: str, ok: bool, elapsed: float = 0.0, output_tokens: int = 0):
+        """Cập nhật EWMA độ trễ (chỉ request thành công) và tỉ lệ lỗi"""
+        alpha = getattr(settings, 'LLM_ROUTER_EWMA_ALPHA', 0.2)
+        stats = self.stats(provider, task)
+        stats['calls'] += 1
+        stats['errors'] = (1 - alpha) * stats['errors'] + alpha * (0.0 if ok else 1.0)
+        if ok:
+            latency = elapsed / max(output_tokens / 1000, 0.1)
+            stats['latency'] = latency if stats['latency'] is None else (1 - alpha) * stats['latency'] + alpha * latency
+        cache.set(self._cache_key(provider, task), stats, timeout=None)
+
+    def estimated_cost(self, provider: LLMProvider, task: str, prompt_tokens: int, output_tokens: int) -> float:
+        price_in, price_out = model_price(provider.model_for(task))
+        return (prompt_tokens * price_in + output_tokens * price_out) / 1_000_000
+
+    def rank(self, task: str, prompt_tokens: int = 0, output_tokens: int = 0) -> List[LLMProvider]:
+        """Các provider theo thứ tự nên thử (provider hết key khỏe xếp cuối)"""
+        if not self.providers:
+            raise ValueError("⚠️ Không có provider LLM nào có API key active trong database!")
+
+        candidates = [provider for provider in self.providers.values() if provider.available()]
+        exhausted = [provider for provider in self.providers.values() if provider not in candidates]
+        if len(candidates) <= 1:
+            return candidates + exhausted
+
+        weights = getattr(settings, 'LLM_ROUTER_WEIGHTS', {'latency': 1.0, 'errors': 2.0, 'cost': 1.0})
+        stats = {provider.name: self.stats(provider.name, task) for provider in candidates}
+        costs = {
+            provider.name: self.estimated_cost(provider, task, prompt_tokens, output_tokens)
+            for provider in candidates
+        }
+        max_latency = max((s['latency'] or 0.0 for s in stats.values()), default=0.0) or 1.0
+        max_cost = max(costs.values()) or 1.0
+
+        def score(provider):
+            s = stats[provider.name]
+            return (
+                weights.get('latency', 0) * (s['latency'] or 0.0) / max_latency
+                + weights.get('errors', 0) * s['errors']
+                + weights.get('cost', 0) * costs[provider.name] / max_cost
+            )
+
+        # sorted giữ thứ tự khai báo trong LLM_PROVIDERS khi bằng điểm
+        ranked = sorted(candidates, key=score)
+        if random.random() < getattr(settings, 'LLM_ROUTER_EXPLORE', 0.05):
+            ranked.insert(0, ranked.pop(random.randrange(len(ranked))))
+        return ranked + exhausted
+
+    def complete(
+        self,
+        task: str,
+        prompt: str,
+        temperature: float = 0.3,
+        output_ratio: float = 1.0,
+        prefix: str = ""
+    ) -> Tuple[str, Dict]:
+        """
+        Gọi provider tốt nhất cho task, lỗi thì chuyển sang provider tiếp theo
+
+        Args:
+            output_ratio: Token output ước tính / token prompt (để ước tính chi phí)
+            prefix: Phần đầu prompt cố định, được cache nếu provider hỗ trợ (prompt đầy đủ = prefix + prompt)
+
+        Returns:
+            Tuple (text, usage) - usage có thêm 'provider' và 'model'
+        """
+        prompt_tokens = estimate_tokens(prefix + prompt)
+        ranked = self.rank(task, prompt_tokens, int(prompt_tokens * output_ratio))
+
+        last_error = None
+        for position, provider in enumerate(ranked):
+            is_last = position == len(ranked) - 1
+            started = time.monotonic()
+            try:
+                # Còn provider khác thì không chờ key bị khóa mở lại, chuyển provider ngay
+                text, usage = provider.complete(
+                    prompt, task, temperature, max_wait=None if is_last else 0, prefix=prefix
+                )
+            except Exception as e:
+                self.record(provider.name, task, ok=False)
+                last_error = e
+                if not is_last:
+                    print(f"🔀 {provider.name} lỗi ({e}), chuyển sang {ranked[position + 1].name}")
+                continue
+            self.record(provider.name, task, ok=True, elapsed=time.monotonic() - started,
+                        output_tokens=usage.get('output_tokens') or estimate_tokens(text))
+            return text, {**usage, 'provider': provider.name, 'model': provider.model_for(task)}
+
+        raise last_error
+
+
+_router = None
+
+
+def get_router() -> LLMRouter:
+    """Router dùng chung cho process (provider được load một lần)"""
+    global _router
+    if _router is None:
+        _router = LLMRouter()
+    return _router
@@ -0,0 +1,144 @@
+"""
+Ghi lại từng lần gọi LLM vào bảng LLMCallLog (LLM_TRACE) và logger 'core.llm_calls' (JSON mỗi dòng, xem LOGGING):
+thao tác, novel/chapter/segment, provider, model, key, token prompt/output theo usage metadata, chi phí, độ trễ,
+số lần thử lại, kết quả - bảng này là sổ cái để tính chi phí theo segment/chapter/novel/key (xem usage_stats)
+- Novel/chapter/segment và operation được gắn bằng trace_context(...) quanh code gọi LLM
+- Key và số lần thử lại do resilience.call_with_retries ghi vào lần gọi đang được trace (current_call)
+- Nội dung prompt/response chỉ lưu cho một phần request (LLM_TRACE_SAMPLE_RATE) và các request lỗi
+"""
+import contextvars
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger('core.llm_calls')
+
+_context = contextvars.ContextVar('llm_trace_context', default={})
+_current = contextvars.ContextVar('llm_trace_call', default=None)
+
+TRACE_FIELDS = ('operation', 'novel_id', 'chapter_id', 'segment_id')
+
+
+@contextmanager
+def trace_context(**fields):
+    """
+    Gắn thông tin cho các lần gọi LLM bên trong (ghi đè giá trị mặc định ở chỗ gọi)
+
+    Args:
+        fields: operation, novel_id, chapter_id, segment_id (None = giữ giá trị bên ngoài)
+    """
+    token = _context.set({**_context.get(), **{key: value for key, value in fields.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def segment_trace(segment) -> Dict:
+    """Tham số trace_context cho một segment"""
+    return {'novel_id': segment.chapter.novel_id, 'chapter_id': segment.chapter_id, 'segment_id': segment.id}
+
+
+def current_call() -> Optional['LLMCall']:
+    """Lần gọi LLM đang được trace trong context hiện tại (None nếu không có)"""
+    return _current.get()
+
+
+def _sample(text: str) -> str:
+    limit = getattr(settings, 'LLM_TRACE_SAMPLE_CHARS', 2000)
+    text = str(text or '')
+    return text if len(text) <= limit else f"{text[:limit]}... (+{len(text) - limit} ký tự)"
+
+
+class LLMCall:
+    """Một lần gọi LLM đang chạy; chỗ gọi gán usage/response_text rồi finish()"""
+
+    def __init__(self, operation: str, provider: str, model: str = '', prompt: str = '', **fields):
+        self.fields = {'operation': operation, **fields, **_context.get()}
+        self.provider = provider
+        self.model = model or ''
+        self.prompt = prompt
+        self.key_id = None
+        self.retries = 0
+        self.usage: Dict = {}
+        self.cost: Optional[float] = None  # None = tính theo usage và LLM_PRICES khi finish
+        self.response_text = ''
+        self.started = time.monotonic()
+        self.finished = False
+
+    def finish(self, error: Optional[BaseException] = None, outcome: Optional[str] = None):
+        """Ghi log (một lần), lỗi khi ghi log không làm hỏng request"""
+        if self.finished:
+            return
+        self.finished = True
+        outcome = outcome or ('error' if error else 'ok')
+        if self.cost is None:
+            from .llm_router import usage_cost
+            self.cost = usage_cost(self.model, self.usage)
+        sampled = outcome != 'ok' or random.random() < getattr(settings, 'LLM_TRACE_SAMPLE_RATE', 0.02)
+        record = {
+            **{field: self.fields.get(field) for field in TRACE_FIELDS},
+            'provider': self.provider,
+            'model': self.model,
+            # Key 0 = LLM giả lập, không có trong bảng APIKey
+            'api_key_id': self.key_id or None,
+            'prompt_tokens': self.usage.get('prompt_tokens') or 0,
+            'output_tokens': self.usage.get('output_tokens') or 0,
+            'cached_tokens': self.usage.get('cached_tokens') or 0,
+            'cost': round(self.cost, 6),
+            'latency': round(time.monotonic() - self.started, 3),
+            'retries': self.retries,
+            'outcome': outcome,
+            'error': str(error)[:1000] if error else '',
+        }
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+        if not getattr(settings, 'LLM_TRACE', True):
+            return
+        from ..models import LLMCallLog
+        try:
+            LLMCallLog.objects.create(
+                **record,
+                prompt_sample=_sample(self.prompt) if sampled else '',
+                response_sample=_sample(self.response_text) if sampled else '',
+            )
+        except Exception as e:
+            print(f"⚠️ Không ghi được LLMCallLog: {e}")
+
+
+@contextmanager
+def traced_call(
+    operation: str,
+    provider: str,
+    model: str = '',
+    prompt: str = '',
+    defer_finish: bool = False,
+    **fields
+) -> Iterator[LLMCall]:
+    """
+    Trace một lần gọi LLM (gồm cả các lần thử lại bên trong)
+
+    Args:
+        defer_finish: Không ghi log khi ra khỏi block nếu thành công (VD stream: chỗ gọi tự finish() khi đọc hết)
+
+    Usage:
+        with traced_call('review', 'gemini', model, prompt) as call:
+            response = ...
+            call.usage, call.response_text = extract_usage(response), response.text
+    """
+    call = LLMCall(operation, provider, model, prompt, **fields)
+    token = _current.set(call)
+    try:
+        yield call
+    except Exception as e:
+        call.finish(error=e)
+        raise
+    finally:
+        _current.reset(token)
+    if not defer_finish:
+        call.finish()
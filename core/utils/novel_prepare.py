@@ -0,0 +1,108 @@
+"""
+Chia segments cho toàn bộ chapters của một novel
+Việc chia (CPU-bound) chạy song song bằng process pool, process chính là writer duy nhất ghi bằng bulk_create
+"""
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.db import transaction
+from ..models import Novel, Chapter, Segment
+from .parallel import imap_chunks
+from .segment_processor import SegmentProcessor
+
+
+def split_chapters(rows: List[Tuple[int, str, Optional[int]]], max_tokens: int) -> List[Tuple[int, List[str]]]:
+    """
+    Chia một đợt (id, content_raw, token_count) thành segments - hàm top-level để chạy được trong ProcessPoolExecutor
+
+    Returns:
+        List (chapter_id, nội dung các segments)
+    """
+    return [
+        (chapter_id, list(SegmentProcessor.iter_segments(content, max_tokens, token_count)))
+        for chapter_id, content, token_count in rows
+    ]
+
+
+def _read_chunks(chapter_ids: List[int], chunk_size: int) -> Iterator[List[Tuple[int, str, Optional[int]]]]:
+    """Đọc nội dung chapters theo từng đợt id (danh sách id được lấy trước nên việc ghi segments không ảnh hưởng)"""
+    for i in range(0, len(chapter_ids), chunk_size):
+        yield list(
+            Chapter.objects.filter(pk__in=chapter_ids[i:i + chunk_size]).order_by('ordinal').values_list(
+                'id', 'content_raw', 'token_count'
+            )
+        )
+
+
+def _save_segments(results: List[Tuple[int, List[str]]], replace: bool) -> int:
+    """
+    Ghi segments của một đợt chapters trong một transaction
+    replace: xóa segments cũ; chapter có segments bị thay mất bản dịch nên được đưa về trạng thái chưa dịch
+    """
+    segments = [
+        Segment(chapter_id=chapter_id, index=index, content_raw=content)
+        for chapter_id, contents in results
+        for index, content in enumerate(contents, start=1)
+    ]
+    with transaction.atomic():
+        if replace:
+            old_segments = Segment.objects.filter(chapter_id__in=[chapter_id for chapter_id, _contents in results])
+            replaced = list(old_segments.values_list('chapter_id', flat=True).distinct())
+            old_segments.delete()
+            Chapter.objects.filter(pk__in=replaced).update(
+                status='imported', translation=None, foreign_char_warning=None
+            )
+        Segment.objects.bulk_create(segments, batch_size=500)
+    return len(segments)
+
+
+def prepare_novel(
+    novel: Novel,
+    force: bool = False,
+    max_tokens: Optional[int] = None,
+    chunk_size: int = 200,
+    workers: Optional[int] = None,
+    progress: Optional[Callable] = None,
+) -> Dict:
+    """
+    Chia segments cho các chapters chưa có segments
+    force=True: chia lại tất cả, bản dịch segments cũ bị xóa và các chapter đó trở về trạng thái chưa dịch
+    (xóa cả bản dịch đã chốt)
+
+    Args:
+        max_tokens: Token tối đa mỗi segment (mặc định theo TRANSLATION_MODEL, xem SegmentProcessor.segment_budget)
+        chunk_size: Số chapters mỗi đợt gửi cho process pool
+        workers: Số process (mặc định os.cpu_count(); 1 = chạy tuần tự, không tạo process)
+        progress: Callback progress(prepared=..., total=..., segments=...) để báo tiến độ (dùng bởi background job)
+
+    Returns:
+        Dict tổng kết
+    """
+    if max_tokens is None:
+        # Phần prompt cố định của cả novel (glossary, phong cách); các chương trước thay đổi theo chapter
+        from .gemini_client import translation_prompt_overhead
+        glossary_context = "\n".join(
+            f"{term_cn} → {term_vi}" for term_cn, term_vi in novel.glossaries.values_list('term_cn', 'term_vi')
+        )
+        overhead = translation_prompt_overhead(glossary_context, "", novel.translation_style or "")
+        max_tokens = SegmentProcessor.segment_budget(overhead_tokens=overhead)
+
+    chapters = novel.chapters.exclude(content_raw__isnull=True).exclude(content_raw='')
+    if not force:
+        chapters = chapters.filter(segments__isnull=True)
+    chapter_ids = list(chapters.order_by('ordinal').values_list('id', flat=True))
+
+    total = len(chapter_ids)
+    prepared = 0
+    segment_count = 0
+
+    for results in imap_chunks(split_chapters, _read_chunks(chapter_ids, chunk_size), max_tokens, workers=workers):
+        segment_count += _save_segments(results, replace=force)
+        prepared += len(results)
+        if progress:
+            progress(prepared=prepared, total=total, segments=segment_count)
+
+    return {
+        'prepared_chapters': prepared,
+        'created_segments': segment_count,
+        'max_tokens': max_tokens,
+    }
@@ -0,0 +1,39 @@
+"""
+Chạy hàm CPU-bound trên từng đợt dữ liệu bằng process pool (dùng cho các tác vụ trên toàn novel/DB)
+Process chính đọc dữ liệu và ghi kết quả, process con chỉ tính toán
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
+
+import django
+
+
+def imap_chunks(func: Callable, chunks: Iterable, *args, workers: Optional[int] = None) -> Iterator:
+    """
+    Gọi func(chunk, *args) cho từng đợt, trả kết quả theo đúng thứ tự các đợt
+
+    Args:
+        func: Hàm top-level (pickle được) để chạy trong process con
+        workers: Số process (mặc định os.cpu_count(); 1 = chạy tuần tự, không tạo process)
+    """
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        for chunk in chunks:
+            yield func(chunk, *args)
+        return
+
+    # spawn: process con không kế thừa trạng thái thread/connection của process cha,
+    # django.setup() để func import được models
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=django.setup) as executor:
+        # Giữ tối đa 2 đợt/worker đang chờ để bộ nhớ không tăng theo kích thước DB
+        pending = []
+        for chunk in chunks:
+            pending.append(executor.submit(func, chunk, *args))
+            if len(pending) >= workers * 2:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
@@ -0,0 +1,249 @@
+"""
+Hậu xử lý bản dịch:
+1. Thay thuật ngữ tiếng Trung còn sót bằng bản dịch trong Glossary (cục bộ, không gọi AI)
+2. Sửa các câu vẫn còn ký tự ngoại ngữ: chỉ các câu lỗi (kèm câu gốc tương ứng) được gửi cho AI,
+   kết quả được ghép lại vào đúng vị trí
+"""
+import bisect
+import re
+from typing import Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from .foreign_char_detector import ForeignCharDetector
+
+# Kết thúc câu: dấu câu (kèm dấu đóng ngoặc/nháy) hoặc xuống dòng
+SENTENCE_END_PATTERN = re.compile(r'[。！？!?.…]+[”"’」』）)]*|\n')
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """Vị trí (start, end) của từng câu, đã bỏ khoảng trắng hai đầu"""
+    spans = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        spans.append((start, match.end()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+
+    result = []
+    for start, end in spans:
+        chunk = text[start:end]
+        stripped = chunk.strip()
+        if stripped:
+            offset = start + len(chunk) - len(chunk.lstrip())
+            result.append((offset, offset + len(stripped)))
+    return result
+
+
+def foreign_char_count(text: str) -> int:
+    return sum(end - start for start, end, _lang in ForeignCharDetector.scan(text))
+
+
+class GlossarySubstituter:
+    """
+    Thay term_cn còn sót trong bản dịch bằng term_vi, ưu tiên term dài nhất
+    Chỉ quét trong các đoạn chữ Hán mà detector tìm thấy, không quét cả bản dịch
+    """
+
+    def __init__(self, terms: Iterable[Tuple[str, str]]):
+        self.mapping = {}
+        for term_cn, term_vi in terms:
+            term_cn, term_vi = (term_cn or '').strip(), (term_vi or '').strip()
+            if term_cn and term_vi and term_cn not in self.mapping:
+                self.mapping[term_cn] = term_vi
+        # Alternation của re thử lần lượt từ trái sang phải -> sắp xếp term dài trước để khớp dài nhất
+        self.pattern = re.compile('|'.join(
+            re.escape(term) for term in sorted(self.mapping, key=len, reverse=True)
+        )) if self.mapping else None
+
+    @staticmethod
+    def _is_word_char(char: str) -> bool:
+        return char.isalnum() and not ForeignCharDetector.FOREIGN_RUN_REGEX.match(char)
+
+    def _replacement(self, term: str, previous: str, following: str) -> str:
+        """term_vi, thêm khoảng trắng nếu dính liền với chữ tiếng Việt/Latin (kể cả term vừa thay)"""
+        value = self.mapping[term]
+        if previous and self._is_word_char(previous):
+            value = ' ' + value
+        if following and self._is_word_char(following):
+            value = value + ' '
+        return value
+
+    def substitute(self, text: str, spans: List[Tuple[int, int, str]] = None) -> Tuple[str, int]:
+        """
+        Returns:
+            Tuple (bản dịch đã thay, số lần thay)
+        """
+        if not self.pattern or not text:
+            return text, 0
+        if spans is None:
+            spans = ForeignCharDetector.scan(text)
+
+        parts = []
+        last = 0
+        count = 0
+        for start, end, lang in spans:
+            if lang != 'chinese':
+                continue
+            for match in self.pattern.finditer(text, start, end):
+                parts.append(text[last:match.start()])
+                previous = parts[-1][-1:] or (parts[-2][-1:] if len(parts) > 1 else '')
+                parts.append(self._replacement(match.group(), previous, text[match.end():match.end() + 1]))
+                last = match.end()
+                count += 1
+
+        if not count:
+            return text, 0
+        parts.append(text[last:])
+        return ''.join(parts), count
+
+    def context_for(self, texts: Iterable[str]) -> str:
+        """Glossary context ("term_cn → term_vi" mỗi dòng) chỉ gồm các term xuất hiện trong texts"""
+        if not self.pattern:
+            return ""
+        found = {}
+        for text in texts:
+            for match in self.pattern.finditer(text or ""):
+                found.setdefault(match.group(), self.mapping[match.group()])
+        return "\n".join(f"{term_cn} → {term_vi}" for term_cn, term_vi in found.items())
+
+
+class ForeignCharRepairer:
+    """Sửa câu dịch còn sót ký tự ngoại ngữ bằng một request nhỏ"""
+
+    MAX_SENTENCES = 40  # Số câu tối đa mỗi request
+    SOURCE_WINDOW = 1  # Lấy thêm n câu gốc trước/sau câu được căn chỉnh
+
+    @classmethod
+    def find_broken_sentences(cls, text: str, spans: List[Tuple[int, int, str]]) -> List[Tuple[int, int]]:
+        """Các câu chứa ít nhất một đoạn ký tự ngoại ngữ"""
+        sentences = sentence_spans(text)
+        starts = [start for start, _end in sentences]
+        broken = []
+        for start, _end, _lang in spans:
+            i = bisect.bisect_right(starts, start) - 1
+            if i >= 0 and start < sentences[i][1] and (not broken or broken[-1] != sentences[i]):
+                broken.append(sentences[i])
+        return broken
+
+    @classmethod
+    def align_source(cls, source: str, source_sentences: List[Tuple[int, int]],
+                     translation: str, sentence: Tuple[int, int],
+                     foreign_runs: List[str]) -> str:
+        """
+        Tìm câu gốc tương ứng với câu dịch
+        Ưu tiên vị trí xuất hiện của chính đoạn ký tự còn sót trong bản gốc (gần vị trí tương đối nhất),
+        nếu không có thì dùng vị trí tương đối của câu trong bản dịch
+        """
+        if not source_sentences:
+            return ""
+
+        center = (sentence[0] + sentence[1]) / 2
+        expected = center / max(len(translation), 1) * len(source)
+
+        anchor = expected
+        for run in sorted(foreign_runs, key=len, reverse=True):
+            positions = [m.start() for m in re.finditer(re.escape(run), source)]
+            if positions:
+                anchor = min(positions, key=lambda pos: abs(pos - expected))
+                break
+
+        starts = [start for start, _end in source_sentences]
+        i = max(bisect.bisect_right(starts, anchor) - 1, 0)
+        window = source_sentences[max(i - cls.SOURCE_WINDOW, 0):i + cls.SOURCE_WINDOW + 1]
+        return " ".join(source[start:end] for start, end in window)
+
+    @classmethod
+    def repair(cls, source: str, translation: str, glossary_context: str = "",
+               spans: List[Tuple[int, int, str]] = None, glossary: GlossarySubstituter = None) -> Dict:
+        """
+        Sửa các câu còn sót ký tự ngoại ngữ
+
+        Args:
+            glossary: Có thì chỉ gửi các term xuất hiện trong câu gốc/câu lỗi thay cho cả glossary_context
+
+        Returns:
+            Dict: translation (đã ghép câu sửa), repaired (số câu được sửa), broken (số câu lỗi), usage
+        """
+        from .gemini_client import fix_sentences_with_gemini
+
+        if spans is None:
+            spans = ForeignCharDetector.scan(translation)
+        broken = cls.find_broken_sentences(translation, spans)[:cls.MAX_SENTENCES]
+        result = {'translation': translation, 'repaired': 0, 'broken': len(broken),
+                  'usage': {'prompt_tokens': 0, 'output_tokens': 0}}
+        if not broken:
+            return result
+
+        source_sentences = sentence_spans(source or "")
+        items = []
+        for start, end in broken:
+            runs = [translation[s:e] for s, e, _lang in spans if start <= s < end]
+            items.append((
+                cls.align_source(source or "", source_sentences, translation, (start, end), runs),
+                translation[start:end]
+            ))
+
+        if glossary is not None:
+            glossary_context = glossary.context_for(text for item in items for text in item)
+
+        model = getattr(settings, 'FOREIGN_CHAR_REPAIR_MODEL', 'gemini-2.5-flash')
+        fixed, usage = fix_sentences_with_gemini(items, glossary_context, model=model)
+        result['usage'] = usage
+
+        # Ghép từ cuối lên để vị trí các câu phía trước không bị lệch
+        text = translation
+        for (start, end), (_source, original), replacement in reversed(list(zip(broken, items, fixed))):
+            if not replacement:
+                continue
+            if foreign_char_count(replacement) >= foreign_char_count(original):
+                continue
+            text = text[:start] + replacement + text[end:]
+            result['repaired'] += 1
+
+        result['translation'] = text
+        return result
+
+
+def postprocess_translation(source: str, translation: str, glossary_context: str = "",
+                            glossary: GlossarySubstituter = None) -> Dict:
+    """
+    Hậu xử lý bản dịch vừa nhận từ AI rồi phát hiện ký tự ngoại ngữ còn lại
+
+    Args:
+        glossary: GlossarySubstituter của novel (thay term còn sót trước khi phát hiện/sửa bằng AI,
+            prompt sửa câu chỉ gửi các term liên quan)
+
+    Returns:
+        Dict: translation, detection, spans (của bản cuối), substituted (số term được thay),
+        repaired (số câu được AI sửa)
+    """
+    spans = ForeignCharDetector.scan(translation)
+    substituted = 0
+    repaired = 0
+
+    if spans and glossary is not None:
+        translation, substituted = glossary.substitute(translation, spans)
+        if substituted:
+            spans = ForeignCharDetector.scan(translation)
+
+    if spans and getattr(settings, 'FOREIGN_CHAR_REPAIR', True):
+        try:
+            repair = ForeignCharRepairer.repair(source, translation, glossary_context, spans, glossary)
+        except Exception as e:
+            # Không để lỗi sửa câu làm mất bản dịch đã có
+            print(f"⚠️ Lỗi khi sửa ký tự ngoại ngữ: {e}")
+        else:
+            if repair['repaired']:
+                translation = repair['translation']
+                repaired = repair['repaired']
+                spans = ForeignCharDetector.scan(translation)
+                print(f"🩹 Đã sửa {repaired}/{repair['broken']} câu còn sót ký tự ngoại ngữ")
+
+    return {
+        'translation': translation,
+        'detection': ForeignCharDetector.detect(translation, spans),
+        'spans': spans,
+        'substituted': substituted,
+        'repaired': repaired,
+    }
@@ -0,0 +1,290 @@
+"""
+Xử lý lỗi khi gọi API LLM: phân loại lỗi, backoff có jitter, circuit breaker theo từng API key
+Trạng thái breaker lưu trong Django cache để mọi thread/process dùng chung
+"""
+import itertools
+import random
+import re
+import time
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .llm_tracing import current_call
+
+# Loại lỗi
+RATE_LIMIT = 'rate_limit'  # 429 / hết quota -> tạm khóa key, chuyển sang key khác
+AUTH = 'auth'  # Key sai/bị thu hồi -> khóa key lâu hơn, chuyển sang key khác
+TRANSIENT = 'transient'  # 5xx, timeout, mất kết nối -> thử lại sau một khoảng chờ
+FATAL = 'fatal'  # Request sai (400...) -> thử lại cũng vô ích
+
+TRANSIENT_STATUSES = {'UNAVAILABLE', 'INTERNAL', 'DEADLINE_EXCEEDED', 'ABORTED'}
+TRANSIENT_MESSAGE_PATTERN = re.compile(
+    r'timed? ?out|timeout|temporarily|connection (reset|aborted|refused|error)|overloaded|try again',
+    re.IGNORECASE
+)
+RETRY_DELAY_PATTERN = re.compile(r'retry[_ -]?(?:delay|after)["\']?\s*[:=]\s*["\']?(\d+(?:\.\d+)?)s?', re.IGNORECASE)
+
+
+def _error_code(error: Exception) -> Optional[int]:
+    """HTTP status của lỗi (google-genai: .code, openai/requests: .status_code / .response.status_code)"""
+    for value in (
+        getattr(error, 'code', None),
+        getattr(error, 'status_code', None),
+        getattr(getattr(error, 'response', None), 'status_code', None),
+    ):
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def classify_error(error: Exception) -> str:
+    """Phân loại lỗi để quyết định thử lại, đổi key hay dừng"""
+    code = _error_code(error)
+    status = str(getattr(error, 'status', '') or '').upper()
+
+    if code == 429 or status == 'RESOURCE_EXHAUSTED':
+        return RATE_LIMIT
+    if code in (401, 403) or status in ('UNAUTHENTICATED', 'PERMISSION_DENIED'):
+        return AUTH
+    if code in (408, 409) or (code is not None and code >= 500) or status in TRANSIENT_STATUSES:
+        return TRANSIENT
+    if code is not None:
+        return FATAL
+
+    # Lỗi không có HTTP status: lỗi mạng/timeout của thư viện HTTP
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return TRANSIENT
+    if type(error).__module__.split('.')[0] in ('httpx', 'httpcore', 'requests', 'urllib3'):
+        return TRANSIENT
+    message = str(error)
+    if 'quota' in message.lower() or '429' in message:
+        return RATE_LIMIT
+    if TRANSIENT_MESSAGE_PATTERN.search(message):
+        return TRANSIENT
+    return FATAL
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Thời gian chờ server gợi ý (RetryInfo.retryDelay / header Retry-After), nếu có"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        value = headers.get('retry-after') or headers.get('Retry-After')
+        if value:
+            return float(value)
+    except (TypeError, ValueError, AttributeError):
+        pass
+    match = RETRY_DELAY_PATTERN.search(str(getattr(error, 'details', '') or error))
+    return float(match.group(1)) if match else None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff với full jitter: ngẫu nhiên trong [0, min(max, base * 2^attempt)]"""
+    base = getattr(settings, 'LLM_BACKOFF_BASE', 2.0)
+    cap = getattr(settings, 'LLM_BACKOFF_MAX', 60.0)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class KeyCircuitBreaker:
+    """
+    Circuit breaker cho từng API key
+    - Lỗi liên tiếp >= LLM_BREAKER_THRESHOLD (hoặc rate limit/auth) -> mở (key bị bỏ qua) trong một khoảng thời gian
+    - Hết thời gian -> key được thử lại (half-open), thành công thì đóng, lỗi thì mở lại ngay
+    """
+
+    CACHE_PREFIX = 'llm_breaker:'
+
+    def __init__(self, provider: str, key_id):
+        self.cache_key = f'{self.CACHE_PREFIX}{provider}:{key_id}'
+
+    def _state(self) -> dict:
+        return cache.get(self.cache_key) or {'failures': 0, 'open_until': 0}
+
+    def is_open(self) -> bool:
+        return self._state()['open_until'] > time.time()
+
+    def open_until(self) -> float:
+        return self._state()['open_until']
+
+    def record_success(self):
+        if cache.get(self.cache_key) is not None:
+            cache.delete(self.cache_key)
+
+    def record_failure(self, kind: str, retry_after: Optional[float] = None) -> bool:
+        """
+        Ghi nhận lỗi của key
+
+        Returns:
+            True nếu breaker vừa mở (key tạm thời không dùng được)
+        """
+        state = self._state()
+        state['failures'] += 1
+        threshold = getattr(settings, 'LLM_BREAKER_THRESHOLD', 3)
+
+        cooldown = None
+        if kind == RATE_LIMIT:
+            cooldown = retry_after or getattr(settings, 'LLM_RATE_LIMIT_COOLDOWN', 60)
+        elif kind == AUTH or (kind == TRANSIENT and state['failures'] >= threshold):
+            cooldown = getattr(settings, 'LLM_BREAKER_COOLDOWN', 300)
+
+        if cooldown:
+            state['open_until'] = time.time() + cooldown
+        cache.set(self.cache_key, state, timeout=None)
+        return cooldown is not None
+
+
+class AllKeysUnavailable(Exception):
+    """Mọi API key của provider đều đang bị circuit breaker tạm khóa"""
+
+    def __init__(self, provider: str, wait: float):
+        self.provider = provider
+        self.wait = wait
+        super().__init__(f"Tất cả {provider} API keys đang tạm khóa (rate limit/lỗi liên tiếp), thử lại sau {wait:.0f}s")
+
+
+class APIKeyPool:
+    """
+    Các API key active của một provider (bảng APIKey), chọn lần lượt key không bị circuit breaker khóa
+    Subclass cài _make_client(api_key) để tạo client của SDK
+    """
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.api_keys = self._load_api_keys_from_db()
+        self._counter = itertools.count()
+
+    def _load_api_keys_from_db(self) -> list:
+        """Load API keys từ database (chỉ lấy key active)"""
+        from ..models import APIKey
+        keys = APIKey.objects.filter(
+            provider=self.provider,
+            is_active=True
+        ).order_by('id').values_list('id', 'key')
+
+        return [(key_id, key) for key_id, key in keys]
+
+    def _make_client(self, api_key: str):
+        raise NotImplementedError
+
+    def _mark_key_used(self, key_id: int):
+        """Cập nhật usage count cho key"""
+        from ..models import APIKey
+        try:
+            APIKey.objects.get(id=key_id).mark_used()
+        except APIKey.DoesNotExist:
+            pass
+
+    def breaker(self, key_id: int) -> KeyCircuitBreaker:
+        return KeyCircuitBreaker(self.provider, key_id)
+
+    def _healthy_index(self, start: int) -> Optional[int]:
+        """Index của key đầu tiên (tính từ start, vòng tròn) không bị circuit breaker khóa"""
+        for offset in range(len(self.api_keys)):
+            index = (start + offset) % len(self.api_keys)
+            if not self.breaker(self.api_keys[index][0]).is_open():
+                return index
+        return None
+
+    def available(self) -> bool:
+        """Còn key nào dùng được không"""
+        return bool(self.api_keys) and self._healthy_index(0) is not None
+
+    def _unavailable(self) -> AllKeysUnavailable:
+        now = time.time()
+        wait = min((self.breaker(key_id).open_until() for key_id, _key in self.api_keys), default=now) - now
+        return AllKeysUnavailable(self.provider, max(wait, 0))
+
+    def get_client(self) -> tuple:
+        """
+        Client với key khỏe tiếp theo (round-robin)
+
+        Returns:
+            Tuple (client, key_id)
+
+        Raises:
+            AllKeysUnavailable: mọi key đều đang bị khóa
+        """
+        index = self._healthy_index(next(self._counter)) if self.api_keys else None
+        if index is None:
+            raise self._unavailable()
+        key_id, api_key = self.api_keys[index]
+        self._mark_key_used(key_id)
+        return self._make_client(api_key), key_id
+
+    def client_for(self, key_id: int):
+        """Client của một key cụ thể (VD job batch chỉ xem được bằng key đã gửi nó)"""
+        for id_, api_key in self.api_keys:
+            if id_ == key_id:
+                return self._make_client(api_key)
+        raise ValueError(f"⚠️ API key #{key_id} của {self.provider} không còn active")
+
+    def report_failure(self, key_id: int, kind: str, retry_after: float = None):
+        """Ghi nhận lỗi của key, nếu key bị khóa thì lần gọi sau tự chuyển sang key khỏe tiếp theo"""
+        if self.breaker(key_id).record_failure(kind, retry_after):
+            print(f"⛔ Tạm khóa {self.provider} API key #{key_id} ({kind})")
+
+    def report_success(self, key_id: int):
+        self.breaker(key_id).record_success()
+
+
+def _retry_delay(pool: APIKeyPool, error: Exception, key_id: Optional[int], attempt: int, max_wait: float) -> float:
+    """Ghi nhận lỗi và trả về thời gian chờ trước lần thử tiếp theo (raise nếu không thử lại)"""
+    max_retries = getattr(settings, 'LLM_MAX_RETRIES', 4)
+    if isinstance(error, AllKeysUnavailable):
+        if attempt >= max_retries or error.wait > max_wait:
+            raise error
+        return error.wait
+
+    kind = classify_error(error)
+    if kind == FATAL:
+        # Lỗi của request chứ không phải của key
+        raise error
+    pool.report_failure(key_id, kind, retry_after_seconds(error))
+    if attempt >= max_retries:
+        raise error
+
+    print(f"⚠️ Lỗi {pool.provider} ({kind}), thử lại lần {attempt + 1}/{max_retries}: {error}")
+    if kind in (RATE_LIMIT, AUTH):
+        # Đổi key và thử lại ngay; nếu không còn key nào, get_client sẽ báo thời gian chờ
+        return 0
+    return backoff_delay(attempt)
+
+
+def call_with_retries(
+    pool: APIKeyPool,
+    func: Callable[..., Any],
+    max_wait: Optional[float] = None,
+    pass_key_id: bool = False
+) -> Any:
+    """
+    Gọi func(client) với client lấy từ pool, thử lại theo loại lỗi
+    - Rate limit/auth: khóa key hiện tại và thử lại ngay với key khỏe tiếp theo
+    - Lỗi tạm thời: exponential backoff có jitter, lỗi liên tiếp sẽ mở circuit breaker của key
+    - Lỗi không sửa được: raise ngay; tối đa LLM_MAX_RETRIES lần thử lại
+
+    Args:
+        max_wait: Mọi key bị khóa lâu hơn max_wait giây thì raise AllKeysUnavailable thay vì chờ
+            (mặc định LLM_BACKOFF_MAX; 0 = không chờ, dùng khi còn provider khác để chuyển sang)
+        pass_key_id: Gọi func(client, key_id) (VD context cache gắn với từng key)
+    """
+    if max_wait is None:
+        max_wait = getattr(settings, 'LLM_BACKOFF_MAX', 60.0)
+    # Lần gọi đang được trace (llm_tracing) ghi lại key đã dùng và số lần thử lại
+    call = current_call()
+    attempt = 0
+    while True:
+        key_id = None
+        try:
+            client, key_id = pool.get_client()
+            if call:
+                call.key_id = key_id
+            result = func(client, key_id) if pass_key_id else func(client)
+        except Exception as e:
+            time.sleep(_retry_delay(pool, e, key_id, attempt, max_wait))
+            attempt += 1
+            if call:
+                call.retries = attempt
+            continue
+        pool.report_success(key_id)
+        return result
@@ -1,86 +1,208 @@
+import math
 import re
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Tuple
+from django.conf import settings
+from django.db import transaction
 from ..models import Chapter, Segment
+from .tokens import estimate_tokens, token_weight
 
 
 class SegmentProcessor:
-    """Chia chapter thành segments ~3000 từ và quản lý việc dịch"""
+    """Chia chapter thành segments vừa giới hạn token của model dịch và quản lý việc dịch"""
     
-    MAX_WORDS = 3000
+    DEFAULT_SEGMENT_TOKENS = 3000  # Khi không biết giới hạn của model
+    MIN_SEGMENT_TOKENS = 500
+    SAFETY_MARGIN = 0.9  # Chừa 10% cho sai số ước lượng token
     
-    @staticmethod
-    def count_words(text: str) -> int:
+    # Một "từ": mỗi ký tự Hán, hoặc một cụm chữ/số không phải Hán (tiếng Việt, Latin...)
+    HAN_RUN_PATTERN = re.compile(r'[\u4e00-\u9fff]+')
+    OTHER_WORD_PATTERN = re.compile(r'[^\W\u4e00-\u9fff]+')
+    # Một câu: đến dấu kết thúc câu (kèm dấu đóng ngoặc/nháy) hoặc hết đoạn (xuống dòng)
+    SENTENCE_PATTERN = re.compile(r'[^。！？.!?\n]*(?:[。！？.!?]+[”"’」』）)]*|\n|$)')
+    # Một đoạn văn: đến hết các dấu xuống dòng liên tiếp
+    PARAGRAPH_PATTERN = re.compile(r'[^\n]*\n*')
+    
+    @classmethod
+    def count_words(cls, text: str) -> int:
         """Đếm số từ trong văn bản (hỗ trợ cả tiếng Trung và tiếng Việt)"""
-        # Với tiếng Trung, mỗi ký tự là 1 từ
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text))
-        # Với các ngôn ngữ khác, tách bằng khoảng trắng
-        other_words = len(re.findall(r'\b\w+\b', text))
+        # Thay mỗi dãy Hán tự bằng 1 khoảng trắng: số ký tự bị bỏ = số chữ Hán, không cần tạo list từng ký tự
+        stripped, runs = cls.HAN_RUN_PATTERN.subn(' ', text)
+        chinese_chars = len(text) - len(stripped) + runs
+        other_words = len(cls.OTHER_WORD_PATTERN.findall(stripped)) if not stripped.isspace() else 0
         return chinese_chars + other_words
     
-    @staticmethod
-    def split_by_sentences(text: str) -> List[str]:
+    @classmethod
+    def iter_sentences(cls, text: str, pos: int = 0, endpos: int = None) -> Iterator[Tuple[int, int, float]]:
+        """
+        Duyệt văn bản (hoặc đoạn [pos, endpos)) một lần, trả về từng câu kèm số token ước lượng
+        
+        Yields:
+            (start, end, tokens) - vị trí trong văn bản gốc
+        """
+        endpos = len(text) if endpos is None else endpos
+        count = token_weight
+        for match in cls.SENTENCE_PATTERN.finditer(text, pos, endpos):
+            start, end = match.span()
+            if start != end:
+                yield start, end, count(match.group())
+    
+    @classmethod
+    def iter_paragraphs(cls, text: str) -> Iterator[Tuple[int, int, float]]:
+        """Như iter_sentences nhưng theo đoạn văn (kết thúc bằng xuống dòng)"""
+        count = token_weight
+        for match in cls.PARAGRAPH_PATTERN.finditer(text):
+            start, end = match.span()
+            if start != end:
+                yield start, end, count(match.group())
+    
+    @classmethod
+    def split_by_sentences(cls, text: str) -> List[str]:
         """Tách văn bản thành các câu"""
-        # Pattern cho tiếng Trung và tiếng Việt
-        sentences = re.split(r'([。！？\.!?]+[\s]*)', text)
-        result = []
-        for i in range(0, len(sentences)-1, 2):
-            if i+1 < len(sentences):
-                result.append(sentences[i] + sentences[i+1])
-            else:
-                result.append(sentences[i])
-        if sentences and not result:
-            result = [text]
-        return [s.strip() for s in result if s.strip()]
+        return [
+            sentence for sentence in (match.group().strip() for match in cls.SENTENCE_PATTERN.finditer(text))
+            if sentence
+        ]
     
     @classmethod
-    def create_segments(cls, chapter: Chapter) -> int:
+    def segment_budget(cls, model: str = None, overhead_tokens: int = 0) -> int:
         """
-        Chia chapter thành các segments ~3000 từ
-        Returns: số lượng segments được tạo
+        Số token bản gốc tối đa mỗi segment cho model dịch
+        - Output: bản dịch (~TRANSLATION_OUTPUT_RATIO x bản gốc) + thinking phải vừa giới hạn output
+        - Input: prompt cố định (glossary, chương trước...) + segment + output phải vừa context
+        
+        Args:
+            model: Model dịch (mặc định settings.TRANSLATION_MODEL)
+            overhead_tokens: Token của phần prompt không phải nội dung cần dịch
         """
-        if not chapter.content_raw:
-            return 0
+        model = model or getattr(settings, 'TRANSLATION_MODEL', None)
+        limits = getattr(settings, 'MODEL_LIMITS', {}).get(model)
+        if not limits:
+            return cls.DEFAULT_SEGMENT_TOKENS
         
-        # Xóa segments cũ nếu có
-        chapter.segments.all().delete()
+        ratio = getattr(settings, 'TRANSLATION_OUTPUT_RATIO', 1.8)
+        by_output = (limits['output'] - limits.get('thinking', 0)) / ratio
+        by_context = limits['context'] - overhead_tokens - limits['output']
+        budget = min(by_output, by_context) * cls.SAFETY_MARGIN
         
-        sentences = cls.split_by_sentences(chapter.content_raw)
-        segments = []
-        current_segment = []
-        current_word_count = 0
+        cap = getattr(settings, 'SEGMENT_MAX_TOKENS', None)
+        if cap:
+            budget = min(budget, cap)
+        return max(int(budget), cls.MIN_SEGMENT_TOKENS)
+    
+    @classmethod
+    def _pack(cls, text: str, units: List[Tuple[int, int, float]], cap: float, sentences: Dict = None) -> List[int]:
+        """
+        Gom câu/đoạn lần lượt, không vượt cap; trả về vị trí bắt đầu mỗi segment trong văn bản
         
-        for sentence in sentences:
-            sentence_words = cls.count_words(sentence)
-            
-            # Nếu câu hiện tại quá dài, tách riêng
-            if sentence_words > cls.MAX_WORDS:
-                if current_segment:
-                    segments.append('\n'.join(current_segment))
-                    current_segment = []
-                    current_word_count = 0
-                segments.append(sentence)
+        Args:
+            sentences: Có thì đoạn văn không vừa phần còn lại của segment được cắt ở cuối câu
+                (dict cache các câu của từng đoạn văn, theo vị trí bắt đầu)
+        """
+        starts = []
+        segment_tokens = 0.0
+        for start, end, tokens in units:
+            if starts and segment_tokens + tokens <= cap:
+                segment_tokens += tokens
                 continue
-            
-            # Nếu thêm câu này vượt quá giới hạn, lưu segment hiện tại
-            if current_word_count + sentence_words > cls.MAX_WORDS and current_segment:
-                segments.append('\n'.join(current_segment))
-                current_segment = [sentence]
-                current_word_count = sentence_words
+            if sentences is None or not starts:
+                starts.append(start)
+                segment_tokens = tokens
+                continue
+            if start not in sentences:
+                sentences[start] = list(cls.iter_sentences(text, start, end))
+            for sentence_start, _end, sentence_tokens in sentences[start]:
+                if segment_tokens and segment_tokens + sentence_tokens > cap:
+                    starts.append(sentence_start)
+                    segment_tokens = 0.0
+                segment_tokens += sentence_tokens
+        return starts
+    
+    @classmethod
+    def iter_segments(cls, text: str, max_tokens: int = None, total_tokens: int = None) -> Iterator[str]:
+        """
+        Chia văn bản thành các segments tối đa max_tokens, ít request nhất và kích thước đều nhau
+        - Số segments = số tối thiểu khi gom câu/đoạn sát max_tokens
+        - Với số segments đó, tìm (chia đôi) giới hạn nhỏ nhất vẫn gom đủ -> segment lớn nhất nhỏ nhất có thể
+        - Ưu tiên cắt ở cuối đoạn văn (đoạn văn dài hơn kích thước trung bình mới được cắt ở cuối câu);
+          nếu vậy tốn thêm request thì đoạn văn ở chỗ cắt được cắt ở cuối câu
+        - Mỗi segment là một lát cắt của văn bản gốc nên giữ nguyên xuống dòng/đoạn văn
+        - Câu dài hơn giới hạn thành một segment riêng
+        
+        Args:
+            total_tokens: Tổng token của văn bản nếu đã biết (Chapter.token_count)
+        """
+        max_tokens = max_tokens or cls.segment_budget()
+        if total_tokens is None:
+            total_tokens = estimate_tokens(text)
+        if total_tokens <= max_tokens:
+            # Vừa một segment: không cắt
+            if text.strip():
+                yield text.strip()
+            return
+        
+        minimum = math.ceil(total_tokens / max_tokens)
+        split_above = total_tokens / minimum
+        units = []
+        for start, end, tokens in cls.iter_paragraphs(text):
+            if tokens > split_above:
+                units.extend(cls.iter_sentences(text, start, end))
             else:
-                current_segment.append(sentence)
-                current_word_count += sentence_words
+                units.append((start, end, tokens))
+        
+        sentences = None
+        starts = cls._pack(text, units, max_tokens)
+        if len(starts) > minimum:
+            # Chỉ cắt ở cuối đoạn văn thì tốn thêm request
+            sentences = {}
+            starts = cls._pack(text, units, max_tokens, sentences)
+        count = len(starts)
+        
+        low = max(sum(tokens for _start, _end, tokens in units) / count, 1.0)
+        high = float(max_tokens)
+        while high - low > 1:
+            cap = (low + high) / 2
+            if len(cls._pack(text, units, cap, sentences)) <= count:
+                high = cap
+            else:
+                low = cap
+        if high < max_tokens:
+            starts = cls._pack(text, units, high, sentences)
+        
+        for start, end in zip(starts, starts[1:] + [len(text)]):
+            chunk = text[start:end].strip()
+            if chunk:
+                yield chunk
+    
+    @classmethod
+    def create_segments(cls, chapter: Chapter, max_tokens: int = None) -> int:
+        """
+        Chia chapter thành các segments
+        Nếu chapter đã có segments: segments cũ (cùng bản dịch) bị xóa và chapter trở về trạng thái chưa dịch
         
-        # Thêm segment cuối cùng
-        if current_segment:
-            segments.append('\n'.join(current_segment))
+        Args:
+            max_tokens: Token tối đa mỗi segment (xem segment_budget), mặc định theo TRANSLATION_MODEL
         
-        # Tạo Segment objects
-        for idx, content in enumerate(segments, start=1):
-            Segment.objects.create(
-                chapter=chapter,
-                index=idx,
-                content_raw=content
-            )
+        Returns: số lượng segments được tạo
+        """
+        if not chapter.content_raw:
+            return 0
+        
+        contents = list(cls.iter_segments(chapter.content_raw, max_tokens, chapter.token_count))
+        
+        with transaction.atomic():
+            # Xóa segments cũ nếu có
+            deleted, _ = chapter.segments.all().delete()
+            if deleted:
+                chapter.status = 'imported'
+                chapter.translation = None
+                chapter.foreign_char_warning = None
+                chapter.invalidate_full_translation()
+                chapter.save(update_fields=['status', 'translation', 'foreign_char_warning', 'updated_at'])
+            
+            segments = Segment.objects.bulk_create([
+                Segment(chapter=chapter, index=idx, content_raw=content)
+                for idx, content in enumerate(contents, start=1)
+            ])
         
         return len(segments)
     
@@ -101,14 +223,7 @@ class SegmentProcessor:
     @classmethod
     def merge_translations(cls, chapter: Chapter) -> str:
         """Gộp tất cả translations của segments thành bản dịch hoàn chỉnh"""
-        segments = chapter.segments.order_by('index')
-        translations = []
-        
-        for segment in segments:
-            if segment.translation:
-                translations.append(segment.translation.strip())
-        
-        return '\n\n'.join(translations)
+        return chapter.merge_segment_translations()
     
     @classmethod
     def get_next_untranslated_segment(cls, chapter: Chapter):
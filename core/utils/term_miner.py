@@ -0,0 +1,170 @@
+"""
+Khai phá thuật ngữ ứng viên (tên riêng, danh hiệu, chiêu thức...) ngay trên máy
+Dựa trên tần suất n-gram ký tự Hán và branching entropy (độ đa dạng ký tự đứng trước/sau),
+tính toán vector hóa bằng NumPy trên mảng codepoint của toàn bộ văn bản.
+
+Chỉ các ứng viên (kèm một đoạn ngữ cảnh ngắn) mới được gửi cho LLM thay vì toàn bộ chapters.
+"""
+from dataclasses import dataclass
+from typing import List, Iterable
+
+import numpy as np
+
+
+@dataclass
+class TermCandidate:
+    term: str
+    frequency: int
+    left_entropy: float
+    right_entropy: float
+    position: int  # Vị trí xuất hiện đầu tiên trong văn bản
+
+    @property
+    def entropy(self) -> float:
+        return min(self.left_entropy, self.right_entropy)
+
+
+class TermMiner:
+    """Đề xuất thuật ngữ ứng viên từ văn bản tiếng Trung"""
+
+    # Hán tự nằm trong BMP nên mỗi ký tự vừa 16 bit -> n-gram (n <= 4) vừa một uint64
+    HAN_RANGES = ((0x4e00, 0x9fff), (0x3400, 0x4dbf))
+    BITS_PER_CHAR = 16
+
+    # Hư từ / đại từ rất phổ biến: n-gram bắt đầu hoặc kết thúc bằng các chữ này hầu như không phải thuật ngữ
+    STOP_CHARS = '的了是在我他她你们这那不一有着就也都说和地得个上下来去到又被把还很没'
+
+    def __init__(
+        self,
+        min_n: int = 2,
+        max_n: int = 4,
+        min_freq: int = 3,
+        min_entropy: float = 1.0,
+        max_candidates: int = 3000,
+        context_chars: int = 20,
+    ):
+        if not 1 <= min_n <= max_n <= 4:
+            raise ValueError("Chỉ hỗ trợ n-gram từ 1 đến 4 ký tự")
+        self.min_n = min_n
+        self.max_n = max_n
+        self.min_freq = min_freq
+        self.min_entropy = min_entropy
+        self.max_candidates = max_candidates
+        self.context_chars = context_chars
+
+    @staticmethod
+    def encode(text: str) -> np.ndarray:
+        """Chuyển văn bản thành mảng codepoint uint32"""
+        return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+    @classmethod
+    def _han_mask(cls, codes: np.ndarray) -> np.ndarray:
+        mask = np.zeros(len(codes), dtype=bool)
+        for low, high in cls.HAN_RANGES:
+            mask |= (codes >= low) & (codes <= high)
+        return mask
+
+    @staticmethod
+    def _entropy(gram_ids: np.ndarray, neighbors: np.ndarray, gram_counts: np.ndarray) -> np.ndarray:
+        """Branching entropy của ký tự láng giềng cho từng n-gram"""
+        # Ghép (gram_id, codepoint láng giềng) thành một khóa int64 rồi đếm
+        pairs = (gram_ids.astype(np.int64) << 21) | neighbors.astype(np.int64)
+        unique_pairs, pair_counts = np.unique(pairs, return_counts=True)
+        pair_grams = unique_pairs >> 21
+        p = pair_counts / gram_counts[pair_grams]
+        return -np.bincount(pair_grams, weights=p * np.log2(p), minlength=len(gram_counts))
+
+    def _mine_ngrams(self, codes: np.ndarray, han_cumsum: np.ndarray, n: int) -> dict:
+        """Đếm n-gram toàn Hán tự và tính entropy trái/phải"""
+        length = len(codes)
+        if length < n:
+            return {}
+
+        starts = np.arange(length - n + 1)
+        # Cửa sổ chỉ gồm Hán tự
+        valid = (han_cumsum[starts + n] - han_cumsum[starts]) == n
+        positions = starts[valid]
+        if len(positions) == 0:
+            return {}
+
+        keys = np.zeros(len(positions), dtype=np.uint64)
+        for offset in range(n):
+            keys = (keys << np.uint64(self.BITS_PER_CHAR)) | codes[positions + offset].astype(np.uint64)
+
+        grams, first_index, inverse, counts = np.unique(
+            keys, return_index=True, return_inverse=True, return_counts=True
+        )
+
+        # Láng giềng trái/phải, 0 = đầu/cuối văn bản
+        padded = np.concatenate(([0], codes, [0])).astype(np.uint32)
+        left = padded[positions]
+        right = padded[positions + n + 1]
+        left_entropy = self._entropy(inverse, left, counts)
+        right_entropy = self._entropy(inverse, right, counts)
+
+        keep = (counts >= self.min_freq) & (np.minimum(left_entropy, right_entropy) >= self.min_entropy)
+        return {
+            int(key): (int(count), float(h_left), float(h_right), int(positions[first]))
+            for key, count, h_left, h_right, first in zip(
+                grams[keep], counts[keep], left_entropy[keep], right_entropy[keep], first_index[keep]
+            )
+        }
+
+    def _decode(self, key: int, n: int) -> str:
+        mask = (1 << self.BITS_PER_CHAR) - 1
+        return ''.join(
+            chr((key >> (self.BITS_PER_CHAR * (n - 1 - i))) & mask)
+            for i in range(n)
+        )
+
+    def mine(self, text: str) -> List[TermCandidate]:
+        """
+        Đề xuất thuật ngữ ứng viên trong văn bản
+
+        Returns:
+            List TermCandidate, sắp xếp theo tần suất giảm dần
+        """
+        if not text:
+            return []
+
+        codes = self.encode(text)
+        han_cumsum = np.concatenate(([0], np.cumsum(self._han_mask(codes))))
+
+        by_length = {
+            n: self._mine_ngrams(codes, han_cumsum, n)
+            for n in range(self.min_n, self.max_n + 1)
+        }
+
+        # Bỏ n-gram là một phần của n-gram dài hơn có tần suất gần bằng (ví dụ 李明 trong 李明轩)
+        for n in range(self.max_n, self.min_n, -1):
+            shorter = by_length[n - 1]
+            suffix_mask = (1 << (self.BITS_PER_CHAR * (n - 1))) - 1
+            for key, (count, *_rest) in by_length[n].items():
+                prefix = key >> self.BITS_PER_CHAR
+                suffix = key & suffix_mask
+                for sub in (prefix, suffix):
+                    if sub in shorter and count >= 0.9 * shorter[sub][0]:
+                        del shorter[sub]
+
+        candidates = []
+        for n, grams in by_length.items():
+            for key, (count, h_left, h_right, position) in grams.items():
+                term = self._decode(key, n)
+                if term[0] in self.STOP_CHARS or term[-1] in self.STOP_CHARS:
+                    continue
+                candidates.append(TermCandidate(term, count, h_left, h_right, position))
+
+        candidates.sort(key=lambda c: (-c.frequency, c.position))
+        return candidates[:self.max_candidates]
+
+    def context(self, text: str, candidate: TermCandidate) -> str:
+        """Đoạn ngữ cảnh ngắn quanh lần xuất hiện đầu tiên"""
+        start = max(0, candidate.position - self.context_chars)
+        end = candidate.position + len(candidate.term) + self.context_chars
+        return text[start:end].replace('\n', ' ').strip()
+
+    @staticmethod
+    def exclude_known(candidates: Iterable[TermCandidate], known_terms: Iterable[str]) -> List[TermCandidate]:
+        """Bỏ ứng viên đã có trong glossary hoặc là một phần của term đã có"""
+        joined = '\n'.join(known_terms)
+        return [c for c in candidates if c.term not in joined]
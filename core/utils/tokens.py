@@ -0,0 +1,35 @@
+"""
+Ước lượng số token của văn bản (không cần gọi API đếm token)
+Hán tự ~1 token/ký tự, văn bản Latin ~4 ký tự/token
+"""
+import re
+
+HAN_PATTERN = re.compile(r'[㐀-䶿一-鿿豈-﫿]')
+# Xóa cả cụm Hán tự liên tiếp một lần (nhanh hơn nhiều so với thay từng ký tự)
+HAN_RUN_PATTERN = re.compile(HAN_PATTERN.pattern + '+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def _counts(text: str) -> tuple:
+    """(số Hán tự, số ký tự khác không phải khoảng trắng)"""
+    other = HAN_RUN_PATTERN.sub('', text)
+    return len(text) - len(other), len(WHITESPACE_PATTERN.sub('', other))
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của văn bản, chỉ quét văn bản một lần cho mỗi regex"""
+    if not text:
+        return 0
+    han_count, other_chars = _counts(text)
+    return han_count + (other_chars + 3) // 4
+
+
+def token_weight(text: str) -> float:
+    """
+    Như estimate_tokens nhưng không làm tròn: tổng của các phần bằng ước lượng của cả văn bản
+    (làm tròn lên từng câu thì mỗi dấu câu tính thành 1 token, cộng dồn bị lệch nhiều)
+    """
+    if not text:
+        return 0.0
+    han_count, other_chars = _counts(text)
+    return han_count + other_chars / 4
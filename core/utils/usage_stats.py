@@ -0,0 +1,132 @@
+"""
+Thống kê token và chi phí LLM theo segment, chapter, novel, API key - cộng dồn từ sổ cái LLMCallLog (llm_tracing)
+và dự kiến chi phí dịch phần còn lại theo số token/chi phí đo được trên mỗi ký tự nguồn
+- Lần gọi dịch pack (nhiều chapter một request) chỉ gắn với novel, không tính vào chapter/segment
+- Cần LLM_TRACE = True (không ghi LLMCallLog thì không có số liệu)
+"""
+import datetime
+from typing import Dict, List, Optional
+
+from django.db.models import Count, Q, QuerySet, Sum
+from django.db.models.functions import Coalesce, Length
+from django.utils import timezone
+
+from ..models import Chapter, LLMCallLog, Segment
+
+# Thao tác dịch (dùng để đo token/chi phí trên mỗi ký tự nguồn)
+TRANSLATION_OPERATIONS = ('translate', 'translate_fast', 'translate_stream', 'translate_batch')
+
+
+def usage_annotations(prefix: str = '', **filters) -> Dict:
+    """
+    Biểu thức aggregate/annotate tổng usage: số lần gọi, lỗi, token prompt/output/cache, chi phí (USD)
+
+    Args:
+        prefix: Đường dẫn tới LLMCallLog ('' khi aggregate thẳng trên LLMCallLog, 'llm_calls__' cho Chapter,
+            'call_logs__' cho APIKey)
+        filters: Chỉ tính các lần gọi thỏa điều kiện (lookup theo field của LLMCallLog, VD created_at__gte=...)
+    """
+    def where(**extra) -> Optional[Q]:
+        lookups = {f'{prefix}{lookup}': value for lookup, value in {**filters, **extra}.items()}
+        return Q(**lookups) if lookups else None
+
+    return {
+        'calls': Count(f'{prefix}id', filter=where()),
+        'errors': Count(f'{prefix}id', filter=where(outcome='error')),
+        'prompt_tokens': Coalesce(Sum(f'{prefix}prompt_tokens', filter=where()), 0),
+        'output_tokens': Coalesce(Sum(f'{prefix}output_tokens', filter=where()), 0),
+        'cached_tokens': Coalesce(Sum(f'{prefix}cached_tokens', filter=where()), 0),
+        'cost': Coalesce(Sum(f'{prefix}cost', filter=where()), 0.0),
+    }
+
+
+def usage_totals(calls: QuerySet) -> Dict:
+    """Tổng số lần gọi, lỗi, token prompt/output/cache và chi phí (USD) của các LLMCallLog"""
+    return calls.aggregate(**usage_annotations())
+
+
+def today_start() -> datetime.datetime:
+    """0h hôm nay theo TIME_ZONE (tính quota/ngày của API key)"""
+    return timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _untranslated_chars(novel) -> Dict:
+    """Số segment và ký tự nguồn chưa dịch (chapter chưa chia segment và chưa dịch tính theo content_raw)"""
+    segments = Segment.objects.filter(chapter__novel=novel).filter(
+        Q(translation__isnull=True) | Q(translation='')
+    ).aggregate(count=Count('id'), chars=Coalesce(Sum(Length('content_raw')), 0))
+    chapters = Chapter.objects.filter(novel=novel, segments__isnull=True).exclude(
+        Q(translation__isnull=False) | Q(status='translated')
+    ).aggregate(count=Count('id'), chars=Coalesce(Sum(Length('content_raw')), 0))
+    return {
+        'segments': segments['count'],
+        'chapters_without_segments': chapters['count'],
+        'chars': segments['chars'] + chapters['chars'],
+    }
+
+
+def project_remaining_cost(novel) -> Dict:
+    """
+    Dự kiến token/chi phí dịch phần chưa dịch của novel
+    Tỉ lệ đo từ các lần gọi dịch thành công có gắn segment (gồm cả dịch lại/escalate): tổng token, chi phí / tổng ký tự
+    nguồn của các segment đó
+
+    Returns:
+        Dict: remaining_segments, remaining_chars, measured_segments, measured_chars, prompt_tokens_per_char,
+        output_tokens_per_char, cost_per_char, prompt_tokens, output_tokens, cost (None khi chưa đo được)
+    """
+    remaining = _untranslated_chars(novel)
+    calls = LLMCallLog.objects.filter(
+        novel=novel, operation__in=TRANSLATION_OPERATIONS, outcome='ok', segment__isnull=False
+    )
+    measured = Segment.objects.filter(id__in=calls.values('segment_id')).aggregate(
+        count=Count('id'), chars=Coalesce(Sum(Length('content_raw')), 0)
+    )
+    result = {
+        'remaining_segments': remaining['segments'] + remaining['chapters_without_segments'],
+        'remaining_chars': remaining['chars'],
+        'measured_segments': measured['count'],
+        'measured_chars': measured['chars'],
+        'prompt_tokens_per_char': None,
+        'output_tokens_per_char': None,
+        'cost_per_char': None,
+        'prompt_tokens': None,
+        'output_tokens': None,
+        'cost': None,
+    }
+    if not measured['chars']:
+        return result
+
+    totals = usage_totals(calls)
+    for field in ('prompt_tokens', 'output_tokens', 'cost'):
+        rate = totals[field] / measured['chars']
+        result[f'{field}_per_char'] = rate
+        result[field] = rate * remaining['chars']
+    result['prompt_tokens'] = round(result['prompt_tokens'])
+    result['output_tokens'] = round(result['output_tokens'])
+    return result
+
+
+def novel_usage(novel, top_chapters: int = 10) -> Dict:
+    """
+    Tổng hợp usage của novel cho trang novel_detail
+
+    Returns:
+        Dict: totals, by_operation (list), top_chapters (list chapter tốn nhất), projection (project_remaining_cost)
+    """
+    calls = LLMCallLog.objects.filter(novel=novel)
+    by_operation: List[Dict] = list(
+        calls.values('operation').annotate(**usage_annotations()).order_by('-cost', '-prompt_tokens')
+    )
+    chapters = list(
+        Chapter.objects.filter(novel=novel)
+        .annotate(**usage_annotations('llm_calls__'))
+        .filter(calls__gt=0)
+        .order_by('-cost', '-prompt_tokens')[:top_chapters]
+    )
+    return {
+        'totals': usage_totals(calls),
+        'by_operation': by_operation,
+        'top_chapters': chapters,
+        'projection': project_remaining_cost(novel),
+    }
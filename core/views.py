@@ -1,10 +1,13 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse 
+import asyncio
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 import json
 from django.views.decorators.http import require_POST, require_http_methods
 from django.core.paginator import Paginator
-from django.db.models import Avg, Count, Q
-from .models import Novel, Volume, Chapter, Segment, Glossary
+from django.db.models import Avg, BooleanField, Count, ExpressionWrapper, Q, Sum
+from django.db.models.functions import Coalesce, Length, Trim
+from .models import Novel, Volume, Chapter, Segment, Glossary, GlossaryRun
 from .utils.yaml_io import import_yaml_file
 from .forms import UploadYAMLForm
 from .utils.ai_client import translate_text, review_translation
@@ -13,7 +16,15 @@ from .utils.glossary_generator import GlossaryGenerator
 import yaml
 from django.http import HttpResponse
 from .utils.foreign_char_detector import ForeignCharDetector
+from .utils.foreign_char_scan import scan_segments
+from .utils.novel_prepare import prepare_novel
+from .utils.jobs import start_job, get_job
+from .utils.chapter_translator import ChapterTranslator, previous_chapters_context, merge_chapter_translation, translate_novel
+from .utils.llm_tracing import segment_trace, trace_context
+from .utils.usage_stats import novel_usage
+from .utils.async_llm import iterate_in_thread, run_llm
 from django.contrib import messages
+from django.conf import settings
 
 
 def dashboard(request):
@@ -28,15 +39,16 @@ def novel_detail(request, novel_id):
     glossary_count = novel.glossaries.count()
     glossary_terms = novel.glossaries.all()[:50]  # Lấy 50 terms đầu tiên
     
-    # Lấy checkpoint
-    generator = GlossaryGenerator(novel)
-    checkpoint = generator.get_checkpoint()
+    # Lấy checkpoint (chỉ đọc trạng thái, không khởi tạo Gemini client)
+    checkpoint = GlossaryRun.checkpoint_for(novel)
     
     context = {
         'novel': novel,
         'glossary_count': glossary_count,
         'glossary_terms': glossary_terms,
         'checkpoint': checkpoint,
+        # Token/chi phí LLM đã dùng (LLMCallLog) và dự kiến cho phần chưa dịch
+        'usage': novel_usage(novel),
     }
     return render(request, 'core/novel_detail.html', context)
 
@@ -46,21 +58,93 @@ def volume_detail(request, volume_id):
     return render(request, 'core/volume_detail.html', {'volume': volume})
 
 
+def _has_text(field: str) -> ExpressionWrapper:
+    """Annotation: field khác NULL và khác rỗng"""
+    return ExpressionWrapper(Q(**{f'{field}__isnull': False}) & ~Q(**{field: ''}), output_field=BooleanField())
+
+
 def chapter_detail(request, chapter_id):
-    chapter = get_object_or_404(Chapter, pk=chapter_id)
-    
-    # Lấy thông tin segments
-    segments = chapter.segments.all()
+    # Không cần nguyên văn và bản dịch đã chốt (có thể vài MB), chỉ cần độ dài bản dịch
+    chapter = get_object_or_404(
+        Chapter.objects.defer('content_raw', 'translation').annotate(translation_length=Length('translation')),
+        pk=chapter_id
+    )
+    finalized = bool(chapter.translation_length)
+    
+    # Chỉ lấy metadata của segments (trạng thái, badge, nút), nguyên văn/bản dịch/review được trang
+    # tải dần qua chapter_segments_api_view khi segment cuộn tới -> chapter dài vẫn mở ngay
+    segments = list(
+        chapter.segments.only('id', 'index', 'match_percent', 'chapter_id').annotate(
+            has_translation=_has_text('translation'),
+            has_warning=_has_text('foreign_char_warning'),
+            has_review=_has_text('review'),
+        )
+    )
     progress = SegmentProcessor.get_translation_progress(chapter)
     
+    # Số ký tự bản dịch (bản dịch đầy đủ chỉ tải khi copy/xem trước, chapter_translation_api_view)
+    if finalized:
+        translation_chars = chapter.translation_length
+    else:
+        # Giống merge_segment_translations: các đoạn nối bằng '\n\n'
+        merged = chapter.segments.exclude(translation__isnull=True).exclude(translation='').aggregate(
+            count=Count('id'), chars=Coalesce(Sum(Length(Trim('translation'))), 0)
+        )
+        translation_chars = merged['chars'] + 2 * max(merged['count'] - 1, 0)
+    
     context = {
         'chapter': chapter,
         'segments': segments,
         'progress': progress,
+        'translation_chars': translation_chars,
+        'finalized': finalized,
+        'has_translation': finalized or chapter.status == 'translated',
+        'segment_batch_size': getattr(settings, 'CHAPTER_SEGMENT_BATCH', 20),
+        'previous_chapter': chapter.get_previous_chapter(),
+        'next_chapter': chapter.get_next_chapter(),
     }
     return render(request, 'core/chapter_detail.html', context)
 
 
+def chapter_segments_api_view(request, chapter_id):
+    """
+    API trả nội dung của các segment trong chapter (?ids=1,2,3, tối đa CHAPTER_SEGMENT_BATCH segment)
+    Dùng để chapter_detail tải nội dung segment khi cuộn tới
+    """
+    try:
+        ids = [int(segment_id) for segment_id in request.GET.get('ids', '').split(',') if segment_id.strip()]
+    except ValueError:
+        return JsonResponse({
+            'ok': False,
+            'error': 'ids không hợp lệ'
+        }, status=400)
+    ids = ids[:getattr(settings, 'CHAPTER_SEGMENT_BATCH', 20)]
+    
+    segments = Segment.objects.filter(chapter_id=chapter_id, id__in=ids).values(
+        'id', 'content_raw', 'translation', 'review', 'foreign_char_warning'
+    )
+    return JsonResponse({
+        'ok': True,
+        'segments': [{
+            'id': segment['id'],
+            'content_raw': segment['content_raw'],
+            'translation': segment['translation'] or '',
+            'review': segment['review'] or '',
+            'foreign_char_warning': segment['foreign_char_warning'] or '',
+        } for segment in segments]
+    })
+
+
+def chapter_translation_api_view(request, chapter_id):
+    """API trả tiêu đề và bản dịch đầy đủ của chapter (copy/xem trước trên chapter_detail)"""
+    chapter = get_object_or_404(Chapter.objects.defer('content_raw'), pk=chapter_id)
+    return JsonResponse({
+        'ok': True,
+        'title': chapter.title_translation or chapter.title,
+        'translation': chapter.full_translation,
+    })
+
+
 def import_yaml_view(request):
     if request.method == "POST":
         form = UploadYAMLForm(request.POST, request.FILES)
@@ -82,13 +166,28 @@ def import_yaml_view(request):
     return render(request, "core/import_yaml.html", {"form": form})
 
 
+def _segment_budget(chapter: Chapter) -> int:
+    """Token tối đa mỗi segment theo model dịch và phần prompt cố định (glossary, chương trước, phong cách)"""
+    from .utils.gemini_client import translation_prompt_overhead
+    novel = chapter.volume.novel
+    glossary_context = "\n".join(
+        f"{term_cn} → {term_vi}" for term_cn, term_vi in novel.glossaries.values_list('term_cn', 'term_vi')
+    )
+    overhead = translation_prompt_overhead(
+        glossary_context,
+        previous_chapters_context(chapter, limit=3),
+        novel.translation_style or ""
+    )
+    return SegmentProcessor.segment_budget(overhead_tokens=overhead)
+
+
 @require_POST
 def prepare_chapter_view(request, chapter_id):
     """Chuẩn bị chapter bằng cách chia thành segments"""
     chapter = get_object_or_404(Chapter, pk=chapter_id)
     
     try:
-        segment_count = SegmentProcessor.create_segments(chapter)
+        segment_count = SegmentProcessor.create_segments(chapter, _segment_budget(chapter))
         return JsonResponse({
             'ok': True,
             'message': f'Đã chia thành {segment_count} segments',
@@ -102,14 +201,15 @@ def prepare_chapter_view(request, chapter_id):
 
 
 @require_POST
-def translate_segment_view(request, segment_id):
+async def translate_segment_view(request, segment_id):
     """
     Dịch một segment với:
     - Lưu tiêu đề vào CHAPTER nếu là segment đầu tiên
     - Phát hiện ký tự ngoại ngữ
     - Cho phép force re-translate
+    Async view: dịch và ghi DB chạy trong thread pool LLM (async_llm), không giữ worker khi chờ AI
     """
-    segment = get_object_or_404(Segment, pk=segment_id)
+    segment = await aget_object_or_404(Segment.objects.select_related('chapter__volume__novel'), pk=segment_id)
     
     force_retranslate = request.POST.get('force', 'false') == 'true'
     
@@ -121,67 +221,9 @@ def translate_segment_view(request, segment_id):
         }, status=400)
     
     try:
-        chapter = segment.chapter
-        novel = chapter.volume.novel
-        
-        # Lấy glossary
-        glossary_terms = novel.glossaries.all()
-        glossary_context = "\n".join([
-            f"{g.term_cn} → {g.term_vi}"
-            for g in glossary_terms
-        ])
-        
-        # Lấy các chương trước để tham khảo (context)
-        pre_chapters = _get_previous_chapters_context(chapter, limit=3)
-
-        # Lấy phong cách dịch nếu có
-        translation_style = novel.translation_style or ""
-        
-        # ✅ THÊM TIÊU ĐỀ VÀO SOURCE_TEXT
-        source_text = f"{chapter.title}\n\n{segment.content_raw}"
-        
-        # Gọi AI để dịch
-        from .utils.gemini_client import translate_with_gemini
-        title_trans, content_trans = translate_with_gemini(
-            source_text=source_text,  # ✅ Đã có tiêu đề
-            glossary_context=glossary_context,
-            pre_chapters=pre_chapters,
-            translation_style=translation_style
-        )
-        
-        # Lưu bản dịch content
-        segment.translation = content_trans
-        
-        # Lưu tiêu đề vào CHAPTER nếu là segment đầu tiên
-        if segment.index == 1 and title_trans:
-            chapter.title_translation = title_trans
-            chapter.save(update_fields=['title_translation'])
-        
-        # Phát hiện ký tự ngoại ngữ
-        detection = ForeignCharDetector.detect(content_trans)
-        
-        if detection['has_foreign']:
-            segment.foreign_char_warning = detection['warning_message']
-        else:
-            segment.foreign_char_warning = None
-        
-        segment.save()
-        
-        # Cập nhật progress
-        progress = SegmentProcessor.get_translation_progress(chapter)
-        
-        # Nếu đã dịch xong tất cả, gộp lại
-        if progress['remaining'] == 0:
-            _merge_chapter_translation(chapter)
-        
-        return JsonResponse({
-            'ok': True,
-            'translation': content_trans,
-            'title_translation': title_trans if segment.index == 1 else None,
-            'progress': progress,
-            'foreign_detection': detection,
-            'highlighted_text': ForeignCharDetector.highlight_html(content_trans) if detection['has_foreign'] else None
-        })
+        with trace_context(**segment_trace(segment)):
+            result = await run_llm(_translate_segment, segment)
+        return JsonResponse({'ok': True, **result})
         
     except Exception as e:
         return JsonResponse({
@@ -189,92 +231,73 @@ def translate_segment_view(request, segment_id):
             'error': str(e)
         }, status=400)
 
+
+def _translate_segment(segment: Segment) -> dict:
+    """Phần đồng bộ của translate_segment_view: gọi AI, hậu xử lý, lưu segment, cập nhật tiến độ chapter"""
+    chapter = segment.chapter
+    translator = ChapterTranslator(chapter.volume.novel)
+    
+    # Gọi AI để dịch (tiêu đề chapter + nội dung segment, glossary, các chương trước, phong cách dịch)
+    title_trans, content_trans = translator.translate_request(translator.segment_request(segment))
+    
+    # Sửa câu còn sót ký tự ngoại ngữ + phát hiện (spans dùng lại cho highlight), lưu segment
+    # và tiêu đề vào CHAPTER nếu là segment đầu tiên
+    processed = translator.save_segment(segment, title_trans, content_trans)
+    content_trans = processed['translation']
+    foreign_spans = processed['spans']
+    detection = processed['detection']
+    
+    # Cập nhật progress
+    progress = SegmentProcessor.get_translation_progress(chapter)
+    
+    # Nếu đã dịch xong tất cả, gộp lại
+    if progress['remaining'] == 0:
+        merge_chapter_translation(chapter)
+    
+    return {
+        'translation': content_trans,
+        'title_translation': title_trans if segment.index == 1 else None,
+        'progress': progress,
+        'foreign_detection': detection,
+        'substituted_terms': processed['substituted'],
+        'repaired_sentences': processed['repaired'],
+        'highlighted_text': ForeignCharDetector.highlight_html(content_trans, foreign_spans) if detection['has_foreign'] else None
+    }
+
+
 @require_POST
-def translate_chapter_auto_view(request, chapter_id):
+async def translate_chapter_auto_view(request, chapter_id):
     """
     Dịch toàn bộ chapter (tự động chia segments và dịch)
     Với khả năng re-translate
     """
-    chapter = get_object_or_404(Chapter, pk=chapter_id)
+    chapter = await aget_object_or_404(Chapter.objects.select_related('volume__novel'), pk=chapter_id)
     
     force_retranslate = request.POST.get('force', 'false') == 'true'
     
-    if chapter.translation and not force_retranslate:
+    if chapter.has_translation and not force_retranslate:
         return JsonResponse({
             'ok': False,
             'error': 'Chapter đã được dịch. Dùng "Dịch lại" để dịch lại.',
             'already_translated': True
         }, status=400)
     
+    def translate():
+        # Chia segments (nếu cần), dịch từng segment, hậu xử lý và gộp bản dịch
+        result = ChapterTranslator(chapter.volume.novel).translate_chapter(chapter, force=force_retranslate)
+        return result, chapter.full_translation
+    
     try:
-        # Bước 1: Chia segments nếu chưa có hoặc force
-        if chapter.segments.count() == 0 or force_retranslate:
-            SegmentProcessor.create_segments(chapter)
-        
-        # Bước 2: Lấy context
-        novel = chapter.volume.novel
-        glossary_terms = novel.glossaries.all()
-        glossary_context = "\n".join([
-            f"{g.term_cn} → {g.term_vi}"
-            for g in glossary_terms
-        ])
-        
-        pre_chapters = _get_previous_chapters_context(chapter, limit=3)
-        translation_style = novel.translation_style or ""
-        
-        # Bước 3: Dịch từng segment
-        from .utils.gemini_client import translate_with_gemini
-        
-        translated_count = 0
-        foreign_warnings = []
-        
-        for segment in chapter.segments.all():
-            if segment.translation and not force_retranslate:
-                continue
-            
-            # ✅ THÊM TIÊU ĐỀ CHO SEGMENT ĐẦU TIÊN
-            source_text = f"{chapter.title}\n\n{segment.content_raw}"
-            
-            title_trans, content_trans = translate_with_gemini(
-                source_text=source_text,  # ✅ Đã có tiêu đề
-                glossary_context=glossary_context,
-                pre_chapters=pre_chapters,
-                translation_style=translation_style
-            )
-            
-            segment.translation = content_trans
-            
-            # Lưu tiêu đề vào CHAPTER cho segment đầu tiên
-            chapter.title_translation = title_trans
-            
-            # Phát hiện ký tự ngoại ngữ
-            detection = ForeignCharDetector.detect(content_trans)
-            if detection['has_foreign']:
-                segment.foreign_char_warning = detection['warning_message']
-                foreign_warnings.append(f"Segment {segment.index}: {detection['warning_message']}")
-            else:
-                segment.foreign_char_warning = None
-            
-            segment.save()
-            translated_count += 1
-        
-        # Lưu title translation vào chapter
-        if chapter.title_translation:
-            chapter.save(update_fields=['title_translation'])
-        
-        # Bước 4: Gộp translations
-        _merge_chapter_translation(chapter)
-        
-        # Tổng hợp cảnh báo vào chapter
-        if foreign_warnings:
-            chapter.foreign_char_warning = "\n\n".join(foreign_warnings)
-            chapter.save(update_fields=['foreign_char_warning'])
+        result, translation = await run_llm(translate)
+        foreign_warnings = result['foreign_warnings']
         
         return JsonResponse({
             'ok': True,
-            'message': f'Đã dịch {translated_count} segments',
-            'translation': chapter.translation,
+            'message': f"Đã dịch {result['translated_segments']} segments",
+            'translation': translation,
             'title_translation': chapter.title_translation,
+            'substituted_terms': result['substituted'],
+            'repaired_sentences': result['repaired'],
             'has_foreign_warning': len(foreign_warnings) > 0,
             'foreign_warnings': foreign_warnings
         })
@@ -285,93 +308,119 @@ def translate_chapter_auto_view(request, chapter_id):
             'error': str(e)
         }, status=400)
 
-def _get_previous_chapters_context(chapter: Chapter, limit: int = 3) -> str:
-    """
-    Lấy nội dung các chương trước để làm context
-    """
-    volume = chapter.volume
-    novel = volume.novel
-    
-    # Lấy tất cả chapters trước chapter hiện tại
-    previous_chapters = []
-    
-    for vol in novel.volumes.filter(index__lte=volume.index).order_by('index'):
-        if vol.index < volume.index:
-            # Lấy tất cả chapters của volume trước
-            chapters = vol.chapters.filter(
-                translation__isnull=False
-            ).order_by('index')
-            previous_chapters.extend(chapters)
-        else:
-            # Lấy chapters trước chapter hiện tại trong volume hiện tại
-            chapters = vol.chapters.filter(
-                index__lt=chapter.index,
-                translation__isnull=False
-            ).order_by('index')
-            previous_chapters.extend(chapters)
-    
-    # Lấy N chapters gần nhất
-    previous_chapters = previous_chapters[-limit:] if limit else previous_chapters
-    
-    # Format context
-    context_parts = []
-    for ch in previous_chapters:
-        title = ch.title_translation or ch.title
-        content = ch.translation[:20000]  # Giới hạn 20000 ký tự
-        context_parts.append(f"=== {title} ===\n{content}...")
-    
-    return "\n\n".join(context_parts)
 
-
-def _merge_chapter_translation(chapter: Chapter):
-    """
-    Gộp tất cả translations của segments thành bản dịch hoàn chỉnh
-    Lưu vào chapter.translation
-    """
-    segments = chapter.segments.order_by('index')
-    
-    # Gộp content từ tất cả segments
-    translations = []
-    for segment in segments:
-        if segment.translation:
-            translations.append(segment.translation.strip())
-    
-    chapter.translation = '\n\n'.join(translations)
-    chapter.status = 'translated'
-    
-    # Tổng hợp foreign warnings từ các segments
-    warnings = []
-    for segment in segments:
-        if segment.foreign_char_warning:
-            warnings.append(f"Segment {segment.index}:\n{segment.foreign_char_warning}")
-    
-    if warnings:
-        chapter.foreign_char_warning = "\n\n".join(warnings)
-    else:
-        chapter.foreign_char_warning = None
+@require_POST
+def finalize_chapter_view(request, chapter_id):
+    """Ghi bản dịch ghép từ segments vào chapter (dùng cho chế độ lazy)"""
+    chapter = get_object_or_404(Chapter, pk=chapter_id)
     
-    chapter.save()
+    try:
+        translation = chapter.finalize_translation()
+        return JsonResponse({
+            'ok': True,
+            'message': f'Đã lưu bản dịch chapter ({len(translation)} ký tự)',
+        })
+    except Exception as e:
+        return JsonResponse({
+            'ok': False,
+            'error': str(e)
+        }, status=400)
 
 
 @require_POST  
-def retranslate_segment_view(request, segment_id):
+async def retranslate_segment_view(request, segment_id):
     """
     Endpoint riêng cho việc dịch lại segment
     """
     # Chuyển request sang translate_segment_view với force=true
     request.POST = request.POST.copy()
     request.POST['force'] = 'true'
-    return translate_segment_view(request, segment_id)
+    return await translate_segment_view(request, segment_id)
 
 
 @require_POST
-def retranslate_chapter_view(request, chapter_id):
+async def retranslate_chapter_view(request, chapter_id):
     """
     Endpoint riêng cho việc dịch lại chapter
     """
     request.POST = request.POST.copy()
     request.POST['force'] = 'true'
-    return translate_chapter_auto_view(request, chapter_id)
+    return await translate_chapter_auto_view(request, chapter_id)
+
+
+#==================== STREAMING (SERVER-SENT EVENTS) ====================
+
+def _sse_response(request, events) -> StreamingHttpResponse:
+    """
+    Trả về các event (tên, data) theo định dạng Server-Sent Events
+    Lỗi giữa chừng được gửi thành event 'error' (response đã bắt đầu nên không đổi được status code)
+    Chạy bằng ASGI: events (generator đồng bộ gọi LLM) được đọc trong thread pool LLM, client ngắt kết nối thì dừng dịch
+    """
+    def encode(event, data) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    def stream():
+        try:
+            for event, data in events:
+                yield encode(event, data)
+        except Exception as e:
+            yield encode('error', {'error': str(e)})
+    
+    async def astream():
+        try:
+            async for event, data in iterate_in_thread(events):
+                yield encode(event, data)
+        except Exception as e:
+            yield encode('error', {'error': str(e)})
+    
+    # WSGI (runserver, gunicorn sync) cần iterator đồng bộ
+    response = StreamingHttpResponse(
+        astream() if isinstance(request, ASGIRequest) else stream(),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Không để nginx buffer làm mất tác dụng của streaming
+    return response
+
+
+@require_POST
+async def translate_segment_stream_view(request, segment_id):
+    """
+    Dịch một segment, gửi dần tiêu đề/nội dung về trình duyệt ngay khi model sinh ra (SSE)
+    Bản dịch được hậu xử lý và lưu khi stream kết thúc (giống translate_segment_view)
+    """
+    segment = await aget_object_or_404(Segment.objects.select_related('chapter__volume__novel'), pk=segment_id)
+    
+    if segment.translation and request.POST.get('force', 'false') != 'true':
+        return JsonResponse({
+            'ok': False,
+            'error': 'Segment đã được dịch. Dùng "Dịch lại" để dịch lại.',
+            'already_translated': True
+        }, status=400)
+    
+    translator = await run_llm(ChapterTranslator, segment.chapter.volume.novel)
+    return _sse_response(request, translator.stream_chapter(segment.chapter, segments=[segment]))
+
+
+@require_POST
+async def translate_chapter_stream_view(request, chapter_id):
+    """
+    Dịch lần lượt các segments chưa dịch của chapter (force=true: dịch lại tất cả) và stream kết quả (SSE)
+    Tự động chia segments nếu chưa có, gộp bản dịch chapter khi xong
+    """
+    chapter = await aget_object_or_404(Chapter.objects.select_related('volume__novel'), pk=chapter_id)
+    force = request.POST.get('force', 'false') == 'true'
+    
+    if chapter.has_translation and not force:
+        return JsonResponse({
+            'ok': False,
+            'error': 'Chapter đã được dịch. Dùng "Dịch lại" để dịch lại.',
+            'already_translated': True
+        }, status=400)
+    
+    translator = await run_llm(ChapterTranslator, chapter.volume.novel)
+    return _sse_response(request, translator.stream_chapter(chapter, force=force))
+
 
 #==================== TRANSLATION STYLE VIEW ====================
 @require_POST
@@ -398,37 +447,55 @@ def update_translation_style_view(request, novel_id):
 
 #==================== REVIEW VIEWS ====================
 
+async def _review_segments(segments) -> tuple:
+    """
+    Review các segments đã dịch, tối đa REVIEW_CONCURRENCY request song song, lưu điểm/nhận xét vào từng segment
+    
+    Returns:
+        Tuple (điểm các segment review được, báo cáo từng segment, số segment review lỗi)
+    """
+    semaphore = asyncio.Semaphore(getattr(settings, 'REVIEW_CONCURRENCY', 4))
+    translated = [segment for segment in segments if segment.translation]
+    
+    async def review(segment):
+        async with semaphore:
+            with trace_context(**segment_trace(segment)):
+                return await run_llm(review_translation, segment.content_raw, segment.translation)
+    
+    scores, reports, failed_count = [], [], 0
+    for segment, (score, report) in zip(translated, await asyncio.gather(*map(review, translated))):
+        if score is None:
+            # Gọi AI thất bại: giữ điểm cũ, không tính vào điểm trung bình
+            failed_count += 1
+            reports.append(f"Segment {segment.index}: chưa review được\n{report}")
+            continue
+        segment.match_percent = score
+        segment.review = report
+        await segment.asave(update_fields=['match_percent', 'review', 'updated_at'])
+        scores.append(score)
+        reports.append(f"Segment {segment.index}: {score}%\n{report}")
+    return scores, reports, failed_count
+
+
 @require_POST
-def review_chapter_view(request, chapter_id):
+async def review_chapter_view(request, chapter_id):
     """Review chất lượng dịch của chapter"""
-    chapter = get_object_or_404(Chapter, pk=chapter_id)
+    chapter = await aget_object_or_404(Chapter, pk=chapter_id)
     
     # Review từng segment
-    total_score = 0
-    reviews = []
-    
-    for segment in chapter.segments.all():
-        if segment.translation:
-            score, report = review_translation(
-                segment.content_raw,
-                segment.translation
-            )
-            segment.match_percent = score
-            segment.review = report
-            segment.save()
-            
-            total_score += score
-            reviews.append(f"Segment {segment.index}: {score}%\n{report}")
+    segments = [segment async for segment in chapter.segments.select_related('chapter')]
+    scores, reviews, failed_count = await _review_segments(segments)
     
     # Tính điểm trung bình
-    segment_count = chapter.segments.count()
-    avg_score = total_score / segment_count if segment_count > 0 else 0
+    segment_count = len(segments) - failed_count
+    avg_score = sum(scores) / segment_count if segment_count > 0 else 0
     
-    chapter.match_percent = avg_score
+    if segment_count > 0:
+        chapter.match_percent = avg_score
     chapter.review = "\n\n".join(reviews)
-    chapter.save()
+    await chapter.asave(update_fields=['match_percent', 'review', 'updated_at'])
     
-    return JsonResponse({'ok': True, 'avg_score': round(avg_score, 1)})
+    return JsonResponse({'ok': True, 'avg_score': round(avg_score, 1), 'failed_count': failed_count})
 
 
 def review_chapter_results_view(request, chapter_id):
@@ -484,6 +551,7 @@ def glossary_list_api_view(request, novel_id):
         'term_cn': term.term_cn,
         'term_vi': term.term_vi,
         'note': term.note or '',
+        'needs_review': term.needs_review,
     } for term in page_obj]
     
     return JsonResponse({
@@ -510,8 +578,7 @@ def glossary_list_view(request, novel_id):
     page_obj = paginator.get_page(page_number)
     
     # Thống kê
-    generator = GlossaryGenerator(novel)
-    checkpoint = generator.get_checkpoint()
+    checkpoint = GlossaryRun.checkpoint_for(novel)
     
     context = {
         'novel': novel,
@@ -523,16 +590,29 @@ def glossary_list_view(request, novel_id):
 
 
 @require_POST
-def generate_glossary_view(request, novel_id):
+async def generate_glossary_view(request, novel_id):
     """Tạo glossary tự động từ chapters"""
-    novel = get_object_or_404(Novel, pk=novel_id)
+    novel = await aget_object_or_404(Novel, pk=novel_id)
     
     # Lấy tham số
     from_checkpoint = request.POST.get('from_checkpoint', 'true') == 'true'
+    parallel = request.POST.get('parallel', 'false') == 'true'
+    reconcile = request.POST.get('reconcile', 'false') == 'true'
     
-    try:
+    mode = request.POST.get('mode', 'batch')
+    
+    def generate():
         generator = GlossaryGenerator(novel)
-        summary = generator.generate(start_from_checkpoint=from_checkpoint)
+        if mode == 'mined':
+            return generator.generate_from_candidates()
+        return generator.generate(
+            start_from_checkpoint=from_checkpoint,
+            parallel=parallel,
+            reconcile=reconcile
+        )
+    
+    try:
+        summary = await run_llm(generate)
         
         return JsonResponse({
             'ok': True,
@@ -551,7 +631,7 @@ def reset_glossary_checkpoint_view(request, novel_id):
     novel = get_object_or_404(Novel, pk=novel_id)
     
     generator = GlossaryGenerator(novel)
-    generator.save_checkpoint(0)
+    generator.reset_checkpoint()
     
     return JsonResponse({'ok': True, 'message': 'Đã reset checkpoint về 0'})
 
@@ -627,6 +707,9 @@ def update_glossary_term_view(request, novel_id, term_id):
         
         # Cập nhật giá trị
         setattr(term, field, value if value else None)
+        if field == 'term_vi':
+            # Người dùng đã chọn bản dịch, bỏ đánh dấu xung đột
+            term.needs_review = False
         term.save()
         
         return JsonResponse({'ok': True})
@@ -644,17 +727,16 @@ def review_stats_view(request, novel_id):
     
     # Lấy tất cả chapters đã dịch
     chapters = []
-    for volume in novel.volumes.all().order_by('index'):
-        for chapter in volume.chapters.filter(translation__isnull=False).order_by('index'):
-            chapters.append({
-                'id': chapter.id,
-                'title': chapter.title_translation or chapter.title,
-                'volume_id': volume.id,
-                'volume_index': volume.index,
-                'chapter_index': chapter.index,
-                'match_percent': chapter.match_percent,
-                'review': chapter.review,
-            })
+    for chapter in novel.chapters.translated().select_related('volume').order_by('ordinal'):
+        chapters.append({
+            'id': chapter.id,
+            'title': chapter.title_translation or chapter.title,
+            'volume_id': chapter.volume.id,
+            'volume_index': chapter.volume.index,
+            'chapter_index': chapter.index,
+            'match_percent': chapter.match_percent,
+            'review': chapter.review,
+        })
     
     # Tính thống kê
     reviewed_chapters = [ch for ch in chapters if ch['match_percent'] > 0]
@@ -671,45 +753,39 @@ def review_stats_view(request, novel_id):
 
 
 @require_POST
-def review_all_chapters_view(request, novel_id):
+async def review_all_chapters_view(request, novel_id):
     """Review tất cả chapters đã dịch của novel"""
-    novel = get_object_or_404(Novel, pk=novel_id)
+    novel = await aget_object_or_404(Novel, pk=novel_id)
+    chapters = Chapter.objects.filter(volume__novel=novel).translated().order_by('volume__index', 'index')
     
     try:
         reviewed_count = 0
         total_score = 0
+        failed_count = 0
         
-        for volume in novel.volumes.all():
-            for chapter in volume.chapters.filter(translation__isnull=False):
-                # Review từng segment
-                segment_scores = []
-                
-                for segment in chapter.segments.all():
-                    if segment.translation:
-                        score, report = review_translation(
-                            segment.content_raw,
-                            segment.translation
-                        )
-                        segment.match_percent = score
-                        segment.review = report
-                        segment.save()
-                        segment_scores.append(score)
+        async for chapter in chapters:
+            # Review từng segment
+            segment_scores, _reports, failed = await _review_segments(
+                [segment async for segment in chapter.segments.select_related('chapter')]
+            )
+            failed_count += failed
+            
+            # Tính điểm trung bình cho chapter
+            if segment_scores:
+                avg_score = sum(segment_scores) / len(segment_scores)
+                chapter.match_percent = avg_score
+                await chapter.asave(update_fields=['match_percent', 'updated_at'])
                 
-                # Tính điểm trung bình cho chapter
-                if segment_scores:
-                    avg_score = sum(segment_scores) / len(segment_scores)
-                    chapter.match_percent = avg_score
-                    chapter.save()
-                    
-                    total_score += avg_score
-                    reviewed_count += 1
+                total_score += avg_score
+                reviewed_count += 1
         
         avg_score = total_score / reviewed_count if reviewed_count > 0 else 0
         
         return JsonResponse({
             'ok': True,
             'reviewed_count': reviewed_count,
-            'avg_score': round(avg_score, 1)
+            'avg_score': round(avg_score, 1),
+            'failed_count': failed_count
         })
         
     except Exception as e:
@@ -720,34 +796,28 @@ def review_all_chapters_view(request, novel_id):
 
 
 @require_POST
-def review_volume_view(request, volume_id):
+async def review_volume_view(request, volume_id):
     """Review tất cả chapters trong một volume"""
-    volume = get_object_or_404(Volume, pk=volume_id)
+    volume = await aget_object_or_404(Volume, pk=volume_id)
+    chapters = volume.chapters.translated()
     
     try:
         reviewed_count = 0
         total_score = 0
+        failed_count = 0
         
-        for chapter in volume.chapters.filter(translation__isnull=False):
+        async for chapter in chapters:
             # Review từng segment
-            segment_scores = []
-            
-            for segment in chapter.segments.all():
-                if segment.translation:
-                    score, report = review_translation(
-                        segment.content_raw,
-                        segment.translation
-                    )
-                    segment.match_percent = score
-                    segment.review = report
-                    segment.save()
-                    segment_scores.append(score)
+            segment_scores, _reports, failed = await _review_segments(
+                [segment async for segment in chapter.segments.select_related('chapter')]
+            )
+            failed_count += failed
             
             # Tính điểm trung bình cho chapter
             if segment_scores:
                 avg_score = sum(segment_scores) / len(segment_scores)
                 chapter.match_percent = avg_score
-                chapter.save()
+                await chapter.asave(update_fields=['match_percent', 'updated_at'])
                 
                 total_score += avg_score
                 reviewed_count += 1
@@ -757,7 +827,8 @@ def review_volume_view(request, volume_id):
         return JsonResponse({
             'ok': True,
             'reviewed_count': reviewed_count,
-            'avg_score': round(avg_score, 1)
+            'avg_score': round(avg_score, 1),
+            'failed_count': failed_count
         })
         
     except Exception as e:
@@ -765,7 +836,8 @@ def review_volume_view(request, volume_id):
             'ok': False,
             'error': str(e)
         }, status=400)
-    
+
+
 #==================== EXPORT / IMPORT VIEWS ====================
 
 def export_novel_yaml_view(request, novel_id):
@@ -926,8 +998,9 @@ def highlight_foreign_chars_view(request, segment_id):
         }, status=400)
     
     # Highlight foreign characters
-    highlighted = ForeignCharDetector.highlight_html(segment.translation)
-    detection = ForeignCharDetector.detect(segment.translation)
+    foreign_spans = ForeignCharDetector.scan(segment.translation)
+    highlighted = ForeignCharDetector.highlight_html(segment.translation, foreign_spans)
+    detection = ForeignCharDetector.detect(segment.translation, foreign_spans)
     
     return JsonResponse({
         'ok': True,
@@ -936,6 +1009,60 @@ def highlight_foreign_chars_view(request, segment_id):
         'detection': detection
     })
 
+@require_POST
+def scan_foreign_chars_view(request, novel_id):
+    """
+    Quét lại ký tự ngoại ngữ cho toàn bộ segments của novel (background job)
+    Theo dõi tiến độ qua job_status_view
+    """
+    novel = get_object_or_404(Novel, pk=novel_id)
+    
+    try:
+        job_id = start_job('scan_foreign_chars', scan_segments, novel)
+        return JsonResponse({'ok': True, 'job_id': job_id})
+    except Exception as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=500)
+
+
+@require_POST
+def translate_novel_view(request, novel_id):
+    """
+    Dịch các chapters chưa dịch của novel (background job)
+    - pack=true (mặc định): gộp các chapters ngắn liên tiếp vào chung một request
+    Theo dõi tiến độ qua job_status_view
+    """
+    novel = get_object_or_404(Novel, pk=novel_id)
+    pack = request.POST.get('pack', 'true') == 'true'
+    
+    try:
+        job_id = start_job('translate_novel', translate_novel, novel, pack=pack)
+        return JsonResponse({'ok': True, 'job_id': job_id})
+    except Exception as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=500)
+
+
+@require_POST
+def prepare_novel_view(request, novel_id):
+    """
+    Chia segments cho toàn bộ chapters chưa có segments của novel (background job)
+    Theo dõi tiến độ qua job_status_view
+    """
+    novel = get_object_or_404(Novel, pk=novel_id)
+    
+    try:
+        job_id = start_job('prepare_novel', prepare_novel, novel)
+        return JsonResponse({'ok': True, 'job_id': job_id})
+    except Exception as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=500)
+
+
+def job_status_view(request, job_id):
+    """Trạng thái background job"""
+    job = get_job(job_id)
+    if job is None:
+        return JsonResponse({'ok': False, 'error': 'Job không tồn tại hoặc đã hết hạn'}, status=404)
+    return JsonResponse({'ok': True, 'job': job})
+
 # ==================== NOVEL CRUD ====================
 
 def novel_create_view(request):
@@ -1066,10 +1193,12 @@ def volume_edit_view(request, volume_id):
 def volume_delete_view(request, volume_id):
     """Xóa volume"""
     volume = get_object_or_404(Volume, pk=volume_id)
-    novel_id = volume.novel.id
+    novel = volume.novel
+    novel_id = novel.id
     index = volume.index
     
     volume.delete()
+    novel.reindex_chapters()
     messages.success(request, f'✅ Đã xóa Volume {index}')
     return redirect('core:novel_detail', novel_id=novel_id)
 
@@ -1145,8 +1274,10 @@ def chapter_delete_view(request, chapter_id):
     """Xóa chapter"""
     chapter = get_object_or_404(Chapter, pk=chapter_id)
     volume_id = chapter.volume.id
+    novel = chapter.volume.novel
     index = chapter.index
     
     chapter.delete()
+    novel.reindex_chapters()
     messages.success(request, f'✅ Đã xóa Chapter {index}')
     return redirect('core:volume_detail', volume_id=volume_id)
\ No newline at end of file
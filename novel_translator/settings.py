@@ -131,4 +131,137 @@ CACHES = {
 }
 
 # Gemini API Keys for translation and review
-GEMINI_DEFAULT_MODEL = 'gemini-2.0-flash'
\ No newline at end of file
+GEMINI_DEFAULT_MODEL = 'gemini-2.0-flash'
+
+# Model dùng để dịch segments
+TRANSLATION_MODEL = 'gemini-2.5-pro'
+
+# Giới hạn token của từng model: context (input + output), output (gồm cả thinking), thinking (phần dành cho suy luận)
+MODEL_LIMITS = {
+    'gemini-2.5-pro': {'context': 1048576, 'output': 65536, 'thinking': 32768},
+    'gemini-2.5-flash': {'context': 1048576, 'output': 65536, 'thinking': 24576},
+    'gemini-2.0-flash': {'context': 1048576, 'output': 8192, 'thinking': 0},
+}
+
+# Số token bản dịch tiếng Việt ước tính cho mỗi token bản gốc (để segment không bị cắt output)
+TRANSLATION_OUTPUT_RATIO = 1.8
+
+# Giới hạn trên số token bản gốc mỗi segment (None = chỉ theo giới hạn model)
+SEGMENT_MAX_TOKENS = None
+
+# Dịch hàng loạt: gộp các chapters ngắn (<= TRANSLATION_PACK_CHAPTER_TOKENS token) liên tiếp vào chung một request
+# (tối đa TRANSLATION_PACK_MAX_CHAPTERS chapters, tổng không vượt token budget của model)
+TRANSLATION_PACK_CHAPTER_TOKENS = 2000
+TRANSLATION_PACK_MAX_CHAPTERS = 8
+
+# Chế độ lưu bản dịch chapter:
+# - 'eager': ghép và ghi chapter.translation mỗi khi dịch xong chapter
+# - 'lazy': chỉ ghép từ segments khi hiển thị/export, ghi DB khi finalize
+CHAPTER_TRANSLATION_MODE = 'eager'
+
+# Số request song song tối đa khi tạo glossary ở chế độ parallel
+GLOSSARY_PARALLEL_WORKERS = 4
+
+# Tự động sửa các câu còn sót ký tự ngoại ngữ sau khi dịch (chỉ gửi các câu lỗi cho AI)
+FOREIGN_CHAR_REPAIR = True
+FOREIGN_CHAR_REPAIR_MODEL = 'gemini-2.5-flash'
+
+# Retry / failover khi gọi LLM (xem core/utils/resilience.py)
+LLM_MAX_RETRIES = 4  # Số lần thử lại tối đa cho mỗi request
+LLM_BACKOFF_BASE = 2.0  # Giây, chờ ngẫu nhiên trong [0, base * 2^lần_thử] (full jitter)
+LLM_BACKOFF_MAX = 60.0  # Giây, chờ tối đa giữa hai lần thử (mọi key bị khóa lâu hơn thì báo lỗi ngay)
+LLM_BREAKER_THRESHOLD = 3  # Số lỗi liên tiếp của một key trước khi tạm khóa key
+LLM_BREAKER_COOLDOWN = 300  # Giây khóa key khi lỗi liên tiếp hoặc key không hợp lệ
+LLM_RATE_LIMIT_COOLDOWN = 60  # Giây khóa key khi bị rate limit (nếu server không gợi ý retryDelay)
+
+# Provider LLM cho dịch/review (core/utils/llm_providers.py), chỉ provider có API key active trong bảng APIKey mới được dùng
+# - models: model theo task ('translate', 'translate_fast' (tầng nhanh của TRANSLATION_CASCADE), 'review')
+# - openai.base_url: endpoint OpenAI-compatible (None = api.openai.com; VD DeepSeek, vLLM, Ollama)
+# - anthropic.max_tokens: giới hạn output mỗi request (bắt buộc với Messages API)
+LLM_PROVIDERS = {
+    'gemini': {'models': {'translate': TRANSLATION_MODEL, 'translate_fast': 'gemini-2.5-flash', 'review': 'gemini-2.5-flash'}},
+    'openai': {'base_url': None, 'models': {'translate': 'gpt-4o', 'translate_fast': 'gpt-4o-mini', 'review': 'gpt-4o-mini'}},
+    'anthropic': {
+        'models': {'translate': 'claude-sonnet-4-20250514', 'translate_fast': 'claude-3-5-haiku-latest', 'review': 'claude-3-5-haiku-latest'},
+        'max_tokens': 32000,
+    },
+}
+
+# Giá (USD / 1 triệu token input, output[, input đọc từ context cache]) để router ước tính chi phí; model không có ở đây coi như miễn phí
+LLM_PRICES = {
+    'gemini-2.5-pro': (1.25, 10.0, 0.31),
+    'gemini-2.5-flash': (0.30, 2.50, 0.075),
+    'gemini-2.0-flash': (0.10, 0.40, 0.025),
+    'gpt-4o': (2.50, 10.0, 1.25),
+    'gpt-4o-mini': (0.15, 0.60, 0.075),
+    'claude-sonnet-4-20250514': (3.0, 15.0, 0.30),
+    'claude-3-5-haiku-latest': (0.80, 4.0, 0.08),
+}
+LLM_CACHED_INPUT_RATIO = 0.25  # Giá token đọc từ context cache / giá input khi LLM_PRICES không ghi giá cache
+
+# Context cache (core/utils/context_cache.py): phần đầu prompt dịch cố định theo novel (vai trò, phong cách, glossary)
+# được cache ở provider, các segment sau chỉ gửi phần thay đổi; glossary/phong cách đổi thì tự dùng cache mới
+CONTEXT_CACHE = True
+CONTEXT_CACHE_TTL = 3600  # Giây, được gia hạn khi còn dùng
+CONTEXT_CACHE_MIN_TOKENS = 2048  # Prefix ngắn hơn thì không cache (Gemini yêu cầu tối thiểu 1024-4096 token tùy model)
+
+# Router chọn provider (core/utils/llm_router.py): điểm = tổng có trọng số của độ trễ, tỉ lệ lỗi, chi phí (thấp hơn được chọn)
+LLM_ROUTER_WEIGHTS = {'latency': 1.0, 'errors': 2.0, 'cost': 1.0}
+LLM_ROUTER_EWMA_ALPHA = 0.2  # Trọng số của số liệu mới nhất trong trung bình trượt
+LLM_ROUTER_EXPLORE = 0.05  # Tỉ lệ request thử provider ngẫu nhiên để cập nhật số liệu
+
+# LLM giả lập cho benchmark/load test không cần API key (core/utils/fake_llm.py), None = tắt
+# Bật: {} (mặc định) hoặc VD {'latency_median': 0.5, 'error_rate': 0.02, 'rate_limit_every': 100, 'rate_limit_burst': 5, 'seed': 1}
+# Thay thế mọi Gemini client (dịch, review, glossary, stream); provider khác dùng: python manage.py llm_stub_server
+LLM_FAKE = None
+
+# Dịch theo tầng (core/utils/cascade.py): model 'translate_fast' dịch trước, chỉ bản không đạt kiểm tra cục bộ
+# mới dịch lại bằng model 'translate'; thống kê theo novel trong TranslationCascadeStats (không áp dụng cho stream)
+TRANSLATION_CASCADE = False
+TRANSLATION_CASCADE_MAX_FOREIGN = 5  # Số ký tự ngoại ngữ còn sót tối đa
+TRANSLATION_CASCADE_GLOSSARY_MISS = 0.2  # Tỉ lệ tối đa thuật ngữ (có trong bản gốc) không dùng đúng bản dịch glossary
+TRANSLATION_CASCADE_LENGTH_RATIO = (0.8, 3.5)  # Khoảng hợp lệ của token bản dịch / token bản gốc
+
+# Dịch offline qua batch API (core/utils/batch_translator.py, python manage.py translate_batch)
+BATCH_TRANSLATION_PROVIDER = 'gemini'  # gemini, openai hoặc local (giả lập bằng file, không cần mạng)
+BATCH_TRANSLATION_DIR = BASE_DIR / 'batch_jobs'  # File JSONL input/output của các job
+BATCH_TRANSLATION_POLL_INTERVAL = 60  # Giây giữa các lần hỏi trạng thái job
+LLM_BATCH_PRICE_RATIO = 0.5  # Giá batch / giá LLM_PRICES khi tính chi phí (Gemini/OpenAI batch rẻ hơn ~50%)
+
+# Trace mọi lần gọi LLM (core/utils/llm_tracing.py): thao tác, novel/chapter/segment, provider, model, key,
+# token theo usage metadata, độ trễ, số lần thử lại, kết quả -> bảng LLMCallLog (admin) và logger 'core.llm_calls'
+LLM_TRACE = True  # False = chỉ ghi logger, không ghi bảng LLMCallLog (không có thống kê token/chi phí theo novel, key)
+LLM_TRACE_SAMPLE_RATE = 0.02  # Tỉ lệ request lưu nội dung prompt/response (request lỗi luôn được lưu)
+LLM_TRACE_SAMPLE_CHARS = 2000  # Số ký tự tối đa lưu cho mỗi prompt/response
+LLM_TRACE_LOG_FILE = None  # VD BASE_DIR / 'logs' / 'llm_calls.jsonl': ghi thêm mỗi lần gọi một dòng JSON (xoay vòng 10MB x 5)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {},
+    'loggers': {
+        # Mặc định không in ra console (mỗi lần gọi LLM một dòng), chỉ ghi file khi đặt LLM_TRACE_LOG_FILE
+        'core.llm_calls': {'handlers': [], 'level': 'INFO', 'propagate': False},
+    },
+}
+if LLM_TRACE_LOG_FILE:
+    Path(LLM_TRACE_LOG_FILE).parent.mkdir(parents=True, exist_ok=True)
+    LOGGING['handlers']['llm_calls_file'] = {
+        'class': 'logging.handlers.RotatingFileHandler',
+        'filename': LLM_TRACE_LOG_FILE,
+        'maxBytes': 10 * 1024 * 1024,
+        'backupCount': 5,
+        'encoding': 'utf-8',
+        'formatter': 'message',
+    }
+    LOGGING['loggers']['core.llm_calls']['handlers'] = ['llm_calls_file']
+
+# Async views (core/utils/async_llm.py) khi chạy bằng ASGI (uvicorn): code gọi LLM chạy trong thread pool riêng
+LLM_ASYNC_THREADS = 16  # Số lần gọi LLM chạy cùng lúc từ các async view
+REVIEW_CONCURRENCY = 4  # Số segment review song song trong một request review
+
+# Trang chapter_detail chỉ render khung segments, nội dung tải dần khi cuộn tới (views.chapter_segments_api_view)
+CHAPTER_SEGMENT_BATCH = 20  # Số segment tối đa mỗi lần tải nội dung